@@ -0,0 +1,125 @@
+# Copyright 2021 Lin Wang
+
+# This code is part of the Advanced Computer Networks course at Vrije
+# Universiteit Amsterdam.
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+
+#   http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Controller-side proxy ARP state for SPRouter. Every ARP packet that reaches
+# the controller teaches it where its sender lives (IP -> DPID, port, MAC), so
+# that later requests for that IP are answered by the controller itself. Only
+# requests for unknown IPs go out to the hosts, at most once per IP and
+# repeat interval, and preferably only through the single port where the
+# addressing plan says the host must be. A periodic expire() keeps both tables
+# bounded by the hosts and unknown IPs seen recently.
+
+import time
+from collections import namedtuple
+
+from fattree_index import HOST
+
+# seconds during which repeated requests for the same unknown IP are dropped
+DEFAULT_REPEAT_INTERVAL = 1.0
+
+# seconds after which a host that has not sent any ARP is forgotten
+DEFAULT_HOST_TIMEOUT = 300.0
+
+HostLocation = namedtuple("HostLocation", ["dpid", "port", "mac", "last_seen"])
+
+
+class ArpProxy:
+
+    def __init__(self, repeat_interval=DEFAULT_REPEAT_INTERVAL, host_timeout=DEFAULT_HOST_TIMEOUT):
+        self.repeat_interval = repeat_interval
+        self.host_timeout = host_timeout
+        self.hosts = {}
+        self.last_flood = {}
+        self.answered = 0
+        self.flooded = 0
+        self.suppressed = 0
+
+    def learn(self, ip, dpid, port, mac, now=None):
+        "Records where ip lives, returns True if the location is new, has moved or had expired"
+        now = time.time() if now is None else now
+        known = self.hosts.get(ip)
+        self.hosts[ip] = HostLocation(dpid, port, mac, now)
+        # the host answered, so there is nothing left to flood for
+        self.last_flood.pop(ip, None)
+        return known is None or now - known.last_seen > self.host_timeout or \
+            (known.dpid, known.port, known.mac) != (dpid, port, mac)
+
+    def lookup(self, ip, now=None):
+        "Returns the HostLocation of ip, or None if it is unknown or has expired"
+        known = self.hosts.get(ip)
+        if known is None:
+            return None
+        now = time.time() if now is None else now
+        # expired hosts stay until expire() hands them to the controller
+        if now - known.last_seen > self.host_timeout:
+            return None
+        return known
+
+    def answer(self, ip, now=None):
+        "Returns the location to answer a request for ip from, counting the hit"
+        known = self.lookup(ip, now)
+        if known is not None:
+            self.answered += 1
+        return known
+
+    def should_flood(self, ip, now=None):
+        "Decides whether a request for an unknown ip may go out to the hosts"
+        now = time.time() if now is None else now
+        last = self.last_flood.get(ip)
+        if last is not None and now - last < self.repeat_interval:
+            self.suppressed += 1
+            return False
+        self.last_flood[ip] = now
+        self.flooded += 1
+        return True
+
+    def expire(self, now=None):
+        """
+        Drops the flood records older than the repeat interval and the hosts
+        that have expired, returning those as (ip, HostLocation)
+        """
+        now = time.time() if now is None else now
+        for ip in [ip for ip, last in self.last_flood.items() if now - last >= self.repeat_interval]:
+            del self.last_flood[ip]
+        return self._drop([ip for ip, known in self.hosts.items() if now - known.last_seen > self.host_timeout])
+
+    def forget_switch(self, dpid):
+        "Drops every host learned behind a switch that left and returns them as (ip, HostLocation)"
+        return self._drop([ip for ip, known in self.hosts.items() if known.dpid == dpid])
+
+    def _drop(self, ips):
+        return [(ip, self.hosts.pop(ip)) for ip in ips]
+
+
+def host_ports(switch_ports, inter_switch_ports):
+    "Returns {dpid: [port]} of the ports that do not lead to another switch"
+    result = {}
+    for dpid, ports in switch_ports.items():
+        result[dpid] = [port for port in ports if (dpid, port) not in inter_switch_ports]
+    return result
+
+
+def fattree_location(index, ip):
+    "Returns the (DPID, port) where a fat-tree host with this address must be, or None"
+    try:
+        node = index.node_of_address(ip)
+    except (KeyError, ValueError):
+        return None
+    if index.layer(node) != HOST:
+        return None
+    edge = index.edge_of(node)
+    return index.dpid(edge), index.port(edge, node)
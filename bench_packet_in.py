@@ -0,0 +1,112 @@
+# Copyright 2021 Lin Wang
+
+# This code is part of the Advanced Computer Networks course at Vrije
+# Universiteit Amsterdam.
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+
+#   http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# !/usr/bin/env python3
+
+# Packet-in classification throughput, e.g.
+#
+#   python3 bench_packet_in.py --packets 200000
+#
+# Replays a mix of ARP, ICMP, TCP and LLDP frames through the old handler
+# front end (full ryu.lib.packet decode plus one get_protocol() call per
+# protocol) and through packet_classifier.classify(), and prints packet-ins
+# per second for both. The old front end is skipped when Ryu is not installed.
+
+import argparse
+import socket
+import struct
+import time
+
+import packet_classifier
+
+try:
+    from ryu.lib.packet import packet, ethernet, ipv4, icmp, arp
+except ImportError:
+    packet = None
+
+
+def _mac(text):
+    return bytes(int(part, 16) for part in text.split(":"))
+
+
+def ethernet_frame(dst, src, eth_type, payload):
+    return _mac(dst) + _mac(src) + struct.pack("!H", eth_type) + payload
+
+
+def arp_request(src_mac, src_ip, dst_ip):
+    body = struct.pack("!HHBBH6s4s6s4s", 1, packet_classifier.ETH_TYPE_IP, 6, 4, 1,
+                       _mac(src_mac), socket.inet_aton(src_ip), bytes(6), socket.inet_aton(dst_ip))
+    return ethernet_frame("ff:ff:ff:ff:ff:ff", src_mac, packet_classifier.ETH_TYPE_ARP, body)
+
+
+def ipv4_frame(src_mac, dst_mac, src_ip, dst_ip, proto, payload):
+    header = struct.pack("!BBHHHBBH4s4s", 0x45, 0, 20 + len(payload), 0, 0, 64, proto, 0,
+                         socket.inet_aton(src_ip), socket.inet_aton(dst_ip))
+    return ethernet_frame(dst_mac, src_mac, packet_classifier.ETH_TYPE_IP, header + payload)
+
+
+def sample_frames():
+    "Returns one frame of every kind the controller sees"
+    host_a, host_b = "00:00:00:00:00:01", "00:00:00:00:00:02"
+    icmp_echo = struct.pack("!BBHHH", 8, 0, 0, 1, 1) + bytes(56)
+    tcp_syn = struct.pack("!HHIIBBHHH", 40000, 5001, 1, 0, 5 << 4, 0x02, 65535, 0, 0)
+    lldp = bytes(32)
+    return [
+        arp_request(host_a, "10.0.0.2", "10.0.0.3"),
+        ipv4_frame(host_a, host_b, "10.0.0.2", "10.0.0.3", 1, icmp_echo),
+        ipv4_frame(host_a, host_b, "10.0.0.2", "10.1.0.2", 6, tcp_syn),
+        ethernet_frame("01:80:c2:00:00:0e", host_a, packet_classifier.ETH_TYPE_LLDP, lldp),
+    ]
+
+
+def full_decode(data):
+    # what the handler used to do for every packet-in
+    read_packet = packet.Packet(data)
+    read_packet.get_protocol(ipv4.ipv4)
+    read_packet.get_protocol(ethernet.ethernet)
+    read_packet.get_protocol(icmp.icmp)
+    read_packet.get_protocol(arp.arp)
+
+
+def rate(function, frames, count):
+    "Returns calls per second of function over count frames, cycling through frames"
+    start = time.perf_counter()
+    for number in range(count):
+        function(frames[number % len(frames)])
+    return count / (time.perf_counter() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark packet-in classification")
+    parser.add_argument("--packets", default=100000, type=int,
+                        help="packet-ins to classify per variant (default: 100000)")
+    args = parser.parse_args(argv)
+
+    frames = sample_frames()
+    fast = rate(packet_classifier.classify, frames, args.packets)
+    if packet is None:
+        print("full decode: skipped, Ryu is not installed")
+    else:
+        full = rate(full_decode, frames, args.packets)
+        print("full decode: %12.0f packet-ins/s" % full)
+    print("classifier:  %12.0f packet-ins/s" % fast)
+    if packet is not None:
+        print("speedup:     %12.1fx" % (fast / full))
+
+
+if __name__ == "__main__":
+    main()
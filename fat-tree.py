@@ -1,6 +1,6 @@
 # Copyright 2021 Lin Wang
 
-# This code is part of the Advanced Computer Networks course at VU 
+# This code is part of the Advanced Computer Networks course at VU
 # Amsterdam.
 
 # Licensed under the Apache License, Version 2.0 (the "License"); you may not
@@ -15,10 +15,24 @@
 
 # !/usr/bin/env python3
 
-# A dirty workaround to import topo.py from lab2
-
+# Builds a k-ary fat-tree in Mininet and attaches it to a remote controller, e.g.
+#
+#   sudo python3 fat-tree.py --k 8 --controller 127.0.0.1:6653
+#
+# Switches, hosts, addresses, DPIDs and port numbers all come from
+# fattree_index.FattreeIndex, so the fabric matches what SPRouter expects
+# without building any intermediate graph.
+#
+# Link setup:
+#   batch   links are created as plain veth pairs, and the shaping of all of
+#           them is applied afterwards with one "tc -batch" run for the switch
+#           side and one per host
+#   tclink  every link is a TCLink that runs its own tc commands as it is
+#           created (the old behaviour, slow from k=8 on)
+
+import argparse
 import os
-import subprocess
+import tempfile
 import time
 
 import mininet
@@ -26,54 +40,21 @@ import mininet.clean
 from mininet.net import Mininet
 from mininet.cli import CLI
 from mininet.log import lg, info
-from mininet.link import TCLink
-from mininet.node import Node, OVSKernelSwitch, RemoteController
+from mininet.link import Link, TCLink
+from mininet.node import OVSKernelSwitch, RemoteController
 from mininet.topo import Topo
-from mininet.util import waitListening, custom
-
-
-# import topo
-
-class Edge:
-    def __init__(self):
-        self.lnode = None
-        self.rnode = None
-
-    def remove(self):
-        self.lnode.edges.remove(self)
-        self.rnode.edges.remove(self)
-        self.lnode = None
-        self.rnode = None
+from mininet.util import quietRun
 
+from fattree_index import FattreeIndex
 
-# Class for a node in the graph
-class NodeLab:
-    def __init__(self, id, type):
-        self.edges = []
-        self.id = id
-        self.type = type
+# bandwidth in Mbit/s, delay as understood by netem
+LINK_PROFILES = {
+    "lab": dict(bw=15, delay="5ms"),
+    "gigabit": dict(bw=1000, delay="50us"),
+    "unshaped": {},
+}
 
-    # Add an edge connected to another node
-    def add_edge(self, node):
-        edge = Edge()
-        edge.lnode = self
-        edge.rnode = node
-        self.edges.append(edge)
-        node.edges.append(edge)
-        return edge
-
-
-    # Remove an edge from the node
-    def remove_edge(self, edge):
-        self.edges.remove(edge)
-
-
-    # Decide if another node is a neighbor
-    def is_neighbor(self, node):
-        for edge in self.edges:
-            if edge.lnode == node or edge.rnode == node:
-                return True
-        return False
+LINK_SETUPS = ("batch", "tclink")
 
 
 class FattreeNet(Topo):
@@ -81,220 +62,149 @@ class FattreeNet(Topo):
     Create a fat-tree network in Mininet
     """
 
-    def __init__(self, given_ports):
-        Topo.__init__(self)
-        self.servers = []
-        self.switches_lab = []
-        self.num_ports = given_ports
-        self.edge_switch_list = {}
-        self.aggregation_switch_list = {}
-        self.core_switch_list = {}
-        self.edge_topo = {}
-        self.aggregation_topo = {}
-        self.core_topo = {}
-        self.host_topo = {}
-        self.switch_topo = {}
-        self.server_list = {}
-        self.fat_edge_set = set()
-
-
-        # TODO: please complete the network generation logic here
-        # k = self.num_ports
-        info("--------------------------------------------------")
-        #self.num_ports = 2
-        pod_count = self.num_ports
-        each_type_switches_in_pod = self.num_ports // 2
-        core_layer_switch_count = (self.num_ports // 2) ** 2
-        info("\nTotal core switches used in this topology: ", core_layer_switch_count)
-        aggregation_layer_switch_count = self.num_ports * (self.num_ports // 2)
-        info("\nTotal aggregation switches used in this topology: ", aggregation_layer_switch_count)
-        edge_layer_switch_count = self.num_ports * (self.num_ports // 2)
-        info("\nTotal edge switches used in this topology: ", edge_layer_switch_count)
-        total_servers_count = self.num_ports * ((self.num_ports // 2) ** 2)
-        info("\nTotal number of hosts used in this topology: ", total_servers_count)
-        total_switch_count = core_layer_switch_count + aggregation_layer_switch_count + edge_layer_switch_count
-        info("\nTotal switches used in this topology: ", total_switch_count)
-        info("\n--------------------------------------------------")
-        # self.edge_switch_list = self.aggregation_switch_list = self.core_switch_list = self.server_list = {}
-        # creating dictionary above for storing mapping
-        current_switch_count = 0
-        current_server_count = 0
-
-        # few interesting properties to consider
-        # Each edge switch connects to (k/2) nodes and k/2 aggregation switches within same pod
-        # Each aggregation switch connects to (k/2) edge switches from same pod, and k/2 core switches
-        # Each core switch connects to only one aggregation switch (randomly, first for simplicity) in a given pod
-
-        i = 0  # pod-count
-        j = 0  # switch-count
-        # creating edge switches
-        for iterator in range(edge_layer_switch_count):
-            # self.edge_switch_list.append("s" + str(iterator))
-            self.switches_lab.append("s" + str(current_switch_count))
-            if ((iterator % (self.num_ports // 2)) == 0 and iterator != 0):
-                i += 1
-                j = 0
-            elif iterator != 0:
-                j += 1
-            self.edge_switch_list.update({"edge" + str(iterator): NodeLab("s" + str(current_switch_count),
-                                                                       "10." + str(i) + "." + str(j) + ".1")})
-            self.switch_topo.update({"edge" + str(iterator): self.addSwitch("s" + str(current_switch_count))})
-            #self.edge_topo.update({"edge" + str(iterator): self.switch_topo["edge" + str(iterator)]})
-            info("\nEdge switch", current_switch_count,
-                 "; IP-Address = ", self.edge_switch_list["edge" + str(iterator)].type)
-
-            current_switch_count += 1
-
-        i = 0  # pod-count
-        j = 0  # switch-count
-        # creating aggregation switches
-        for iterator in range(aggregation_layer_switch_count):
-            # self.edge_switch_list.append("s" + str(iterator))
-            self.switches_lab.append("s" + str(current_switch_count))
-            if ((iterator % (self.num_ports // 2)) == 0 and iterator != 0):
-                i += 1
-                j = (self.num_ports // 2)
-            elif iterator != 0:
-                j += 1
+    def build(self, index, linkopts=None):
+        self.index = index
+        linkopts = linkopts or {}
+        for switch in index.switches():
+            self.addSwitch(index.name(switch), dpid="%016x" % index.dpid(switch))
+        for host in index.hosts():
+            self.addHost(index.name(host), ip=index.address(host))
+        # explicit port numbers, port i + 1 of a node leads to its i-th neighbor
+        for upper, lower in index.links():
+            self.addLink(index.name(upper), index.name(lower),
+                         port1=index.port(upper, lower), port2=index.port(lower, upper), **linkopts)
+
+
+def tc_commands(device, bw=None, delay=None, loss=None, max_queue_size=None):
+    "Returns the tc batch lines (without the leading tc) that TCIntf would run for one interface"
+    commands = []
+    parent = "root"
+    if bw is not None:
+        commands.append("qdisc replace dev %s root handle 5:0 htb default 1" % device)
+        commands.append("class add dev %s parent 5:0 classid 5:1 htb rate %fMbit burst 15k" % (device, bw))
+        parent = "parent 5:1"
+    netem = []
+    if delay is not None:
+        netem.append("delay %s" % delay)
+    if loss:
+        netem.append("loss %.4f%%" % loss)
+    if max_queue_size is not None:
+        netem.append("limit %d" % max_queue_size)
+    if netem:
+        verb = "add" if bw is not None else "replace"
+        commands.append("qdisc %s dev %s %s handle 10: netem %s" % (verb, device, parent, " ".join(netem)))
+    return commands
+
+
+def run_tc_batch(commands, node=None):
+    "Runs tc commands in one tc process, in the namespace of node or the root namespace"
+    if not commands:
+        return ""
+    with tempfile.NamedTemporaryFile("w", prefix="fattree-tc-", suffix=".batch", delete=False) as batch:
+        batch.write("\n".join(commands) + "\n")
+    try:
+        command = "tc -force -batch %s" % batch.name
+        return node.cmd(command) if node is not None else quietRun(command)
+    finally:
+        os.unlink(batch.name)
+
+
+def shape_links(net, linkopts):
+    """
+    Shapes both ends of every link of a built network, batched per network
+    namespace. OVS kernel switches share the root namespace, so all switch
+    interfaces take a single tc run
+    """
+    if not linkopts:
+        return 0
+    root_commands = []
+    host_commands = {}
+    for link in net.links:
+        for intf in (link.intf1, link.intf2):
+            commands = tc_commands(intf.name, **linkopts)
+            if intf.node.inNamespace:
+                host_commands.setdefault(intf.node, []).extend(commands)
             else:
-                j = (self.num_ports // 2)
-            self.aggregation_switch_list.update(
-                {"aggregator" + str(iterator): NodeLab("s" + str(current_switch_count),
-                                                    "10." + str(i) + "." + str(j) + ".1")})
-            self.switch_topo.update({"aggregator" + str(iterator): self.addSwitch("s" + str(current_switch_count))})
-            #self.aggregation_topo.update({"aggregator" + str(iterator):self.switch_topo["aggregator" + str(iterator)]})
-            info("\nAggregator switch ", current_switch_count,
-                 "; IP-Address = ", self.aggregation_switch_list["aggregator" + str(iterator)].type)
-            current_switch_count += 1
-
-        i = 0  # core's ith position for ip-address
-        j = 1  # core's jth position for ip-address
-        # creating core switches
-        for iterator in range(0, core_layer_switch_count):
-            # self.core_switch_list.append("s" + str(iterator))
-            self.switches_lab.append("s" + str(current_switch_count))
-            if ((iterator) % (self.num_ports // 2) == 0):
-                i += 1
-                j = 1
-            self.core_switch_list.update({"core" + str(iterator): NodeLab("s" + str(current_switch_count),
-                                                                       "10." + str(self.num_ports) + "." + str(
-                                                                           i) + "." + str(j))})
-            self.switch_topo.update({"core" + str(iterator): self.addSwitch("s" + str(current_switch_count))})
-            #self.core_topo.update({"core" + str(iterator): self.switch_topo["core" + str(iterator)]})
-            info("\nCore switch ", current_switch_count, "; IP-Address = ",
-                 self.core_switch_list["core" + str(iterator)].type)
-
-            j += 1
-            current_switch_count += 1
-
-        i = 0  # pod-count
-        j = 0  # switch-count
-        k = 2  # host-count, always start with 2 (as ip-octet value 1 is occupied by switch)
-        # creating hosts
-        for host_iterator in range(total_servers_count):
-            if (host_iterator % self.num_ports == 0 and host_iterator != 0):
-                i += 1
-                j = 0
-                k = 2
-            elif ((host_iterator % (self.num_ports // 2)) == 0 and host_iterator != 0):
-                j += 1
-                k = 2
-
-            self.server_list.update({"host" + str(host_iterator): NodeLab("h" + str(current_switch_count),
-                                                                       "10." + str(i) + "." + str(j) + "." + str(k))})
-            self.servers.append("h" + str(current_server_count))
-            self.host_topo.update({"host" + str(host_iterator): self.addHost("h" + str(current_server_count),
-                                                                             ip="10." + str(i) + "." + str(
-                                                                                 j) + "." + str(k))})
-            info("\nHost ", current_server_count, "; IP-Address = ", self.server_list["host" + str(host_iterator)].type)
-            k += 1
-            current_server_count += 1
-
-        current_server_count = 0
-        host_switch_linkopts = dict(bw=15, delay='5ms')
-
-        # iterating the edge switches and adding link with hosts first
-        for iterator in range(0, edge_layer_switch_count):
-
-            for host_iterator in range(current_server_count, current_server_count + (self.num_ports // 2)):
-                temp_edge = self.edge_switch_list["edge" + str(iterator)].add_edge(
-                    self.server_list["host" + str(host_iterator)])
-                self.edge_switch_list["edge" + str(iterator)].edges.append(temp_edge)
-                self.fat_edge_set.add((temp_edge.lnode.id, temp_edge.rnode.id))
-                info("\nConnected edge switch ", self.switch_topo["edge" + str(iterator)], "to the host ",
-                       self.host_topo["host" + str(host_iterator)])
-                self.addLink(self.host_topo["host" + str(host_iterator)], self.switch_topo["edge" + str(iterator)],
-                             **host_switch_linkopts)
-                current_server_count += 1
-
-        current_pod = 0
-        # print("Switch Count ", current_switch_count)
-
-        # iterating the aggregator switches and adding links with edge switches and core switches
-        for iterator in range(0, aggregation_layer_switch_count):
-
-            self.aggregation_switch_list.update(
-                {"aggregator" + str(iterator): NodeLab("s" + str(current_switch_count), "aggregator")})
-
-            # print("POD ", current_pod)
-            if iterator % (self.num_ports // 2) == 0 and iterator != 0:
-                current_pod += 1
-                #print("\nPOD ", current_pod)
-
-            # link edge switches
-            for edge_iterator in range(current_pod * (self.num_ports // 2),
-                                       (current_pod * (self.num_ports // 2)) + (self.num_ports // 2)):
-                temp_edge = self.aggregation_switch_list["aggregator" + str(iterator)].add_edge(
-                    self.edge_switch_list["edge" + str(edge_iterator)])
-                self.aggregation_switch_list["aggregator" + str(iterator)].edges.append(temp_edge)
-                # print("\nConnected aggregator switch ", self.aggregation_topo["aggregator" + str(iterator)],
-                #        "to the edge switch ",
-                #        self.edge_topo["edge" + str(edge_iterator)])
-                self.fat_edge_set.add((temp_edge.lnode.id, temp_edge.rnode.id))
-                self.addLink(self.switch_topo["aggregator" + str(iterator)],
-                             self.switch_topo["edge" + str(edge_iterator)],
-                             **host_switch_linkopts)
-
-            # link core switches
-            core_aggregate_connection = 0  # checks for the k/2 connections between core and aggregator
-            for core_iterator in range((iterator * self.num_ports // 2) % core_layer_switch_count,
-                                       core_layer_switch_count):
-                # ((iterator) * (self.num_ports // 2)) % (core_layer_switch_count)):
-                temp_edge = self.aggregation_switch_list["aggregator" + str(iterator)].add_edge(
-                    self.core_switch_list["core" + str(core_iterator)])
-                self.aggregation_switch_list["aggregator" + str(iterator)].edges.append(temp_edge)
-                # print("\nConnected aggregator switch ", self.aggregation_topo["aggregator" + str(iterator)],
-                #       "to the core switch ",
-                #       self.core_topo["core" + str(core_iterator)])
-                self.fat_edge_set.add((temp_edge.lnode.id, temp_edge.rnode.id))
-                core_aggregate_connection += 1
-                self.addLink(self.switch_topo["core" + str(core_iterator)],
-                             self.switch_topo["aggregator" + str(iterator)],
-                             **host_switch_linkopts)
-                if core_aggregate_connection == self.num_ports // 2:
-                    break
-
-
-def make_mininet_instance(graph_topo):
-    #net_topo = FattreeNet(graph_topo)
-    net = Mininet(topo=graph_topo, controller=None, autoSetMacs=True)
-    net.addController('c0', controller=RemoteController, ip="127.0.0.1", port=6653)
+                root_commands.extend(commands)
+    errors = run_tc_batch(root_commands)
+    for node, commands in host_commands.items():
+        errors += run_tc_batch(commands, node)
+    if errors.strip():
+        info("*** tc reported: %s\n" % errors.strip())
+    return len(net.links)
+
+
+def parse_controller(text):
+    "Parses 'host[:port]' into (host, port), the port defaults to 6653"
+    host, _, port = text.rpartition(":")
+    if not host:
+        return text, 6653
+    return host, int(port)
+
+
+def make_mininet_instance(index, linkopts, controller=("127.0.0.1", 6653), link_setup="batch"):
+    "Builds (but does not start) the Mininet network of a fat-tree"
+    shaped = link_setup == "tclink" and linkopts
+    graph_topo = FattreeNet(index=index, linkopts=linkopts if shaped else None)
+    net = Mininet(topo=graph_topo, switch=OVSKernelSwitch, link=TCLink if shaped else Link,
+                  controller=None, autoSetMacs=True, build=False)
+    net.addController('c0', controller=RemoteController, ip=controller[0], port=controller[1])
+    started = time.time()
+    net.build()
+    info("*** Built %d switches, %d hosts and %d links in %.1f s\n"
+         % (index.num_switches, index.num_hosts, len(net.links), time.time() - started))
+    if link_setup == "batch" and linkopts:
+        started = time.time()
+        shaped_links = shape_links(net, linkopts)
+        info("*** Shaped %d links in %.1f s\n" % (shaped_links, time.time() - started))
     return net
 
 
-def run(graph_topo):
-    # Run the Mininet CLI with a given topology
-    lg.setLogLevel('info')
-    mininet.clean.cleanup()
-    net = make_mininet_instance(graph_topo)
-
+def run(net, cli=True, pingall=False):
+    # Run the Mininet CLI with a given network
     info('*** Starting network ***\n')
     net.start()
-    info('*** Running CLI ***\n')
-    CLI(net)
+    if pingall:
+        net.pingAll()
+    if cli:
+        info('*** Running CLI ***\n')
+        CLI(net)
     info('*** Stopping network ***\n')
     net.stop()
 
 
-ft_topo = FattreeNet(4)
-run(ft_topo)
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a k-ary fat-tree in Mininet")
+    parser.add_argument("--k", default=4, type=int, help="switch ports (default: 4)")
+    parser.add_argument("--profile", default="lab", choices=sorted(LINK_PROFILES),
+                        help="link shaping profile (default: lab, 15 Mbit/s and 5 ms)")
+    parser.add_argument("--bw", default=None, type=float, help="override the profile's bandwidth in Mbit/s")
+    parser.add_argument("--delay", default=None, help="override the profile's delay, e.g. 2ms")
+    parser.add_argument("--loss", default=None, type=float, help="packet loss in percent")
+    parser.add_argument("--max-queue", default=None, type=int, help="netem queue limit in packets")
+    parser.add_argument("--controller", default="127.0.0.1:6653",
+                        help="remote controller as host[:port] (default: 127.0.0.1:6653)")
+    parser.add_argument("--link-setup", default="batch", choices=LINK_SETUPS,
+                        help="batch shapes all links after they exist, tclink shapes them one by one "
+                             "(default: batch)")
+    parser.add_argument("--pingall", action="store_true", help="ping all host pairs after starting")
+    parser.add_argument("--no-cli", action="store_true", help="stop right after starting (and pinging)")
+    args = parser.parse_args(argv)
+
+    if args.k < 2 or args.k % 2 != 0:
+        parser.error("the number of switch ports should be a positive even number, got %d" % args.k)
+    linkopts = dict(LINK_PROFILES[args.profile])
+    for name, value in (("bw", args.bw), ("delay", args.delay), ("loss", args.loss),
+                        ("max_queue_size", args.max_queue)):
+        if value is not None:
+            linkopts[name] = value
+
+    lg.setLogLevel('info')
+    mininet.clean.cleanup()
+    index = FattreeIndex(args.k)
+    net = make_mininet_instance(index, linkopts, parse_controller(args.controller), args.link_setup)
+    run(net, cli=not args.no_cli, pingall=args.pingall)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+# Copyright 2021 Lin Wang
+
+# This code is part of the Advanced Computer Networks course at Vrije
+# Universiteit Amsterdam.
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+
+#   http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Closed-form addressing for a k-ary fat-tree. Every property of a node (layer,
+# pod, position, address, DPID, name, neighbors) is computed from its index, so
+# nothing has to be materialized to answer questions about a fabric.
+#
+# Node indices follow the order in which the topologies create their nodes:
+#   edge switches         0 .. k*k/2 - 1            (pod-major)
+#   aggregation switches  k*k/2 .. k*k - 1          (pod-major)
+#   core switches         k*k .. k*k + (k/2)^2 - 1
+#   hosts                 num_switches .. num_switches + k^3/4 - 1
+#
+# Addresses follow Al-Fares et al.: pod switches are 10.pod.switch.1 (edge
+# switches use switch 0..k/2-1, aggregation switches k/2..k-1), core switches
+# are 10.k.j.i with j, i in 1..k/2, and hosts are 10.pod.switch.ID with ID in
+# 2..k/2+1. Switch n is named "s<n>" and gets DPID n + 1, which the Mininet
+# topologies pass to addSwitch as a hex string (the way Mininet parses it);
+# host m is "h<m>".
+
+import socket
+import struct
+
+EDGE = 0
+AGGREGATION = 1
+CORE = 2
+HOST = 3
+
+LAYER_NAMES = ("edge", "aggregator", "core", "host")
+
+
+def address_value(address):
+    "Returns a dotted IPv4 address as an unsigned int"
+    return struct.unpack("!I", socket.inet_aton(address))[0]
+
+
+class FattreeIndex:
+
+    def __init__(self, num_ports):
+        if num_ports < 2 or num_ports % 2 != 0:
+            raise ValueError("the number of switch ports should be a positive even number, got %r" % (num_ports,))
+        self.k = num_ports
+        self.half = num_ports // 2
+        self.num_edge = num_ports * self.half
+        self.num_aggregation = num_ports * self.half
+        self.num_core = self.half ** 2
+        self.num_switches = self.num_edge + self.num_aggregation + self.num_core
+        self.num_hosts = num_ports * self.half ** 2
+        self.num_nodes = self.num_switches + self.num_hosts
+
+        self.aggregation_start = self.num_edge
+        self.core_start = self.aggregation_start + self.num_aggregation
+        self.host_start = self.num_switches
+
+    def _check(self, node):
+        if not 0 <= node < self.num_nodes:
+            raise IndexError("node index %d out of range for a %d-ary fat-tree" % (node, self.k))
+
+    def layer(self, node):
+        self._check(node)
+        if node < self.aggregation_start:
+            return EDGE
+        if node < self.core_start:
+            return AGGREGATION
+        if node < self.host_start:
+            return CORE
+        return HOST
+
+    def layer_name(self, node):
+        return LAYER_NAMES[self.layer(node)]
+
+    # Index of the node inside its own layer
+    def offset(self, node):
+        layer = self.layer(node)
+        if layer == EDGE:
+            return node
+        if layer == AGGREGATION:
+            return node - self.aggregation_start
+        if layer == CORE:
+            return node - self.core_start
+        return node - self.host_start
+
+    # Pod of a pod switch or host; core switches do not belong to a pod
+    def pod(self, node):
+        layer = self.layer(node)
+        if layer == CORE:
+            return None
+        if layer == HOST:
+            return self.offset(node) // self.half ** 2
+        return self.offset(node) // self.half
+
+    # Position of the node below its parent: the switch number inside the pod
+    # for edge and aggregation switches, the port group (j - 1, i - 1) for core
+    # switches and the host number on its edge switch for hosts
+    def position(self, node):
+        layer = self.layer(node)
+        offset = self.offset(node)
+        if layer == CORE:
+            return divmod(offset, self.half)
+        return offset % self.half
+
+    def address(self, node):
+        layer = self.layer(node)
+        offset = self.offset(node)
+        if layer == EDGE:
+            return "10.%d.%d.1" % divmod(offset, self.half)
+        if layer == AGGREGATION:
+            pod, switch = divmod(offset, self.half)
+            return "10.%d.%d.1" % (pod, self.half + switch)
+        if layer == CORE:
+            group, member = divmod(offset, self.half)
+            return "10.%d.%d.%d" % (self.k, group + 1, member + 1)
+        edge, host = divmod(offset, self.half)
+        pod, switch = divmod(edge, self.half)
+        return "10.%d.%d.%d" % (pod, switch, host + 2)
+
+    def dpid(self, node):
+        if self.layer(node) == HOST:
+            raise ValueError("host %d has no DPID" % node)
+        return node + 1
+
+    def name(self, node):
+        if self.layer(node) == HOST:
+            return "h" + str(node - self.host_start)
+        return "s" + str(node)
+
+    # Neighbors in port order: the i-th neighbor hangs off port i + 1, which is
+    # the order in which FattreeNet adds its links (hosts below an edge switch
+    # first, then edge switches below an aggregation switch, then cores)
+    def neighbors(self, node):
+        layer = self.layer(node)
+        offset = self.offset(node)
+        half = self.half
+        if layer == EDGE:
+            pod = offset // half
+            return [self.host_start + offset * half + host for host in range(half)] + \
+                   [self.aggregation_start + pod * half + switch for switch in range(half)]
+        if layer == AGGREGATION:
+            pod, switch = divmod(offset, half)
+            return [pod * half + edge for edge in range(half)] + \
+                   [self.core_start + switch * half + core for core in range(half)]
+        if layer == CORE:
+            group = offset // half
+            return [self.aggregation_start + pod * half + group for pod in range(self.k)]
+        return [offset // half]
+
+    def degree(self, node):
+        return 1 if self.layer(node) == HOST else self.k
+
+    # Port on node that leads to neighbor, or None if they are not adjacent
+    def port(self, node, neighbor):
+        layer = self.layer(node)
+        offset = self.offset(node)
+        other_layer = self.layer(neighbor)
+        other = self.offset(neighbor)
+        half = self.half
+        if layer == HOST:
+            return 1 if other_layer == EDGE and other == offset // half else None
+        if layer == EDGE:
+            if other_layer == HOST and other // half == offset:
+                return other % half + 1
+            if other_layer == AGGREGATION and other // half == offset // half:
+                return half + other % half + 1
+            return None
+        if layer == AGGREGATION:
+            if other_layer == EDGE and other // half == offset // half:
+                return other % half + 1
+            if other_layer == CORE and other // half == offset % half:
+                return half + other % half + 1
+            return None
+        if other_layer == AGGREGATION and other % half == offset // half:
+            return other // half + 1
+        return None
+
+    def is_neighbor(self, node, neighbor):
+        return self.port(node, neighbor) is not None
+
+    def node_of_dpid(self, dpid):
+        if not 1 <= dpid <= self.num_switches:
+            raise KeyError(dpid)
+        return dpid - 1
+
+    def node_of_address(self, address):
+        octets = [int(octet) for octet in address.split(".")]
+        if len(octets) != 4 or octets[0] != 10:
+            raise KeyError(address)
+        _, second, third, fourth = octets
+        half = self.half
+        if second == self.k:
+            if 1 <= third <= half and 1 <= fourth <= half:
+                return self.core_start + (third - 1) * half + (fourth - 1)
+            raise KeyError(address)
+        if not 0 <= second < self.k or not 0 <= third < self.k:
+            raise KeyError(address)
+        if fourth == 1:
+            if third < half:
+                return second * half + third
+            return self.aggregation_start + second * half + (third - half)
+        if third < half and 2 <= fourth <= half + 1:
+            return self.host_start + (second * half + third) * half + (fourth - 2)
+        raise KeyError(address)
+
+    # Edge switch a host is attached to
+    def edge_of(self, node):
+        if self.layer(node) != HOST:
+            raise ValueError("node %d is not a host" % node)
+        return self.offset(node) // self.half
+
+    def switches(self, layer=None):
+        if layer is None:
+            return range(self.num_switches)
+        if layer == EDGE:
+            return range(0, self.aggregation_start)
+        if layer == AGGREGATION:
+            return range(self.aggregation_start, self.core_start)
+        if layer == CORE:
+            return range(self.core_start, self.host_start)
+        return range(0)
+
+    def hosts(self):
+        return range(self.host_start, self.num_nodes)
+
+    # Every link once, as (upper, lower) node pairs in FattreeNet's creation order
+    def links(self):
+        for edge in self.switches(EDGE):
+            for host in self.neighbors(edge)[:self.half]:
+                yield edge, host
+        for aggregator in self.switches(AGGREGATION):
+            for neighbor in self.neighbors(aggregator):
+                yield aggregator, neighbor
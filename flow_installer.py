@@ -0,0 +1,209 @@
+# Copyright 2021 Lin Wang
+
+# This code is part of the Advanced Computer Networks course at Vrije
+# Universiteit Amsterdam.
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+
+#   http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Flow installation pipeline for SPRouter. Flow mods are queued per datapath
+# instead of being sent on the spot; flush() sends at most one batch per
+# datapath, closes every batch with a barrier and remembers the barrier's xid.
+# The barrier reply acknowledges the whole batch, and error messages are
+# matched back to the flow mod that caused them by xid.
+#
+# The installer only talks to datapath objects (send_msg, set_xid and the
+# ofproto parser), so the controller decides when to flush, typically from a
+# green thread so that bulk installs are spread over several event-loop turns.
+
+import time
+from collections import deque
+
+DEFAULT_BATCH_SIZE = 256
+
+# install rates are reported over this many recent seconds
+RATE_WINDOW = 10.0
+
+# seconds a flow counts as being installed after its flow mod was queued
+PENDING_TIMEOUT = 1.0
+
+
+class FlowInstaller:
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, use_bundles=False, logger=None):
+        self.batch_size = batch_size
+        # wrap every batch in an ONF (OpenFlow 1.3 extension) bundle, committed atomically
+        self.use_bundles = use_bundles
+        self.logger = logger
+        self.pending = {}
+        self.datapaths = {}
+        # (dpid, barrier xid) -> (xids of the flow mods in the batch, send time)
+        self.outstanding = {}
+        # (dpid, flow mod xid) -> flow mod, until its batch is acknowledged
+        self.in_flight = {}
+        self.next_bundle_id = 1
+        # (time, flow mods) of recent barrier replies, for the install rate
+        self.recent_acks = deque()
+        self.queued = 0
+        self.sent = 0
+        self.acknowledged = 0
+        self.errors = 0
+        self.barrier_latency = 0.0
+        self.barriers = 0
+        self.last_errors = deque(maxlen=16)
+
+    def queue(self, datapath, mod):
+        self.datapaths[datapath.id] = datapath
+        self.pending.setdefault(datapath.id, deque()).append(mod)
+        self.queued += 1
+
+    def has_pending(self):
+        return any(self.pending.values())
+
+    def flush(self, dpid=None):
+        "Sends one batch to every datapath (or only to dpid) and returns the number of flow mods sent"
+        sent = 0
+        for target in ([dpid] if dpid is not None else list(self.pending)):
+            mods = self.pending.get(target)
+            if not mods:
+                continue
+            datapath = self.datapaths[target]
+            batch = [mods.popleft() for _ in range(min(self.batch_size, len(mods)))]
+            self._send_batch(datapath, batch)
+            sent += len(batch)
+        return sent
+
+    def _send_batch(self, datapath, batch):
+        parser = datapath.ofproto_parser
+        ofproto = datapath.ofproto
+        bundle_id = None
+        if self.use_bundles and hasattr(parser, "ONFBundleCtrlMsg"):
+            bundle_id = self.next_bundle_id
+            self.next_bundle_id += 1
+            datapath.send_msg(parser.ONFBundleCtrlMsg(datapath, bundle_id, ofproto.ONF_BCT_OPEN_REQUEST,
+                                                      ofproto.ONF_BF_ATOMIC, []))
+        xids = []
+        for mod in batch:
+            if bundle_id is None:
+                xid = datapath.set_xid(mod)
+                datapath.send_msg(mod)
+            else:
+                # the bundled message carries the xid of the add message around it
+                add = parser.ONFBundleAddMsg(datapath, bundle_id, ofproto.ONF_BF_ATOMIC, mod, [])
+                xid = datapath.set_xid(add)
+                mod.set_xid(xid)
+                datapath.send_msg(add)
+            self.in_flight[(datapath.id, xid)] = mod
+            xids.append(xid)
+        if bundle_id is not None:
+            datapath.send_msg(parser.ONFBundleCtrlMsg(datapath, bundle_id, ofproto.ONF_BCT_COMMIT_REQUEST,
+                                                      ofproto.ONF_BF_ATOMIC, []))
+        barrier = parser.OFPBarrierRequest(datapath)
+        xid = datapath.set_xid(barrier)
+        datapath.send_msg(barrier)
+        self.outstanding[(datapath.id, xid)] = (xids, time.time())
+        self.sent += len(batch)
+
+    def barrier_reply(self, msg):
+        "Marks the batch closed by this barrier reply as installed"
+        dpid = msg.datapath.id
+        batch = self.outstanding.pop((dpid, msg.xid), None)
+        if batch is None:
+            return
+        xids, sent_at = batch
+        # flow mods that failed were already taken out by error()
+        installed = sum(1 for xid in xids if self.in_flight.pop((dpid, xid), None) is not None)
+        self.acknowledged += installed
+        now = time.time()
+        self.recent_acks.append((now, installed))
+        self.barrier_latency += now - sent_at
+        self.barriers += 1
+
+    def error(self, msg):
+        "Records an OFPErrorMsg, returns the flow mod it refers to if it was one of ours"
+        mod = self.in_flight.pop((msg.datapath.id, msg.xid), None)
+        if mod is None:
+            return None
+        self.errors += 1
+        self.last_errors.append((msg.datapath.id, msg.type, msg.code))
+        if self.logger is not None:
+            self.logger.warning("Flow mod on switch %s failed: type=%s code=%s"
+                                % (msg.datapath.id, msg.type, msg.code))
+        return mod
+
+    def forget(self, dpid):
+        "Drops all state of a datapath that disconnected"
+        self.pending.pop(dpid, None)
+        self.datapaths.pop(dpid, None)
+        for key in [key for key in self.outstanding if key[0] == dpid]:
+            del self.outstanding[key]
+        for key in [key for key in self.in_flight if key[0] == dpid]:
+            del self.in_flight[key]
+
+    def install_rate(self):
+        "Returns the acknowledged flow mods per second over the last RATE_WINDOW seconds"
+        horizon = time.time() - RATE_WINDOW
+        while self.recent_acks and self.recent_acks[0][0] < horizon:
+            self.recent_acks.popleft()
+        return sum(count for _, count in self.recent_acks) / RATE_WINDOW
+
+    def metrics(self):
+        return {
+            "queued": self.queued,
+            "sent": self.sent,
+            "acknowledged": self.acknowledged,
+            "errors": self.errors,
+            "pending": sum(len(mods) for mods in self.pending.values()),
+            "outstanding_barriers": len(self.outstanding),
+            "install_rate": self.install_rate(),
+            "mean_barrier_latency": self.barrier_latency / self.barriers if self.barriers else 0.0,
+        }
+
+
+class PendingFlows:
+    """
+    Flows whose entry is on its way to a switch. Packets of the flow that
+    reach the controller in the meantime are forwarded the same way instead
+    of installing the entry once more
+    """
+
+    def __init__(self, timeout=PENDING_TIMEOUT):
+        self.timeout = timeout
+        # (dpid, ...) -> (value, deadline)
+        self.flows = {}
+        self.duplicates = 0
+
+    def __len__(self):
+        return len(self.flows)
+
+    def get(self, key, now=None):
+        "Returns the value of a pending flow, or None if it is not (or no longer) pending"
+        pending = self.flows.get(key)
+        if pending is None:
+            return None
+        now = time.time() if now is None else now
+        if pending[1] < now:
+            del self.flows[key]
+            return None
+        self.duplicates += 1
+        return pending[0]
+
+    def add(self, key, value, now=None):
+        now = time.time() if now is None else now
+        # drop the expired flows now and then, the map holds at most one timeout's worth
+        if len(self.flows) >= 64 and len(self.flows) & (len(self.flows) - 1) == 0:
+            self.flows = {known: pending for known, pending in self.flows.items() if pending[1] >= now}
+        self.flows[key] = (value, now + self.timeout)
+
+    def forget(self, dpid):
+        for key in [key for key in self.flows if key[0] == dpid]:
+            del self.flows[key]
@@ -0,0 +1,155 @@
+# Copyright 2021 Lin Wang
+
+# This code is part of the Advanced Computer Networks course at Vrije
+# Universiteit Amsterdam.
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+
+#   http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Flow-table occupancy for SPRouter. Every entry the controller installs gets
+# a cookie: the top byte says whether it is a proactive route (kept until the
+# controller removes it) or a reactive entry (per-flow, with an idle timeout),
+# the rest is a serial number. Reactive entries are tracked per switch in
+# least-recently-used order; when a switch reaches its budget, installing one
+# more evicts the least recently used ones, so the tables never overflow into
+# slow paths. Entries are used when they are (re)installed and when the flow
+# stats show their packet count grew; they leave the books on
+# OFPFlowRemoved, on the controller's own deletes, and on eviction.
+#
+# Nothing in here depends on Ryu, matches are any hashable key (see
+# telemetry.match_key).
+
+from collections import OrderedDict, namedtuple
+
+PROACTIVE = 1
+REACTIVE = 2
+
+COOKIE_KIND_SHIFT = 56
+COOKIE_KIND_MASK = 0xff << COOKIE_KIND_SHIFT
+COOKIE_SERIAL_MASK = (1 << COOKIE_KIND_SHIFT) - 1
+
+DEFAULT_BUDGET = 1000
+DEFAULT_IDLE_TIMEOUT = 10
+
+# ofp_flow_removed_reason of OpenFlow 1.3, for the metrics
+REMOVED_REASONS = {0: "idle_timeout", 1: "hard_timeout", 2: "delete", 3: "group_delete"}
+
+# what to send for one install: the cookie and timeouts of the flow mod, and
+# the reactive entries that have to be deleted to make room for it
+Installation = namedtuple("Installation", ["cookie", "idle_timeout", "hard_timeout", "evicted"])
+# a reactive entry on a switch
+Entry = namedtuple("Entry", ["priority", "key", "cookie"])
+
+
+def cookie_kind(cookie):
+    return (cookie & COOKIE_KIND_MASK) >> COOKIE_KIND_SHIFT
+
+
+class FlowLifecycle:
+
+    def __init__(self, budget=DEFAULT_BUDGET, idle_timeout=DEFAULT_IDLE_TIMEOUT, hard_timeout=0):
+        self.budget = budget
+        self.idle_timeout = idle_timeout
+        self.hard_timeout = hard_timeout
+        self.next_serial = 1
+        # dpid -> OrderedDict (priority, key) -> [cookie, last packet count], least recently used first
+        self.reactive = {}
+        # dpid -> set of (priority, key) of the proactive entries
+        self.proactive = {}
+        # (dpid, cookie) -> (priority, key) of the reactive entries
+        self.cookies = {}
+        self.installed = 0
+        self.evicted = 0
+        self.removed_reasons = {}
+
+    def _cookie(self, kind):
+        serial = self.next_serial
+        self.next_serial = (self.next_serial + 1) & COOKIE_SERIAL_MASK or 1
+        return (kind << COOKIE_KIND_SHIFT) | serial
+
+    def install(self, dpid, priority, key, reactive=False):
+        "Books an entry about to be installed and returns its Installation"
+        self.installed += 1
+        if not reactive:
+            self.proactive.setdefault(dpid, set()).add((priority, key))
+            return Installation(self._cookie(PROACTIVE), 0, 0, [])
+        table = self.reactive.setdefault(dpid, OrderedDict())
+        known = table.get((priority, key))
+        if known is not None:
+            # a re-install replaces the entry on the switch, keep its cookie
+            table.move_to_end((priority, key))
+            return Installation(known[0], self.idle_timeout, self.hard_timeout, [])
+        evicted = []
+        while self.budget and len(table) >= self.budget:
+            (old_priority, old_key), (old_cookie, _) = table.popitem(last=False)
+            del self.cookies[(dpid, old_cookie)]
+            evicted.append(Entry(old_priority, old_key, old_cookie))
+        self.evicted += len(evicted)
+        cookie = self._cookie(REACTIVE)
+        table[(priority, key)] = [cookie, 0]
+        self.cookies[(dpid, cookie)] = (priority, key)
+        return Installation(cookie, self.idle_timeout, self.hard_timeout, evicted)
+
+    def deleted(self, dpid, priority, key):
+        "Forgets an entry the controller deletes itself"
+        table = self.reactive.get(dpid)
+        if table is not None:
+            known = table.pop((priority, key), None)
+            if known is not None:
+                del self.cookies[(dpid, known[0])]
+        self.proactive.get(dpid, set()).discard((priority, key))
+
+    def removed(self, dpid, cookie, reason=None):
+        "Handles an OFPFlowRemoved, returns whether the entry was still booked"
+        name = REMOVED_REASONS.get(reason, str(reason))
+        self.removed_reasons[name] = self.removed_reasons.get(name, 0) + 1
+        entry = self.cookies.pop((dpid, cookie), None)
+        if entry is None:
+            return False
+        del self.reactive[dpid][entry]
+        return True
+
+    def flow_stats(self, dpid, stats):
+        "Marks the reactive entries whose packet count grew as used, from (cookie, packet count) pairs"
+        table = self.reactive.get(dpid)
+        if not table:
+            return 0
+        used = 0
+        for cookie, packets in stats:
+            entry = self.cookies.get((dpid, cookie))
+            if entry is None:
+                continue
+            booked = table[entry]
+            if packets != booked[1]:
+                booked[1] = packets
+                table.move_to_end(entry)
+                used += 1
+        return used
+
+    def forget(self, dpid):
+        for cookie, _ in self.reactive.pop(dpid, {}).values():
+            del self.cookies[(dpid, cookie)]
+        self.proactive.pop(dpid, None)
+
+    def occupancy(self, dpid):
+        "Returns (proactive, reactive) entries booked on a switch"
+        return len(self.proactive.get(dpid, ())), len(self.reactive.get(dpid, ()))
+
+    def metrics(self):
+        return {
+            "proactive": sum(len(entries) for entries in self.proactive.values()),
+            "reactive": len(self.cookies),
+            "fullest": max((len(table) for table in self.reactive.values()), default=0),
+            "installed": self.installed,
+            "evicted": self.evicted,
+            "removed": dict(self.removed_reasons),
+        }
@@ -0,0 +1,263 @@
+# Copyright 2021 Lin Wang
+
+# This code is part of the Advanced Computer Networks course at Vrije
+# Universiteit Amsterdam.
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+
+#   http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# !/usr/bin/env python3
+
+# Flow-level throughput of topo.Fattree and topo.Jellyfish without Mininet.
+# Every flow of a traffic matrix is routed on the switch graph, and the
+# max-min fair rates of all flows are computed by progressive filling, e.g.
+#
+#   python3 flowsim.py --topology jellyfish --k 16 --mode ksp --seed 1
+#
+# Routing modes:
+#   sp    one shortest path per flow, the same for every flow between two switches
+#   ecmp  one shortest path per flow, every switch on the way picks one of its
+#         equal-cost next hops with a seeded hash
+#   ksp   one subflow on each of the k shortest paths (as MPTCP would), the
+#         rate of the flow is the sum of its subflows
+#   hedera (fat-tree only) one path per flow, placed by hedera.Scheduler on the
+#         least-loaded equal-cost path after estimating every flow's demand
+#
+# Links are directed. Switch links have capacity link_capacity. Every server
+# has an uplink and a downlink of server_capacity (link_capacity by default).
+# A flow can have a finite demand. Its subflows then also cross one virtual
+# link of that capacity.
+#
+# Progressive filling works on the flat subflow x link incidence list. Each
+# round raises all unfrozen subflows by the smallest fair share left on any
+# link, then freezes every subflow that crosses a link which is now full. A
+# round is a bincount plus a few vector operations, and there are at most as
+# many rounds as distinct bottleneck levels.
+
+import argparse
+import random
+import sys
+import time
+from collections import namedtuple
+
+import numpy as npy
+
+import hedera
+import topo
+from path_diversity import PathEngine, permutation_traffic, DEFAULT_K
+from shortest_paths import switch_csr, server_switches
+
+ROUTING_MODES = ("sp", "ecmp", "ksp", "hedera")
+
+# relative slack when deciding whether a link is the bottleneck of a round
+TOLERANCE = 1e-9
+
+# flow_rates[i] is the rate of flows[i]; link_load and link_capacity are
+# indexed by link id, see FlowSimulator for the layout
+FlowResult = namedtuple("FlowResult", ["flow_rates", "subflow_rates", "subflow_flows",
+                                       "link_load", "link_capacity", "rounds"])
+
+
+def max_min_rates(element_subflows, element_links, capacities, num_subflows):
+    """
+    Returns (max-min fair rate of every subflow, number of filling rounds).
+    Subflow element_subflows[i] crosses link element_links[i]; subflows
+    without any link get rate 0
+    """
+    element_subflows = npy.asarray(element_subflows, dtype=npy.int64)
+    element_links = npy.asarray(element_links, dtype=npy.int64)
+    capacities = npy.asarray(capacities, dtype=npy.float64)
+    num_links = len(capacities)
+    rates = npy.zeros(num_subflows, dtype=npy.float64)
+    remaining = capacities.copy()
+    active = npy.zeros(num_subflows, dtype=bool)
+    active[element_subflows] = True
+
+    rounds = 0
+    element_active = active[element_subflows]
+    while element_active.any():
+        rounds += 1
+        counts = npy.bincount(element_links[element_active], minlength=num_links)
+        used = counts > 0
+        shares = npy.full(num_links, npy.inf)
+        shares[used] = remaining[used] / counts[used]
+        delta = max(float(shares.min()), 0.0)
+        rates[active] += delta
+        remaining -= delta * counts
+        # every link whose fair share was the minimum is now full
+        saturated = used & (shares <= delta * (1 + TOLERANCE) + TOLERANCE * capacities)
+        remaining[saturated] = 0.0
+        frozen = element_subflows[element_active & saturated[element_links]]
+        active[frozen] = False
+        element_active = active[element_subflows]
+    return rates, rounds
+
+
+class FlowSimulator:
+    """
+    Link ids: the directed switch links in CSR order come first, then the
+    uplink and then the downlink of every server, then one virtual link per
+    flow with a finite demand
+    """
+
+    def __init__(self, topology, link_capacity=1.0, server_capacity=None):
+        self.offsets, self.neighbors = switch_csr(topology)
+        self.attached = server_switches(topology)
+        self.engine = PathEngine(self.offsets, self.neighbors)
+        self.num_switch_links = len(self.neighbors)
+        self.num_servers = len(self.attached)
+        self.index = getattr(topology, "index", None)
+        self.link_capacity = link_capacity
+        self.server_capacity = link_capacity if server_capacity is None else server_capacity
+        self.link_ids = {}
+        for node in range(len(self.offsets) - 1):
+            for position in range(self.offsets[node], self.offsets[node + 1]):
+                self.link_ids[(node, int(self.neighbors[position]))] = position
+
+    def uplink(self, server):
+        return self.num_switch_links + server
+
+    def downlink(self, server):
+        return self.num_switch_links + self.num_servers + server
+
+    def paths(self, source, target, mode, k=DEFAULT_K, rng=random):
+        "Returns the switch paths the subflows between two switches take"
+        if source == target:
+            return [(source,)]
+        if mode == "sp":
+            return self.engine.ecmp_paths(source, target, 1)
+        if mode == "ecmp":
+            path = self.engine.random_shortest_path(source, target, rng)
+            return [path] if path is not None else []
+        if mode == "ksp":
+            return self.engine.k_shortest_paths(source, target, k)
+        raise ValueError("routing mode should be one of %s, got %r" % (", ".join(ROUTING_MODES), mode))
+
+    def hedera_paths(self, flows):
+        "Returns {flow number: switch path} of the flows as the Hedera scheduler places them"
+        if self.index is None:
+            raise ValueError("hedera routing needs a fat-tree")
+        start = self.index.host_start
+        pairs = []
+        keys = []
+        for number, flow in enumerate(flows):
+            source, destination = int(flow[0]), int(flow[1])
+            if source != destination:
+                pairs.append((start + source, start + destination))
+                keys.append((start + source, start + destination, number))
+        demands = {}
+        for key, demand, flow in zip(keys, hedera.estimate_demands(pairs), (flows[key[2]] for key in keys)):
+            # a finite demand caps the estimate
+            if len(flow) > 2 and flow[2] is not None and npy.isfinite(flow[2]):
+                demand = min(demand, flow[2] / self.server_capacity)
+            demands[key] = demand
+        placed = hedera.Scheduler(self.index).place(demands)
+        return {key[2]: path for key, path in placed.items()}
+
+    def route(self, flows, mode="sp", k=DEFAULT_K, seed=None):
+        """
+        Routes (source server, destination server[, demand]) flows and returns
+        (subflow_flows, element_subflows, element_links, capacities)
+        """
+        rng = random.Random(seed)
+        subflow_flows = []
+        element_subflows = []
+        element_links = []
+        demands = []
+        placements = self.hedera_paths(flows) if mode == "hedera" else None
+        # flows to the same destination reuse its distance table
+        order = sorted(range(len(flows)), key=lambda number: flows[number][1])
+        for number in order:
+            flow = flows[number]
+            source, destination = int(flow[0]), int(flow[1])
+            lswitch, rswitch = int(self.attached[source]), int(self.attached[destination])
+            if lswitch < 0 or rswitch < 0 or source == destination:
+                continue
+            demand_link = None
+            if len(flow) > 2 and flow[2] is not None and npy.isfinite(flow[2]):
+                demand_link = self.num_switch_links + 2 * self.num_servers + len(demands)
+                demands.append(float(flow[2]))
+            if placements is not None:
+                paths = [placements[number]]
+            else:
+                paths = self.paths(lswitch, rswitch, mode, k, rng)
+            for path in paths:
+                subflow = len(subflow_flows)
+                subflow_flows.append(number)
+                links = [self.uplink(source), self.downlink(destination)]
+                links.extend(self.link_ids[hop] for hop in zip(path, path[1:]))
+                if demand_link is not None:
+                    links.append(demand_link)
+                element_subflows.extend([subflow] * len(links))
+                element_links.extend(links)
+        capacities = npy.concatenate([
+            npy.full(self.num_switch_links, self.link_capacity, dtype=npy.float64),
+            npy.full(2 * self.num_servers, self.server_capacity, dtype=npy.float64),
+            npy.array(demands, dtype=npy.float64),
+        ])
+        return (npy.array(subflow_flows, dtype=npy.int64), npy.array(element_subflows, dtype=npy.int64),
+                npy.array(element_links, dtype=npy.int64), capacities)
+
+    def run(self, flows, mode="sp", k=DEFAULT_K, seed=None):
+        "Routes the flows and returns their max-min fair FlowResult"
+        subflow_flows, element_subflows, element_links, capacities = self.route(flows, mode, k, seed)
+        subflow_rates, rounds = max_min_rates(element_subflows, element_links, capacities, len(subflow_flows))
+        flow_rates = npy.bincount(subflow_flows, weights=subflow_rates, minlength=len(flows))
+        link_load = npy.bincount(element_links, weights=subflow_rates[element_subflows], minlength=len(capacities))
+        return FlowResult(flow_rates, subflow_rates, subflow_flows, link_load, capacities, rounds)
+
+
+def simulate(topology, flows, mode="sp", k=DEFAULT_K, seed=None,
+             link_capacity=1.0, server_capacity=None):
+    "Returns the max-min fair FlowResult of the flows on a topology"
+    simulator = FlowSimulator(topology, link_capacity, server_capacity)
+    return simulator.run(flows, mode, k, seed)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Max-min fair throughput of Fattree and Jellyfish")
+    parser.add_argument("--topology", default="fattree", choices=["fattree", "jellyfish"])
+    parser.add_argument("--k", default=4, type=int, help="switch ports (default: 4)")
+    parser.add_argument("--servers", default=None, type=int,
+                        help="Jellyfish servers (default: k^3/4, as many as the Fattree)")
+    parser.add_argument("--mode", default="sp", choices=ROUTING_MODES, help="routing mode (default: sp)")
+    parser.add_argument("--paths", default=DEFAULT_K, type=int,
+                        help="paths per flow in ksp mode (default: %d)" % DEFAULT_K)
+    parser.add_argument("--seed", default=None, type=int,
+                        help="seed of the Jellyfish wiring, the permutation and the ECMP hash")
+    args = parser.parse_args(argv)
+
+    if args.k < 2 or args.k % 2 != 0:
+        parser.error("the number of switch ports should be a positive even number, got %d" % args.k)
+    if args.mode == "hedera" and args.topology != "fattree":
+        parser.error("hedera routing needs the fattree topology")
+    started = time.perf_counter()
+    if args.topology == "fattree":
+        instance = topo.Fattree(args.k)
+    else:
+        servers = args.k ** 3 // 4 if args.servers is None else args.servers
+        instance = topo.Jellyfish(servers, 5 * args.k ** 2 // 4, args.k, args.seed)
+    flows = permutation_traffic(len(instance.servers), random.Random(args.seed))
+    built = time.perf_counter()
+    result = simulate(instance, flows, args.mode, args.paths, seed=args.seed)
+    finished = time.perf_counter()
+
+    rates = result.flow_rates
+    print("%s k=%d, %d flows, %s routing" % (args.topology, args.k, len(flows), args.mode))
+    print("mean throughput  %.4f" % (rates.mean() if len(rates) else 0.0))
+    print("min throughput   %.4f" % (rates.min() if len(rates) else 0.0))
+    print("filling rounds   %d" % result.rounds)
+    print("build %.2f s, routing and filling %.2f s" % (built - started, finished - built), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
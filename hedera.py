@@ -0,0 +1,205 @@
+# Copyright 2021 Lin Wang
+
+# This code is part of the Advanced Computer Networks course at Vrije
+# Universiteit Amsterdam.
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+
+#   http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Elephant-flow scheduling for fat-trees, after Hedera (Al-Fares et al.,
+# NSDI 2010). Nothing in here depends on Ryu, flows are (source host,
+# destination host) pairs of FattreeIndex nodes and rates are fractions of
+# a host's link capacity.
+#
+# Every scheduling round
+#   1. flows above the elephant threshold are picked from the measured rates,
+#   2. their natural demand, the rate they would get if only the hosts'
+#      links limited them, is estimated with Hedera's fixed point: senders
+#      split their capacity equally over their flows, and receivers that are
+#      oversubscribed cut the largest flows down to an equal share,
+#   3. the elephants are placed, largest demand first, on the equal-cost path
+#      whose busiest link has the most room left after the demands placed so
+#      far (a flow keeps its current path on a tie).
+#
+# The controller installs a placement as exact (source, destination) entries
+# along the path, above the destination-based routes; see SPRouter. Both the
+# counting and the pinned entries are reactive entries of flow_lifecycle, so
+# they idle out once the flow stops.
+
+from fattree_index import AGGREGATION, CORE
+
+# entries of the controller on edge switches: everything a host sends goes to
+# the controller (MONITOR) until the flow has its own counting entry (FLOW);
+# elephants are pinned to their scheduled path with ELEPHANT entries
+MONITOR_PRIORITY = 30
+FLOW_PRIORITY = 40
+ELEPHANT_PRIORITY = 50
+
+# flows above this fraction of the host link capacity are elephants (Hedera uses 10%)
+DEFAULT_THRESHOLD = 0.1
+
+# demand estimation stops once no demand moves by more than this
+CONVERGENCE = 1e-6
+
+
+def host_paths(index, source, destination):
+    """
+    Returns the equal-cost switch paths from the edge switch of host source to
+    the edge switch of host destination, ordered by the aggregation and then
+    the core switch they take
+    """
+    half = index.half
+    source_edge = index.edge_of(source)
+    destination_edge = index.edge_of(destination)
+    if source_edge == destination_edge:
+        return [(source_edge,)]
+    source_pod = index.pod(source_edge)
+    destination_pod = index.pod(destination_edge)
+    aggregation = index.switches(AGGREGATION).start
+    core = index.switches(CORE).start
+    if source_pod == destination_pod:
+        return [(source_edge, aggregation + source_pod * half + group, destination_edge) for group in range(half)]
+    paths = []
+    for group in range(half):
+        up = aggregation + source_pod * half + group
+        down = aggregation + destination_pod * half + group
+        for member in range(half):
+            paths.append((source_edge, up, core + group * half + member, down, destination_edge))
+    return paths
+
+
+def path_links(path):
+    "Returns the directed switch links of a path"
+    return list(zip(path, path[1:]))
+
+
+def path_entries(index, source, destination, path):
+    "Returns the (dpid, out port) of every switch on the path of a flow, up to the destination host"
+    hops = list(path) + [destination]
+    return [(index.dpid(node), index.port(node, following)) for node, following in zip(hops, hops[1:])]
+
+
+def default_port(index, edge, source, destination):
+    """
+    Returns the port on which edge sends a new flow from host source to host
+    destination before it is scheduled: the destination's port if it is
+    local, otherwise an uplink picked by hashing the pair, as ECMP would
+    """
+    if index.edge_of(destination) == edge:
+        return index.port(edge, destination)
+    return index.half + hash((source, destination)) % index.half + 1
+
+
+def estimate_demands(flows):
+    """
+    Returns the natural demand of every (source, destination) flow, as a
+    fraction of the host link capacity, in the order of flows
+    """
+    demands = [0.0] * len(flows)
+    converged = [False] * len(flows)
+    by_source = {}
+    by_destination = {}
+    for number, (source, destination) in enumerate(flows):
+        by_source.setdefault(source, []).append(number)
+        by_destination.setdefault(destination, []).append(number)
+
+    changed = True
+    while changed:
+        changed = False
+        # senders share what the converged flows leave over their other flows
+        for numbers in by_source.values():
+            fixed = sum(demands[number] for number in numbers if converged[number])
+            open_flows = [number for number in numbers if not converged[number]]
+            if not open_flows:
+                continue
+            share = max(1.0 - fixed, 0.0) / len(open_flows)
+            for number in open_flows:
+                if abs(demands[number] - share) > CONVERGENCE:
+                    demands[number] = share
+                    changed = True
+        # oversubscribed receivers limit their largest flows to an equal share
+        for numbers in by_destination.values():
+            if sum(demands[number] for number in numbers) <= 1.0 + CONVERGENCE:
+                continue
+            limited = list(numbers)
+            share = 1.0 / len(limited)
+            while True:
+                small = [number for number in limited if demands[number] < share]
+                if not small:
+                    break
+                limited = [number for number in limited if demands[number] >= share]
+                share = (1.0 - sum(demands[number] for number in numbers if number not in limited)) / len(limited)
+            for number in limited:
+                if abs(demands[number] - share) > CONVERGENCE or not converged[number]:
+                    demands[number] = share
+                    converged[number] = True
+                    changed = True
+    return demands
+
+
+def elephants(rates, threshold=DEFAULT_THRESHOLD):
+    "Returns the flows of {flow: rate} whose rate is at least threshold, largest first"
+    return sorted((flow for flow, rate in rates.items() if rate >= threshold),
+                  key=lambda flow: (-rates[flow], flow))
+
+
+class Scheduler:
+    """
+    Places elephants on the least-loaded equal-cost path of a fat-tree and
+    remembers the placements between rounds, so that only flows that move
+    have to be reinstalled
+    """
+
+    def __init__(self, index, threshold=DEFAULT_THRESHOLD):
+        self.index = index
+        self.threshold = threshold
+        # (source, destination) -> switch path
+        self.placements = {}
+        # (node, node) -> demand reserved on the link in the last round
+        self.reserved = {}
+
+    def place(self, demands):
+        """
+        Places {(source, destination): demand} from scratch and returns
+        {(source, destination): path} for every flow
+        """
+        reserved = {}
+        placed = {}
+        for flow in sorted(demands, key=lambda flow: (-demands[flow], flow)):
+            demand = demands[flow]
+            current = self.placements.get(flow)
+            best = None
+            best_load = None
+            for path in host_paths(self.index, flow[0], flow[1]):
+                load = max([reserved.get(link, 0.0) + demand for link in path_links(path)] or [demand])
+                if best is None or load < best_load - CONVERGENCE or \
+                        (abs(load - best_load) <= CONVERGENCE and path == current):
+                    best, best_load = path, load
+            placed[flow] = best
+            for link in path_links(best):
+                reserved[link] = reserved.get(link, 0.0) + demand
+        self.reserved = reserved
+        return placed
+
+    def schedule(self, rates):
+        """
+        Runs one round on the measured {(source, destination): rate} and returns
+        (moved, released): {flow: path} of the elephants whose path changed or
+        that are new, and the flows that are no longer scheduled
+        """
+        flows = elephants(rates, self.threshold)
+        demands = dict(zip(flows, estimate_demands(flows)))
+        placed = self.place(demands)
+        moved = {flow: path for flow, path in placed.items() if self.placements.get(flow) != path}
+        released = [flow for flow in self.placements if flow not in placed]
+        self.placements = placed
+        return moved, released
@@ -0,0 +1,457 @@
+# Copyright 2021 Lin Wang
+
+# This code is part of the Advanced Computer Networks course at Vrije
+# Universiteit Amsterdam.
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+
+#   http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# !/usr/bin/env python3
+
+# Packet-level discrete-event simulation of the FattreeNet fabric, as a
+# stand-in for Mininet. No root, Open vSwitch or Ryu is needed, e.g.
+#
+#   python3 netsim.py --k 4 --mode ecmp --duration 2 --fail-at 1
+#
+# The fabric is built from FattreeIndex with the same names, DPIDs, addresses
+# and port numbers as FattreeNet. Every link has its bandwidth and delay, every
+# port a drop-tail queue. Switches forward by prioritized ipv4_dst
+# address/mask entries, like the OpenFlow tables SPRouter installs. Entries
+# with several (port, weight) next hops behave like select groups.
+#
+# Controller plays SPRouter's part through the same routing.py calls: it feeds
+# the switch links into routing.fattree_routing_state, pushes
+# routing.proactive_tables and, after a link event, the routing.route_entries
+# of the incremental changes once the control delay has passed. Table misses
+# are counted as packet-ins.
+#
+# The scheduler is a heap of (time, sequence, callback, args). The sequence
+# number keeps events at the same time in FIFO order, so runs are
+# deterministic.
+
+import argparse
+import heapq
+import random
+import sys
+import time
+from collections import deque
+
+import routing
+from fattree_index import FattreeIndex, HOST, address_value
+
+# the TCLink parameters of FattreeNet
+DEFAULT_BANDWIDTH = 15e6
+DEFAULT_DELAY = 0.005
+DEFAULT_QUEUE_LIMIT = 100
+
+DEFAULT_PACKET_SIZE = 1500
+DEFAULT_TTL = 64
+
+# seconds between a topology event and the route changes reaching the switches
+DEFAULT_CONTROL_DELAY = 0.001
+
+
+
+class Simulator:
+
+    def __init__(self):
+        self.now = 0.0
+        self.queue = []
+        self.sequence = 0
+        self.events = 0
+
+    def schedule(self, delay, callback, *args):
+        self.sequence += 1
+        heapq.heappush(self.queue, (self.now + delay, self.sequence, callback, args))
+
+    def run(self, until=None):
+        "Runs events in time order until the queue is empty or the next event is after until"
+        queue = self.queue
+        while queue:
+            if until is not None and queue[0][0] > until:
+                break
+            when, _, callback, args = heapq.heappop(queue)
+            self.now = when
+            callback(*args)
+            self.events += 1
+        if until is not None and until > self.now:
+            self.now = until
+
+
+class Packet:
+    __slots__ = ("src", "dst", "size", "flow", "sent", "ttl")
+
+    def __init__(self, src, dst, size, flow, sent):
+        self.src = src
+        self.dst = dst
+        self.size = size
+        self.flow = flow
+        self.sent = sent
+        self.ttl = DEFAULT_TTL
+
+
+# One direction of a link: a drop-tail queue in front of a transmitter
+class Port:
+
+    def __init__(self, sim, number, bandwidth, delay, queue_limit):
+        self.sim = sim
+        self.number = number
+        self.bandwidth = bandwidth
+        self.delay = delay
+        self.queue_limit = queue_limit
+        # (node, port number) at the other end
+        self.peer = None
+        self.up = True
+        self.busy = False
+        self.queue = deque()
+        self.sent = 0
+        self.bytes = 0
+        self.dropped = 0
+
+    def send(self, packet):
+        if not self.up or self.peer is None:
+            self.dropped += 1
+        elif not self.busy:
+            self._transmit(packet)
+        elif len(self.queue) < self.queue_limit:
+            self.queue.append(packet)
+        else:
+            self.dropped += 1
+
+    def _transmit(self, packet):
+        self.busy = True
+        self.sim.schedule(packet.size * 8 / self.bandwidth, self._transmitted, packet)
+
+    def _transmitted(self, packet):
+        self.sent += 1
+        self.bytes += packet.size
+        node, number = self.peer
+        self.sim.schedule(self.delay, node.receive, packet, number)
+        if self.queue:
+            self._transmit(self.queue.popleft())
+        else:
+            self.busy = False
+
+    def set_up(self, up):
+        self.up = up
+        if not up:
+            # whatever is still queued is lost with the link
+            self.dropped += len(self.queue)
+            self.queue.clear()
+
+
+class Switch:
+
+    def __init__(self, sim, dpid, name):
+        self.sim = sim
+        self.dpid = dpid
+        self.name = name
+        self.ports = {}
+        # (priority, address, mask, action), highest priority first
+        self.entries = []
+        # destination -> action, cleared whenever the table changes
+        self.cache = {}
+        self.controller = None
+        self.forwarded = 0
+        self.missed = 0
+        self.expired = 0
+
+    def set_entry(self, priority, address, mask, hop):
+        "Adds or replaces the entry for address/mask; hop is a port, (port, weight) pairs or None to delete"
+        address, mask = address_value(address), address_value(mask)
+        self.entries = [entry for entry in self.entries if entry[:3] != (priority, address & mask, mask)]
+        if hop is not None:
+            if isinstance(hop, tuple) and len(hop) == 1:
+                hop = hop[0][0]
+            if isinstance(hop, tuple):
+                # select group: ports and the running total of their weights
+                totals = []
+                total = 0
+                for _, weight in hop:
+                    total += weight
+                    totals.append(total)
+                hop = (tuple(port for port, _ in hop), tuple(totals))
+            self.entries.append((priority, address & mask, mask, hop))
+            self.entries.sort(key=lambda entry: -entry[0])
+        self.cache.clear()
+
+    def lookup(self, destination):
+        action = self.cache.get(destination, self)
+        if action is self:
+            action = None
+            for _, address, mask, hop in self.entries:
+                if destination & mask == address:
+                    action = hop
+                    break
+            self.cache[destination] = action
+        return action
+
+    def receive(self, packet, in_port):
+        packet.ttl -= 1
+        if packet.ttl <= 0:
+            self.expired += 1
+            return
+        action = self.lookup(packet.dst)
+        if action is None:
+            self.missed += 1
+            if self.controller is not None:
+                self.controller.packet_in(self, in_port, packet)
+            return
+        if type(action) is not int:
+            # hash the flow onto a bucket, salted per switch against polarization
+            ports, totals = action
+            point = hash((self.dpid, packet.src, packet.dst, packet.flow)) % totals[-1]
+            for port, total in zip(ports, totals):
+                if point < total:
+                    action = port
+                    break
+        self.forwarded += 1
+        self.ports[action].send(packet)
+
+
+class FlowStats:
+    __slots__ = ("sent", "received", "bytes", "latency", "first", "last")
+
+    def __init__(self):
+        self.sent = 0
+        self.received = 0
+        self.bytes = 0
+        self.latency = 0.0
+        self.first = None
+        self.last = None
+
+    def goodput(self):
+        "Returns the received bits per second between the first and the last packet"
+        if self.received < 2 or self.last == self.first:
+            return 0.0
+        return self.bytes * 8 / (self.last - self.first)
+
+
+class Host:
+
+    def __init__(self, sim, name, address):
+        self.sim = sim
+        self.name = name
+        self.address = address
+        self.value = address_value(address)
+        self.port = None
+        self.flows = {}
+        self.misdelivered = 0
+
+    def receive(self, packet, in_port):
+        if packet.dst != self.value:
+            self.misdelivered += 1
+            return
+        stats = self.flows.get(packet.flow)
+        if stats is None:
+            stats = self.flows[packet.flow] = FlowStats()
+        stats.received += 1
+        stats.bytes += packet.size
+        stats.latency += self.sim.now - packet.sent
+        if stats.first is None:
+            stats.first = self.sim.now
+        stats.last = self.sim.now
+
+    def start_flow(self, flow, destination, rate, size=DEFAULT_PACKET_SIZE, stop=None, stats=None):
+        "Sends size-byte packets to destination at rate bits per second until stop"
+        stats = stats if stats is not None else FlowStats()
+        self._send(flow, address_value(destination), size * 8 / rate, size, stop, stats)
+        return stats
+
+    def _send(self, flow, destination, interval, size, stop, stats):
+        if stop is not None and self.sim.now >= stop:
+            return
+        stats.sent += 1
+        self.port.send(Packet(self.value, destination, size, flow, self.sim.now))
+        self.sim.schedule(interval, self._send, flow, destination, interval, size, stop, stats)
+
+
+class FattreeNetwork:
+
+    def __init__(self, num_ports, bandwidth=DEFAULT_BANDWIDTH, delay=DEFAULT_DELAY,
+                 queue_limit=DEFAULT_QUEUE_LIMIT):
+        self.sim = Simulator()
+        self.index = index = FattreeIndex(num_ports)
+        self.nodes = []
+        for node in range(index.num_nodes):
+            if index.layer(node) == HOST:
+                self.nodes.append(Host(self.sim, index.name(node), index.address(node)))
+            else:
+                self.nodes.append(Switch(self.sim, index.dpid(node), index.name(node)))
+        for upper, lower in index.links():
+            for near, far in ((upper, lower), (lower, upper)):
+                port = Port(self.sim, index.port(near, far), bandwidth, delay, queue_limit)
+                port.peer = (self.nodes[far], index.port(far, near))
+                if index.layer(near) == HOST:
+                    self.nodes[near].port = port
+                else:
+                    self.nodes[near].ports[port.number] = port
+
+    def switch(self, dpid):
+        return self.nodes[self.index.node_of_dpid(dpid)]
+
+    def hosts(self):
+        return [self.nodes[node] for node in self.index.hosts()]
+
+    def switch_links(self):
+        "Yields (src dpid, src port, dst dpid) for every live directed switch link, as discovery reports them"
+        index = self.index
+        for node in index.switches():
+            for neighbor in index.neighbors(node):
+                if index.layer(neighbor) != HOST and self.nodes[node].ports[index.port(node, neighbor)].up:
+                    yield index.dpid(node), index.port(node, neighbor), index.dpid(neighbor)
+
+    def set_link(self, node, neighbor, up):
+        "Takes the link between two adjacent nodes down or brings it back, both directions"
+        for near, far in ((node, neighbor), (neighbor, node)):
+            if self.index.layer(near) == HOST:
+                self.nodes[near].port.set_up(up)
+            else:
+                self.nodes[near].ports[self.index.port(near, far)].set_up(up)
+
+    def install(self, tables):
+        "Writes {dpid: [(address, mask, next hop)]} tables into the switches"
+        for dpid, entries in tables.items():
+            switch = self.switch(dpid)
+            for address, mask, hop in entries:
+                switch.set_entry(routing.entry_priority(mask), address, mask, hop)
+
+    def dropped(self):
+        ports = []
+        for node in self.nodes:
+            ports.extend(node.ports.values() if isinstance(node, Switch) else [node.port])
+        return sum(port.dropped for port in ports)
+
+
+# SPRouter's part in the simulation
+class Controller:
+
+    def __init__(self, network, mode="shortest", control_delay=DEFAULT_CONTROL_DELAY):
+        index = network.index
+        self.state = routing.fattree_routing_state(index, mode)
+        self.network = network
+        self.mode = mode
+        self.control_delay = control_delay
+        self.packet_ins = 0
+        self.updates = 0
+        for node in index.switches():
+            network.nodes[node].controller = self
+        # discovery finds the whole fabric before anything is installed
+        for node in index.switches():
+            self.state.add_switch(index.dpid(node))
+        for src_dpid, src_port, dst_dpid in network.switch_links():
+            self.state.add_link(src_dpid, src_port, dst_dpid)
+        network.install(routing.proactive_tables(index, self.state, mode))
+
+    def packet_in(self, switch, in_port, packet):
+        self.packet_ins += 1
+
+    def link_down(self, node, neighbor):
+        self.network.set_link(node, neighbor, False)
+        if self.network.index.layer(node) == HOST or self.network.index.layer(neighbor) == HOST:
+            return
+        dpid, other = self.network.index.dpid(node), self.network.index.dpid(neighbor)
+        changes = self.state.remove_link(dpid, other)
+        for moved_dpid, moved in self.state.remove_link(other, dpid).items():
+            changes.setdefault(moved_dpid, {}).update(moved)
+        self._schedule(changes)
+
+    def link_up(self, node, neighbor):
+        self.network.set_link(node, neighbor, True)
+        if self.network.index.layer(node) == HOST or self.network.index.layer(neighbor) == HOST:
+            return
+        index = self.network.index
+        changes = {}
+        for near, far in ((node, neighbor), (neighbor, node)):
+            for moved_dpid, moved in self.state.add_link(index.dpid(near), index.port(near, far),
+                                                         index.dpid(far)).items():
+                changes.setdefault(moved_dpid, {}).update(moved)
+        self._schedule(changes)
+
+    def _schedule(self, changes):
+        # SPRouter re-issues the same entries, after the control delay here
+        entries = routing.route_entries(self.state, self.mode, changes)
+        if entries:
+            self.network.sim.schedule(self.control_delay, self._apply, entries)
+
+    def _apply(self, entries):
+        for dpid, changed in entries.items():
+            switch = self.network.switch(dpid)
+            for address, mask, hop in changed:
+                switch.set_entry(routing.entry_priority(mask), address, mask, hop)
+                self.updates += 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Packet-level simulation of the fat-tree fabric")
+    parser.add_argument("--k", default=4, type=int, help="switch ports (default: 4)")
+    parser.add_argument("--mode", default="shortest", choices=routing.ROUTING_MODES,
+                        help="routing mode (default: shortest)")
+    parser.add_argument("--duration", default=1.0, type=float, help="simulated seconds (default: 1)")
+    parser.add_argument("--rate", default=5e6, type=float,
+                        help="bits per second of every flow (default: 5e6)")
+    parser.add_argument("--bandwidth", default=DEFAULT_BANDWIDTH / 1e6, type=float,
+                        help="link bandwidth in Mbit/s (default: %g)" % (DEFAULT_BANDWIDTH / 1e6))
+    parser.add_argument("--delay", default=DEFAULT_DELAY * 1000, type=float,
+                        help="link delay in ms (default: %g)" % (DEFAULT_DELAY * 1000))
+    parser.add_argument("--queue", default=DEFAULT_QUEUE_LIMIT, type=int,
+                        help="packets per port queue (default: %d)" % DEFAULT_QUEUE_LIMIT)
+    parser.add_argument("--fail-at", default=None, type=float,
+                        help="take the first aggregation-core link down at this time")
+    parser.add_argument("--seed", default=None, type=int, help="seed of the permutation traffic")
+    args = parser.parse_args(argv)
+
+    if args.k < 2 or args.k % 2 != 0:
+        parser.error("the number of switch ports should be a positive even number, got %d" % args.k)
+    network = FattreeNetwork(args.k, args.bandwidth * 1e6, args.delay / 1000, args.queue)
+    controller = Controller(network, args.mode)
+    hosts = network.hosts()
+    rng = random.Random(args.seed)
+    destinations = list(range(len(hosts)))
+    rng.shuffle(destinations)
+    flows = {}
+    packet_time = DEFAULT_PACKET_SIZE * 8 / args.rate
+    for flow, (source, destination) in enumerate(enumerate(destinations)):
+        if source != destination:
+            # sender and receiver share the stats; the starts are spread over
+            # one packet interval so that the flows do not send in lockstep
+            flows[flow] = hosts[destination].flows[flow] = FlowStats()
+            network.sim.schedule(rng.random() * packet_time, hosts[source].start_flow, flow,
+                                 hosts[destination].address, args.rate, DEFAULT_PACKET_SIZE,
+                                 args.duration, flows[flow])
+    if args.fail_at is not None:
+        index = network.index
+        aggregation = index.aggregation_start
+        network.sim.schedule(args.fail_at, controller.link_down, aggregation, index.neighbors(aggregation)[-1])
+
+    started = time.perf_counter()
+    # let the last packets drain
+    network.sim.run(args.duration + 1.0)
+    elapsed = time.perf_counter() - started
+
+    sent = sum(stats.sent for stats in flows.values())
+    received = sum(stats.received for stats in flows.values())
+    latency = sum(stats.latency for stats in flows.values())
+    goodputs = [stats.goodput() for stats in flows.values()]
+    print("%d-ary fat-tree, %d flows, %s routing" % (args.k, len(flows), args.mode))
+    print("packets sent %d, received %d (%.2f%%), dropped %d, expired %d, packet-ins %d" % (
+        sent, received, 100.0 * received / sent if sent else 0.0, network.dropped(),
+        sum(node.expired for node in network.nodes if isinstance(node, Switch)), controller.packet_ins))
+    print("mean latency %.3f ms, mean goodput %.3f Mbit/s, route updates %d" % (
+        1000 * latency / received if received else 0.0,
+        sum(goodputs) / len(goodputs) / 1e6 if goodputs else 0.0, controller.updates))
+    print("%d events in %.2f s (%.0f events/s)" % (network.sim.events, elapsed, network.sim.events / elapsed),
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
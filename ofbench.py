@@ -0,0 +1,441 @@
+# Copyright 2021 Lin Wang
+
+# This code is part of the Advanced Computer Networks course at Vrije
+# Universiteit Amsterdam.
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+
+#   http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# !/usr/bin/env python3
+
+# cbench-style load test for an OpenFlow 1.3 controller such as SPRouter.
+# With the controller running (ryu-manager sp_routing.py), e.g.
+#
+#   python3 ofbench.py --k 8 --switches 32 --duration 10 --mix arp:2,icmp:1,ipv4:1
+#
+# The simulated datapaths are the edge switches of the fat-tree (DPIDs 1 up to
+# k*k/2), so the controller sees every host behind the switch it belongs to.
+#
+# Every simulated datapath opens its own TCP connection. It completes the
+# handshake (HELLO, FEATURES, port description), answers ECHO and BARRIER
+# requests, and then replays packet-ins drawn from the mix. Each packet-in
+# carries a unique token at the end of its frame. That token is used to match
+# the packet-outs that carry the frame back out, on whichever switch
+# connection they arrive. Controller-generated ARP replies are matched by
+# (requester, target) address pair. Flow mods are matched to the oldest
+# unanswered packet-in of their switch, as cbench does for reactive
+# controllers.
+#
+# Every switch keeps at most --window packet-ins unanswered: 1 measures
+# latency (cbench latency mode), a larger window measures throughput.
+# Packet-ins still unanswered after --timeout seconds are counted as lost.
+
+import argparse
+import asyncio
+import math
+import random
+import struct
+import sys
+import time
+from collections import Counter, deque
+
+import packet_classifier
+from bench_packet_in import arp_request, ipv4_frame
+from fattree_index import FattreeIndex
+
+OFP_VERSION = 4
+
+OFPT_HELLO = 0
+OFPT_ERROR = 1
+OFPT_ECHO_REQUEST = 2
+OFPT_ECHO_REPLY = 3
+OFPT_FEATURES_REQUEST = 5
+OFPT_FEATURES_REPLY = 6
+OFPT_GET_CONFIG_REQUEST = 7
+OFPT_GET_CONFIG_REPLY = 8
+OFPT_PACKET_IN = 10
+OFPT_PACKET_OUT = 13
+OFPT_FLOW_MOD = 14
+OFPT_MULTIPART_REQUEST = 18
+OFPT_MULTIPART_REPLY = 19
+OFPT_BARRIER_REQUEST = 20
+OFPT_BARRIER_REPLY = 21
+
+OFPMP_PORT_DESC = 13
+OFP_NO_BUFFER = 0xffffffff
+OFPXMT_OFB_IN_PORT_HEADER = 0x80000004
+
+HEADER = struct.Struct("!BBHI")
+FRAME_TAIL = struct.Struct("!4sI")
+TOKEN_MAGIC = b"OFBN"
+# Ethernet frames are at least 60 bytes without the FCS
+MIN_FRAME = 60
+
+PACKET_KINDS = ("arp", "icmp", "ipv4")
+DEFAULT_MIX = "arp:1,icmp:1,ipv4:1"
+# seconds the controller has to complete the handshake with every switch
+DEFAULT_HANDSHAKE_TIMEOUT = 10.0
+
+
+def message(msg_type, xid, body=b""):
+    return HEADER.pack(OFP_VERSION, msg_type, HEADER.size + len(body), xid) + body
+
+
+def features_reply(xid, dpid, num_tables=254):
+    return message(OFPT_FEATURES_REPLY, xid, struct.pack("!QIBB2xII", dpid, 0, num_tables, 0, 0x4f, 0))
+
+
+def port_desc_reply(xid, dpid, num_ports):
+    body = struct.pack("!HH4x", OFPMP_PORT_DESC, 0)
+    for port_no in range(1, num_ports + 1):
+        hw_addr = struct.pack("!HI", dpid & 0xffff, port_no)
+        name = ("s%d-eth%d" % (dpid - 1, port_no)).encode()[:15]
+        # 10 Gbit/s copper, link up
+        body += struct.pack("!I4x6s2x16sIIIIIIII", port_no, hw_addr, name, 0, 0, 0x2040, 0x2040, 0x2040, 0,
+                            10000000, 10000000)
+    return message(OFPT_MULTIPART_REPLY, xid, body)
+
+
+def packet_in(xid, in_port, data):
+    match = struct.pack("!HHII4x", 1, 12, OFPXMT_OFB_IN_PORT_HEADER, in_port)
+    body = struct.pack("!IHBBQ", OFP_NO_BUFFER, len(data), 0, 0, 0) + match + b"\x00\x00" + data
+    return message(OFPT_PACKET_IN, xid, body)
+
+
+def packet_out_data(body):
+    "Returns the frame carried by a PACKET_OUT body"
+    _, _, actions_len = struct.unpack_from("!IIH", body, 0)
+    return body[16 + actions_len:]
+
+
+def frame_token(data):
+    "Returns the benchmark token at the end of a frame, or None"
+    if len(data) < FRAME_TAIL.size:
+        return None
+    magic, token = FRAME_TAIL.unpack_from(data, len(data) - FRAME_TAIL.size)
+    return token if magic == TOKEN_MAGIC else None
+
+
+def parse_mix(text):
+    "Parses 'arp:2,icmp:1' into (kinds, weights)"
+    kinds = []
+    weights = []
+    for part in text.split(","):
+        kind, _, weight = part.partition(":")
+        if kind not in PACKET_KINDS:
+            raise ValueError("packet kind should be one of %s, got %r" % (", ".join(PACKET_KINDS), kind))
+        kinds.append(kind)
+        weights.append(float(weight or 1))
+    return kinds, weights
+
+
+def percentile(ordered, fraction):
+    "Nearest-rank percentile of an ordered list"
+    if not ordered:
+        return float("nan")
+    rank = math.ceil(fraction * len(ordered))
+    return ordered[min(len(ordered) - 1, max(0, rank - 1))]
+
+
+class BenchError(Exception):
+    pass
+
+
+class Bench:
+
+    def __init__(self, num_switches, num_ports, index, mix, window, timeout, seed=None,
+                 handshake_timeout=DEFAULT_HANDSHAKE_TIMEOUT):
+        if num_switches > index.num_edge:
+            raise ValueError("a k=%d fat-tree has %d edge switches, got %d switches"
+                             % (index.k, index.num_edge, num_switches))
+        self.num_switches = num_switches
+        self.num_ports = num_ports
+        self.index = index
+        self.kinds, self.weights = mix
+        self.window = window
+        self.timeout = timeout
+        self.handshake_timeout = handshake_timeout
+        self.rng = random.Random(seed)
+        self.running = False
+        # token -> (send time, dpid, kind)
+        self.outstanding = {}
+        # dpid -> tokens in send order, for matching flow mods
+        self.fifo = {}
+        # (requester ip, target ip) -> token of the latest ARP request
+        self.arp_pending = {}
+        self.unanswered = {}
+        self.wakeups = {}
+        self.next_token = 1
+        # packet-ins sent before this time belong to the warmup
+        self.measure_from = 0.0
+        self.sent = Counter()
+        self.answered = Counter()
+        self.lost = Counter()
+        self.received = Counter()
+        self.latencies = {kind: [] for kind in PACKET_KINDS}
+        self.handshakes = []
+
+    def hosts_of(self, dpid):
+        "Returns (address, MAC, edge port) of the fat-tree hosts the switch sends packet-ins for"
+        index = self.index
+        # DPIDs follow FattreeIndex, the first num_edge switches are the edge switches
+        edge = index.node_of_dpid(dpid)
+        result = []
+        for host in index.neighbors(edge)[:index.half]:
+            number = host - index.host_start
+            mac = "00:00:00:%02x:%02x:%02x" % (number >> 16 & 0xff, number >> 8 & 0xff, number & 0xff)
+            result.append((index.address(host), mac, index.port(edge, host)))
+        return result
+
+    def frame(self, kind, source, token):
+        address, mac, _ = source
+        target = self.index.address(self.rng.choice(self.index.hosts()))
+        tail = FRAME_TAIL.pack(TOKEN_MAGIC, token)
+        if kind == "arp":
+            data = arp_request(mac, address, target)
+            # the token sits in the Ethernet padding
+            data += bytes(max(0, MIN_FRAME - len(data) - len(tail))) + tail
+            return data, (address, target)
+        if kind == "icmp":
+            payload = struct.pack("!BBHHH", 8, 0, 0, 1, token & 0xffff) + bytes(48) + tail
+            return ipv4_frame(mac, "00:00:00:00:00:fe", address, target, 1, payload), None
+        payload = struct.pack("!HH4x", 40000, 5001) + tail
+        return ipv4_frame(mac, "00:00:00:00:00:fe", address, target, 17, payload), None
+
+    def answer(self, token, kind_of_response):
+        sent = self.outstanding.pop(token, None)
+        if sent is None:
+            return
+        sent_at, dpid, kind = sent
+        if sent_at >= self.measure_from:
+            self.latencies[kind].append(time.perf_counter() - sent_at)
+            self.answered[kind_of_response] += 1
+        self.unanswered[dpid] -= 1
+        self.wakeups[dpid].set()
+
+    def handle_response(self, dpid, msg_type, body):
+        if msg_type == OFPT_PACKET_OUT:
+            self.received["packet_out"] += 1
+            data = packet_out_data(body)
+            token = frame_token(data)
+            if token is None:
+                eth_type, header = packet_classifier.classify(data)
+                if eth_type == packet_classifier.ETH_TYPE_ARP and header is not None:
+                    token = self.arp_pending.pop((header.dst_ip, header.src_ip), None)
+            if token is not None:
+                self.answer(token, "packet_out")
+        elif msg_type == OFPT_FLOW_MOD:
+            self.received["flow_mod"] += 1
+            fifo = self.fifo.get(dpid)
+            while fifo:
+                token = fifo.popleft()
+                if token in self.outstanding:
+                    self.answer(token, "flow_mod")
+                    break
+
+    async def expire(self):
+        while self.running:
+            await asyncio.sleep(min(0.1, self.timeout))
+            horizon = time.perf_counter() - self.timeout
+            for token in [token for token, sent in self.outstanding.items() if sent[0] < horizon]:
+                sent_at, dpid, kind = self.outstanding.pop(token)
+                if sent_at >= self.measure_from:
+                    self.lost[kind] += 1
+                self.unanswered[dpid] -= 1
+                self.wakeups[dpid].set()
+
+    async def switch(self, host, port, dpid, ready):
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+        except OSError as error:
+            if not ready.done():
+                ready.set_exception(BenchError("switch %d cannot connect to %s:%d: %s" % (dpid, host, port, error)))
+            return
+        started = time.perf_counter()
+        writer.write(message(OFPT_HELLO, 0))
+        handshake = asyncio.get_running_loop().create_future()
+        self.unanswered[dpid] = 0
+        self.wakeups[dpid] = asyncio.Event()
+        self.fifo[dpid] = deque()
+
+        async def receive():
+            while True:
+                header = await reader.readexactly(HEADER.size)
+                _, msg_type, length, xid = HEADER.unpack(header)
+                body = await reader.readexactly(length - HEADER.size)
+                if msg_type == OFPT_ECHO_REQUEST:
+                    writer.write(message(OFPT_ECHO_REPLY, xid, body))
+                elif msg_type == OFPT_FEATURES_REQUEST:
+                    writer.write(features_reply(xid, dpid))
+                    # controllers that do not ask for the port description are ready now
+                    asyncio.get_running_loop().call_later(1.0, lambda: handshake.done() or handshake.set_result(None))
+                elif msg_type == OFPT_MULTIPART_REQUEST:
+                    kind, = struct.unpack_from("!H", body, 0)
+                    if kind == OFPMP_PORT_DESC:
+                        writer.write(port_desc_reply(xid, dpid, self.num_ports))
+                        if not handshake.done():
+                            handshake.set_result(None)
+                    else:
+                        writer.write(message(OFPT_MULTIPART_REPLY, xid, struct.pack("!HH4x", kind, 0)))
+                elif msg_type == OFPT_GET_CONFIG_REQUEST:
+                    writer.write(message(OFPT_GET_CONFIG_REPLY, xid, struct.pack("!HH", 0, 0xffff)))
+                elif msg_type == OFPT_BARRIER_REQUEST:
+                    writer.write(message(OFPT_BARRIER_REPLY, xid))
+                elif msg_type in (OFPT_PACKET_OUT, OFPT_FLOW_MOD) and self.running:
+                    self.handle_response(dpid, msg_type, body)
+
+        receiver = asyncio.ensure_future(receive())
+        await asyncio.wait([handshake, receiver], return_when=asyncio.FIRST_COMPLETED)
+        if not handshake.done():
+            # the controller hung up (or sent garbage) before the handshake was over
+            error = receiver.exception() or "connection closed"
+            if not ready.done():
+                ready.set_exception(BenchError("switch %d lost the controller during the handshake: %s"
+                                               % (dpid, error)))
+            writer.close()
+            return
+        self.handshakes.append(time.perf_counter() - started)
+        if not ready.done():
+            ready.set_result(None)
+        await self.started.wait()
+
+        sources = self.hosts_of(dpid)
+        xid = 1
+        while self.running:
+            if self.unanswered[dpid] >= self.window:
+                self.wakeups[dpid].clear()
+                await self.wakeups[dpid].wait()
+                continue
+            kind = self.rng.choices(self.kinds, self.weights)[0]
+            source = self.rng.choice(sources)
+            token = self.next_token
+            self.next_token += 1
+            data, arp_key = self.frame(kind, source, token)
+            if arp_key is not None:
+                self.arp_pending[arp_key] = token
+            self.outstanding[token] = (time.perf_counter(), dpid, kind)
+            self.fifo[dpid].append(token)
+            self.unanswered[dpid] += 1
+            self.sent[kind] += 1
+            writer.write(packet_in(xid, source[2], data))
+            xid += 1
+            # let the receiver and the other switches run
+            await writer.drain()
+        receiver.cancel()
+        writer.close()
+
+    async def run(self, host, port, duration, warmup):
+        self.started = asyncio.Event()
+        readies = [asyncio.get_running_loop().create_future() for _ in range(self.num_switches)]
+        switches = [asyncio.ensure_future(self.switch(host, port, dpid, ready))
+                    for dpid, ready in enumerate(readies, 1)]
+        try:
+            await asyncio.wait_for(asyncio.gather(*readies), self.handshake_timeout)
+        except (BenchError, asyncio.TimeoutError) as error:
+            for switch in switches:
+                switch.cancel()
+            await asyncio.gather(*switches, return_exceptions=True)
+            # one failure is reported, the others would only repeat it
+            for ready in readies:
+                if ready.done() and not ready.cancelled():
+                    ready.exception()
+            if isinstance(error, BenchError):
+                raise
+            done = sum(1 for ready in readies if ready.done() and not ready.cancelled())
+            raise BenchError("%d of %d switches completed the handshake within %.0f s"
+                             % (done, self.num_switches, self.handshake_timeout))
+        self.running = True
+        expirer = asyncio.ensure_future(self.expire())
+        self.started.set()
+        if warmup:
+            await asyncio.sleep(warmup)
+            self.reset()
+        started = time.perf_counter()
+        await asyncio.sleep(duration)
+        self.running = False
+        elapsed = time.perf_counter() - started
+        for dpid in self.wakeups:
+            self.wakeups[dpid].set()
+        await asyncio.gather(*switches, return_exceptions=True)
+        expirer.cancel()
+        return elapsed
+
+    def reset(self):
+        "Forgets everything measured so far, answers to earlier packet-ins are no longer counted"
+        self.measure_from = time.perf_counter()
+        self.sent.clear()
+        self.answered.clear()
+        self.lost.clear()
+        self.received.clear()
+        for latencies in self.latencies.values():
+            del latencies[:]
+
+    def report(self, elapsed, output=sys.stdout):
+        sent = sum(self.sent.values())
+        answered = sum(self.answered.values())
+        print("%d switches, handshakes done in %.3f s (slowest)" % (self.num_switches, max(self.handshakes)),
+              file=output)
+        print("packet-ins sent %d, answered %d, lost %d" % (sent, answered, sum(self.lost.values())), file=output)
+        print("throughput %.0f answered packet-ins/s, %.0f flow mods/s, %.0f packet-outs/s" % (
+            answered / elapsed, self.received["flow_mod"] / elapsed, self.received["packet_out"] / elapsed),
+            file=output)
+        everything = sorted(latency for latencies in self.latencies.values() for latency in latencies)
+        for kind, latencies in [("all", everything)] + sorted(self.latencies.items()):
+            ordered = sorted(latencies)
+            if not ordered:
+                continue
+            print("latency %-4s p50 %.3f ms, p90 %.3f ms, p99 %.3f ms, max %.3f ms (%d samples)" % (
+                kind, 1000 * percentile(ordered, 0.5), 1000 * percentile(ordered, 0.9),
+                1000 * percentile(ordered, 0.99), 1000 * ordered[-1], len(ordered)), file=output)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test an OpenFlow 1.3 controller with simulated switches")
+    parser.add_argument("--controller", default="127.0.0.1", help="controller address (default: 127.0.0.1)")
+    parser.add_argument("--port", default=6653, type=int, help="controller port (default: 6653)")
+    parser.add_argument("--switches", default=None, type=int,
+                        help="simulated edge switches, at most k*k/2 (default: all edge switches)")
+    parser.add_argument("--k", default=4, type=int,
+                        help="fat-tree whose addresses and port count the switches use (default: 4)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, type=parse_mix,
+                        help="packet-in kinds and weights (default: %s)" % DEFAULT_MIX)
+    parser.add_argument("--window", default=1, type=int,
+                        help="unanswered packet-ins per switch, 1 for latency mode (default: 1)")
+    parser.add_argument("--duration", default=10.0, type=float, help="measured seconds (default: 10)")
+    parser.add_argument("--warmup", default=1.0, type=float, help="seconds not measured (default: 1)")
+    parser.add_argument("--timeout", default=1.0, type=float,
+                        help="seconds after which a packet-in counts as lost (default: 1)")
+    parser.add_argument("--seed", default=None, type=int, help="seed of the packet-in mix")
+    parser.add_argument("--handshake-timeout", default=DEFAULT_HANDSHAKE_TIMEOUT, type=float,
+                        help="seconds the controller has to complete all handshakes (default: %.0f)"
+                             % DEFAULT_HANDSHAKE_TIMEOUT)
+    args = parser.parse_args(argv)
+
+    if args.k < 2 or args.k % 2 != 0:
+        parser.error("the number of switch ports should be a positive even number, got %d" % args.k)
+    index = FattreeIndex(args.k)
+    if args.switches is None:
+        args.switches = index.num_edge
+    if not 1 <= args.switches <= index.num_edge:
+        parser.error("a k=%d fat-tree has %d edge switches, got --switches %d"
+                     % (args.k, index.num_edge, args.switches))
+    bench = Bench(args.switches, args.k, index, args.mix, args.window, args.timeout, args.seed,
+                  args.handshake_timeout)
+    try:
+        elapsed = asyncio.run(bench.run(args.controller, args.port, args.duration, args.warmup))
+    except BenchError as error:
+        sys.exit("ofbench: %s" % error)
+    bench.report(elapsed)
+
+
+if __name__ == "__main__":
+    main()
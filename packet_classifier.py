@@ -0,0 +1,110 @@
+# Copyright 2021 Lin Wang
+
+# This code is part of the Advanced Computer Networks course at Vrije
+# Universiteit Amsterdam.
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+
+#   http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Header peeking for SPRouter's packet-in handler. Instead of decoding the
+# whole frame with ryu.lib.packet, classify() reads the EtherType (behind at
+# most one VLAN tag) and the few ARP or IPv4 fields the controller uses
+# straight from the raw buffer. The handler dispatches on the returned
+# EtherType and only the matching handler looks at the header tuple.
+#
+# Addresses come back as the same strings ryu.lib.packet produces
+# ("10.0.0.2", "00:00:00:00:00:01"), so the results can be used as keys of
+# the controller's existing tables.
+
+import struct
+from collections import namedtuple
+from socket import inet_ntoa
+
+ETH_TYPE_IP = 0x0800
+ETH_TYPE_ARP = 0x0806
+ETH_TYPE_8021Q = 0x8100
+ETH_TYPE_LLDP = 0x88cc
+
+ETH_HEADER_LEN = 14
+VLAN_HEADER_LEN = 4
+ARP_HEADER_LEN = 28
+IPV4_HEADER_LEN = 20
+
+# field names match ryu.lib.packet.arp.arp and ryu.lib.packet.ipv4.ipv4
+ArpHeader = namedtuple("ArpHeader", ["opcode", "src_mac", "src_ip", "dst_mac", "dst_ip"])
+Ipv4Header = namedtuple("Ipv4Header", ["src", "dst", "proto", "ttl"])
+
+_ETHERTYPE = struct.Struct("!H")
+# hardware type, protocol type, lengths, opcode, sender MAC/IP, target MAC/IP
+_ARP = struct.Struct("!HHBBH6s4s6s4s")
+# version/IHL, TTL and protocol, then source and destination addresses
+_IPV4_VERSION = struct.Struct("!B")
+_IPV4_TAIL = struct.Struct("!BB2x4s4s")
+
+
+def mac_text(raw):
+    "Formats 6 raw bytes as a colon separated MAC address"
+    return "%02x:%02x:%02x:%02x:%02x:%02x" % tuple(raw)
+
+
+def ethertype(data):
+    "Returns (EtherType, offset of the payload) of an Ethernet frame, or (None, 0) if it is too short"
+    if len(data) < ETH_HEADER_LEN:
+        return None, 0
+    eth_type, = _ETHERTYPE.unpack_from(data, 12)
+    offset = ETH_HEADER_LEN
+    if eth_type == ETH_TYPE_8021Q and len(data) >= ETH_HEADER_LEN + VLAN_HEADER_LEN:
+        eth_type, = _ETHERTYPE.unpack_from(data, 16)
+        offset += VLAN_HEADER_LEN
+    return eth_type, offset
+
+
+def parse_arp(data, offset):
+    "Returns the ArpHeader at offset, or None for a truncated or non IPv4-over-Ethernet ARP"
+    if len(data) < offset + ARP_HEADER_LEN:
+        return None
+    hw_type, proto_type, hw_len, proto_len, opcode, src_mac, src_ip, dst_mac, dst_ip = \
+        _ARP.unpack_from(data, offset)
+    if hw_len != 6 or proto_len != 4 or proto_type != ETH_TYPE_IP:
+        return None
+    return ArpHeader(opcode, mac_text(src_mac), inet_ntoa(src_ip), mac_text(dst_mac), inet_ntoa(dst_ip))
+
+
+def parse_ipv4(data, offset):
+    "Returns the Ipv4Header at offset, or None for a truncated or non-IPv4 header"
+    if len(data) < offset + IPV4_HEADER_LEN:
+        return None
+    version, = _IPV4_VERSION.unpack_from(data, offset)
+    if version >> 4 != 4:
+        return None
+    ttl, proto, src, dst = _IPV4_TAIL.unpack_from(data, offset + 8)
+    return Ipv4Header(inet_ntoa(src), inet_ntoa(dst), proto, ttl)
+
+
+_PARSERS = {
+    ETH_TYPE_ARP: parse_arp,
+    ETH_TYPE_IP: parse_ipv4,
+}
+
+
+def classify(data):
+    """
+    Returns (EtherType, header) of a raw frame. header is an ArpHeader or an
+    Ipv4Header for the two protocols the controller handles and None for
+    everything else, including truncated frames
+    """
+    data = memoryview(data)
+    eth_type, offset = ethertype(data)
+    parser = _PARSERS.get(eth_type)
+    if parser is None:
+        return eth_type, None
+    return eth_type, parser(data, offset)
@@ -0,0 +1,263 @@
+# Copyright 2021 Lin Wang
+
+# This code is part of the Advanced Computer Networks course at Vrije
+# Universiteit Amsterdam.
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+
+#   http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Path diversity of topo.Fattree and topo.Jellyfish under random permutation
+# traffic, as in Figure 9 of the Jellyfish paper: for every flow we compute the
+# k shortest paths (Yen) and the ECMP equal-cost paths between the switches of
+# its two servers, and count on how many distinct paths every switch link is.
+#
+# Paths are computed on the switch graph. The BFS distances towards a
+# destination switch are computed once and shared by every flow to that
+# destination: ECMP walks them directly and Yen's spur searches use them as an
+# A* heuristic. Spur paths are cached as well, keyed by the spur switch, the
+# destination and the nodes and links the search had to avoid, so a spur search
+# that another query (or an earlier round of the same one) already ran is not
+# repeated. Flows are sorted by destination and split across a process pool so
+# that each worker keeps reusing the same distance tables and spur paths.
+
+import heapq
+import random
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from shortest_paths import switch_csr, server_switches
+
+DEFAULT_K = 8
+DEFAULT_ECMP_LIMIT = 64
+
+# distance tables kept per process, one per destination switch
+DISTANCE_CACHE_SIZE = 4096
+# spur paths kept per process
+SPUR_CACHE_SIZE = 65536
+
+
+class PathEngine:
+
+    def __init__(self, offsets, neighbors):
+        offsets = [int(offset) for offset in offsets]
+        neighbors = [int(neighbor) for neighbor in neighbors]
+        self.adjacency = [neighbors[offsets[node]:offsets[node + 1]] for node in range(len(offsets) - 1)]
+        self.distance_cache = OrderedDict()
+        # (spur, target, blocked nodes, blocked edges) -> spur path or None
+        self.spur_cache = OrderedDict()
+        self.path_cache = {}
+
+    def distances_to(self, target):
+        "Returns BFS hop counts from every switch to target (None if unreachable)"
+        distances = self.distance_cache.get(target)
+        if distances is not None:
+            self.distance_cache.move_to_end(target)
+            return distances
+        distances = [None] * len(self.adjacency)
+        distances[target] = 0
+        frontier = [target]
+        while frontier:
+            next_frontier = []
+            for node in frontier:
+                for neighbor in self.adjacency[node]:
+                    if distances[neighbor] is None:
+                        distances[neighbor] = distances[node] + 1
+                        next_frontier.append(neighbor)
+            frontier = next_frontier
+        self.distance_cache[target] = distances
+        if len(self.distance_cache) > DISTANCE_CACHE_SIZE:
+            self.distance_cache.popitem(last=False)
+        return distances
+
+    def ecmp_paths(self, source, target, limit=DEFAULT_ECMP_LIMIT):
+        "Returns up to limit equal-cost shortest paths from source to target"
+        distances = self.distances_to(target)
+        if distances[source] is None:
+            return []
+        paths = []
+        stack = [(source,)]
+        while stack and len(paths) < limit:
+            path = stack.pop()
+            node = path[-1]
+            if node == target:
+                paths.append(path)
+                continue
+            # push in reverse so paths come out in neighbor order
+            for neighbor in reversed(self.adjacency[node]):
+                if distances[neighbor] == distances[node] - 1:
+                    stack.append(path + (neighbor,))
+        return paths
+
+    def random_shortest_path(self, source, target, rng=random):
+        "Returns one shortest path, choosing uniformly among the next hops at every switch as ECMP hashing does"
+        distances = self.distances_to(target)
+        if distances[source] is None:
+            return None
+        path = [source]
+        node = source
+        while node != target:
+            node = rng.choice([neighbor for neighbor in self.adjacency[node]
+                               if distances[neighbor] == distances[node] - 1])
+            path.append(node)
+        return tuple(path)
+
+    def _spur_path(self, spur, target, blocked_nodes, blocked_edges):
+        key = (spur, target, blocked_nodes, blocked_edges)
+        if key in self.spur_cache:
+            self.spur_cache.move_to_end(key)
+            return self.spur_cache[key]
+        path = self._search_spur_path(spur, target, blocked_nodes, blocked_edges)
+        self.spur_cache[key] = path
+        if len(self.spur_cache) > SPUR_CACHE_SIZE:
+            self.spur_cache.popitem(last=False)
+        return path
+
+    def _search_spur_path(self, spur, target, blocked_nodes, blocked_edges):
+        # A* search, the unrestricted distances to target are an admissible heuristic
+        distances = self.distances_to(target)
+        if distances[spur] is None:
+            return None
+        parents = {spur: None}
+        costs = {spur: 0}
+        heap = [(distances[spur], 0, spur)]
+        while heap:
+            _, cost, node = heapq.heappop(heap)
+            if node == target:
+                path = []
+                while node is not None:
+                    path.append(node)
+                    node = parents[node]
+                return tuple(reversed(path))
+            if cost > costs[node]:
+                continue
+            for neighbor in self.adjacency[node]:
+                if neighbor in blocked_nodes or (node, neighbor) in blocked_edges:
+                    continue
+                if distances[neighbor] is None:
+                    continue
+                if neighbor not in costs or cost + 1 < costs[neighbor]:
+                    costs[neighbor] = cost + 1
+                    parents[neighbor] = node
+                    heapq.heappush(heap, (cost + 1 + distances[neighbor], cost + 1, neighbor))
+        return None
+
+    def k_shortest_paths(self, source, target, k=DEFAULT_K):
+        "Returns up to k loop-free shortest paths from source to target (Yen's algorithm)"
+        key = (source, target, k)
+        if key in self.path_cache:
+            return self.path_cache[key]
+        first = self.ecmp_paths(source, target, 1)
+        if not first:
+            self.path_cache[key] = []
+            return []
+        paths = [first[0]]
+        seen = {first[0]}
+        candidates = []
+        while len(paths) < k:
+            last = paths[-1]
+            for position in range(len(last) - 1):
+                spur = last[position]
+                root = last[:position + 1]
+                blocked_edges = frozenset((path[position], path[position + 1]) for path in paths
+                                          if path[:position + 1] == root)
+                blocked_nodes = frozenset(root[:-1])
+                spur_path = self._spur_path(spur, target, blocked_nodes, blocked_edges)
+                if spur_path is None:
+                    continue
+                candidate = root[:-1] + spur_path
+                if candidate not in seen:
+                    seen.add(candidate)
+                    heapq.heappush(candidates, (len(candidate), candidate))
+            if not candidates:
+                break
+            paths.append(heapq.heappop(candidates)[1])
+        self.path_cache[key] = paths
+        return paths
+
+
+def permutation_traffic(num_servers, rng=random):
+    "Returns (source, destination) server pairs of a random permutation without self-flows"
+    destinations = list(range(num_servers))
+    if num_servers < 2:
+        return []
+    while True:
+        rng.shuffle(destinations)
+        if all(source != destination for source, destination in enumerate(destinations)):
+            return list(enumerate(destinations))
+
+
+def _count_links(engine, flows, k, ecmp_limit):
+    ksp_counts = Counter()
+    ecmp_counts = Counter()
+    for source, target in flows:
+        for path in engine.k_shortest_paths(source, target, k):
+            ksp_counts.update(zip(path, path[1:]))
+        for path in engine.ecmp_paths(source, target, ecmp_limit):
+            ecmp_counts.update(zip(path, path[1:]))
+    return ksp_counts, ecmp_counts
+
+
+_worker_engine = None
+
+
+def _init_worker(offsets, neighbors):
+    global _worker_engine
+    _worker_engine = PathEngine(offsets, neighbors)
+
+
+def _count_links_in_worker(flows, k, ecmp_limit):
+    return _count_links(_worker_engine, flows, k, ecmp_limit)
+
+
+def link_path_counts(topology, k=DEFAULT_K, ecmp_limit=DEFAULT_ECMP_LIMIT, seed=None, workers=None,
+                     chunk=256):
+    """
+    Routes one random permutation of the servers and returns two Counters,
+    for k-shortest-paths and ECMP, mapping each directed switch link to the
+    number of distinct paths it is on
+    """
+    offsets, neighbors = switch_csr(topology)
+    attached = server_switches(topology)
+    rng = random.Random(seed)
+    flows = []
+    for source, destination in permutation_traffic(len(attached), rng):
+        lswitch, rswitch = int(attached[source]), int(attached[destination])
+        # flows between servers of the same switch do not cross any switch link
+        if lswitch >= 0 and rswitch >= 0 and lswitch != rswitch:
+            flows.append((lswitch, rswitch))
+    flows.sort(key=lambda flow: (flow[1], flow[0]))
+
+    if workers == 1 or len(flows) <= chunk:
+        return _count_links(PathEngine(offsets, neighbors), flows, k, ecmp_limit)
+
+    ksp_counts = Counter()
+    ecmp_counts = Counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(offsets, neighbors)) as executor:
+        futures = [executor.submit(_count_links_in_worker, flows[first:first + chunk], k, ecmp_limit)
+                   for first in range(0, len(flows), chunk)]
+        for future in futures:
+            ksp_part, ecmp_part = future.result()
+            ksp_counts.update(ksp_part)
+            ecmp_counts.update(ecmp_part)
+    return ksp_counts, ecmp_counts
+
+
+def link_rank_distribution(topology, counts):
+    "Returns the path count of every directed switch link in ascending order, unused links included"
+    offsets, neighbors = switch_csr(topology)
+    result = []
+    for node in range(len(offsets) - 1):
+        for neighbor in neighbors[offsets[node]:offsets[node + 1]]:
+            result.append(counts.get((node, int(neighbor)), 0))
+    result.sort()
+    return result
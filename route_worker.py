@@ -0,0 +1,189 @@
+# Copyright 2021 Lin Wang
+
+# This code is part of the Advanced Computer Networks course at Vrije
+# Universiteit Amsterdam.
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+
+#   http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Keeps SPRouter's event loop free while routes are computed, and keeps
+# packet-ins from piling up behind the computations.
+#
+# RouteWorker drives a deferred routing.RoutingState: topology events only
+# update the graph and mark the destinations to recompute, and schedule()
+# sends a snapshot of the graph with the dirty destinations to a process
+# pool. One computation is in flight at a time. When a newer event arrives
+# meanwhile, a computation that has not started yet is cancelled, and the
+# result of one that has is thrown away once it comes back; either way the
+# next computation covers everything that is dirty by then. Small graphs are
+# computed inline, where shipping the graph to a process costs more than the
+# BFS itself.
+#
+# PacketInQueue is a bounded queue of packet-ins, one FIFO per switch, drained
+# round robin so that one busy switch cannot starve the others. A full queue
+# refuses new packet-ins; the controller lets go of their switch buffers and
+# the hosts retransmit once the load is gone.
+
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import routing
+
+# graphs with fewer switches are computed inline
+DEFAULT_OFFLOAD_SWITCHES = 200
+
+DEFAULT_QUEUE_CAPACITY = 1024
+DEFAULT_SWITCH_CAPACITY = 128
+
+
+class RouteWorker:
+
+    def __init__(self, state, workers=2, offload_switches=DEFAULT_OFFLOAD_SWITCHES, executor=None):
+        self.state = state
+        self.offload_switches = offload_switches
+        self.executor = executor
+        if self.executor is None and workers > 0:
+            # a fresh interpreter, the controller's event loop is not fork safe
+            self.executor = ProcessPoolExecutor(max_workers=workers,
+                                                mp_context=multiprocessing.get_context("spawn"))
+        # (generation, future) of the computation in flight
+        self.running = None
+        self.submitted = 0
+        self.cancelled = 0
+        self.stale = 0
+        self.inline = 0
+
+    def busy(self):
+        "Returns whether routes are still being computed or wait to be"
+        return self.running is not None or bool(self.state.dirty)
+
+    def schedule(self):
+        """
+        Starts computing the dirty destinations, unless the computation in
+        flight is for the current graph. Returns the changed next hops if the
+        computation ran inline, {} otherwise
+        """
+        state = self.state
+        if not state.dirty:
+            return {}
+        if self.running is not None:
+            generation, future = self.running
+            if generation == state.generation:
+                return {}
+            if not future.cancel():
+                # already running, poll() throws its result away and starts over
+                return {}
+            self.cancelled += 1
+            self.running = None
+        generation, adjacency, reverse, destinations = state.snapshot()
+        if self.executor is None or len(adjacency) < self.offload_switches:
+            self.inline += 1
+            return state.apply_paths(routing.compute_paths(adjacency, reverse, destinations, state.multipath))
+        future = self.executor.submit(routing.compute_paths, adjacency, reverse, destinations, state.multipath)
+        self.running = (generation, future)
+        self.submitted += 1
+        return {}
+
+    def poll(self):
+        "Takes over a finished computation and returns the changed next hops, {} while there is none"
+        if self.running is None:
+            return self.schedule()
+        generation, future = self.running
+        if not future.done():
+            return {}
+        self.running = None
+        paths = future.result()
+        if generation != self.state.generation:
+            # the graph moved on while computing
+            self.stale += 1
+            return self.schedule()
+        changes = self.state.apply_paths(paths)
+        # destinations that became dirty without changing the graph
+        for dpid, moved in self.schedule().items():
+            changes.setdefault(dpid, {}).update(moved)
+        return changes
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+    def metrics(self):
+        return {
+            "submitted": self.submitted,
+            "inline": self.inline,
+            "cancelled": self.cancelled,
+            "stale": self.stale,
+            "dirty": len(self.state.dirty),
+            "running": self.running is not None,
+        }
+
+
+class PacketInQueue:
+
+    def __init__(self, capacity=DEFAULT_QUEUE_CAPACITY, switch_capacity=DEFAULT_SWITCH_CAPACITY):
+        self.capacity = capacity
+        self.switch_capacity = switch_capacity
+        # dpid -> deque of packet-ins, and the switches with something queued, in serving order
+        self.queues = {}
+        self.ready = deque()
+        self.size = 0
+        self.accepted = 0
+        self.dropped = 0
+        self.high_watermark = 0
+
+    def __len__(self):
+        return self.size
+
+    def put(self, dpid, item):
+        "Queues item, returns False (and queues nothing) when the switch or the whole queue is full"
+        queue = self.queues.get(dpid)
+        if queue is None:
+            queue = self.queues[dpid] = deque()
+        if self.size >= self.capacity or len(queue) >= self.switch_capacity:
+            self.dropped += 1
+            return False
+        if not queue:
+            self.ready.append(dpid)
+        queue.append(item)
+        self.size += 1
+        self.accepted += 1
+        self.high_watermark = max(self.high_watermark, self.size)
+        return True
+
+    def get_batch(self, limit):
+        "Returns up to limit queued items, one switch at a time in round robin"
+        batch = []
+        while self.ready and len(batch) < limit:
+            dpid = self.ready.popleft()
+            queue = self.queues.get(dpid)
+            if not queue:
+                continue
+            batch.append(queue.popleft())
+            self.size -= 1
+            if queue:
+                self.ready.append(dpid)
+        return batch
+
+    def forget(self, dpid):
+        "Drops the packet-ins of a switch that left and returns them"
+        queue = self.queues.pop(dpid, deque())
+        self.size -= len(queue)
+        return list(queue)
+
+    def metrics(self):
+        return {
+            "queued": self.size,
+            "accepted": self.accepted,
+            "dropped": self.dropped,
+            "high_watermark": self.high_watermark,
+        }
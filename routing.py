@@ -0,0 +1,532 @@
+# Copyright 2021 Lin Wang
+
+# This code is part of the Advanced Computer Networks course at Vrije
+# Universiteit Amsterdam.
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+
+#   http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Route computation for SPRouter. Nothing in here depends on Ryu: the switch
+# graph is a dict {dpid: {neighbor dpid: local port}} built from the discovered
+# links, and the results are plain (address, mask, out port) entries that the
+# controller turns into flow mods.
+
+from math import gcd
+
+from fattree_index import EDGE, AGGREGATION, CORE, HOST
+
+HOST_MASK = "255.255.255.255"
+SUBNET_MASK = "255.255.255.0"
+POD_MASK = "255.255.0.0"
+# matches only the host ID, the last octet of the destination
+SUFFIX_MASK = "0.0.0.255"
+
+# priorities of the proactive entries, host deliveries win over subnet routes
+# and subnet routes win over the host-ID suffixes of the two-level tables
+SUFFIX_PRIORITY = 5
+PREFIX_PRIORITY = 10
+HOST_PRIORITY = 20
+
+MASK_PRIORITIES = {HOST_MASK: HOST_PRIORITY, SUFFIX_MASK: SUFFIX_PRIORITY}
+
+# largest bucket weight of an OpenFlow 1.3 select group
+MAX_BUCKET_WEIGHT = 0xffff
+
+# one next hop per destination, weighted select groups over all equal-cost
+# next hops, or the static prefix/suffix tables of the fat-tree addresses
+ROUTING_MODES = ("shortest", "ecmp", "two-level")
+
+
+def entry_priority(mask):
+    "Returns the flow priority of a table entry with this mask"
+    return MASK_PRIORITIES.get(mask, PREFIX_PRIORITY)
+
+
+def add_link(adjacency, src_dpid, src_port, dst_dpid):
+    "Records the directed link src_dpid:src_port -> dst_dpid"
+    adjacency.setdefault(src_dpid, {})[dst_dpid] = src_port
+    adjacency.setdefault(dst_dpid, {})
+
+
+def distances_to(adjacency, destination):
+    "Returns BFS hop counts from every switch that can reach destination"
+    # links are directed, so walk them backwards from the destination
+    reverse = {}
+    for dpid, neighbors in adjacency.items():
+        for neighbor in neighbors:
+            reverse.setdefault(neighbor, []).append(dpid)
+    distances = {destination: 0}
+    frontier = [destination]
+    while frontier:
+        next_frontier = []
+        for dpid in frontier:
+            for previous in reverse.get(dpid, ()):
+                if previous not in distances:
+                    distances[previous] = distances[dpid] + 1
+                    next_frontier.append(previous)
+        frontier = next_frontier
+    return distances
+
+
+def next_hops(adjacency, destination, distances=None):
+    "Returns {dpid: out port} along one shortest path from every switch to destination"
+    if distances is None:
+        distances = distances_to(adjacency, destination)
+    ports = {}
+    for dpid, distance in distances.items():
+        if dpid == destination:
+            continue
+        # lowest neighbor DPID on a shortest path, so the choice is deterministic
+        for neighbor in sorted(adjacency[dpid]):
+            if distances.get(neighbor) == distance - 1:
+                ports[dpid] = adjacency[dpid][neighbor]
+                break
+    return ports
+
+
+def compile_routes(adjacency, prefixes):
+    """
+    Returns {dpid: [(address, mask, out port)]} so that every switch forwards
+    each prefix towards the switch owning it. prefixes maps the DPID of the
+    owning switch to a list of (address, mask) pairs.
+    """
+    tables = {dpid: [] for dpid in adjacency}
+    for destination, owned in prefixes.items():
+        if destination not in adjacency:
+            continue
+        for dpid, port in next_hops(adjacency, destination).items():
+            for address, mask in owned:
+                tables[dpid].append((address, mask, port))
+    return tables
+
+
+def fattree_prefixes(index):
+    "Returns the /24 subnet of every edge switch of a fat-tree, keyed by DPID"
+    prefixes = {}
+    for node in index.switches(EDGE):
+        prefixes[index.dpid(node)] = [(index.address(node)[:-1] + "0", SUBNET_MASK)]
+    return prefixes
+
+
+def fattree_host_ports(index):
+    "Returns the /32 entries of every edge switch towards its own hosts, keyed by DPID"
+    entries = {}
+    for node in index.switches(EDGE):
+        entries[index.dpid(node)] = [(index.address(host), HOST_MASK, index.port(node, host))
+                                     for host in index.neighbors(node) if index.layer(host) == HOST]
+    return entries
+
+
+def fattree_link_count(index):
+    "Returns the number of directed switch-to-switch links discovery reports for a fat-tree"
+    return 2 * (index.num_edge + index.num_aggregation) * index.half
+
+
+def fattree_two_level_tables(index):
+    """
+    Returns the two-level tables of Al-Fares et al. for a fat-tree, keyed by
+    DPID. Traffic goes down by prefix: cores match the /16 of every pod,
+    aggregation switches the /24 of every edge switch in their pod and edge
+    switches their own hosts (/32). Everything else goes up by suffix: the
+    host ID picks the uplink, so different hosts of one subnet take different
+    aggregation and core switches. Suffix entries (SUFFIX_MASK) have to rank
+    below all prefix entries. Every switch ends up with O(k) entries.
+    """
+    half = index.half
+    tables = fattree_host_ports(index)
+    for node in index.switches():
+        layer = index.layer(node)
+        entries = tables.setdefault(index.dpid(node), [])
+        if layer == CORE:
+            for pod, aggregation in enumerate(index.neighbors(node)):
+                entries.append(("10.%d.0.0" % pod, POD_MASK, index.port(node, aggregation)))
+            continue
+        if layer == AGGREGATION:
+            for edge in index.neighbors(node)[:half]:
+                entries.append((index.address(edge)[:-1] + "0", SUBNET_MASK, index.port(node, edge)))
+        # uplinks are the upper half of the ports, host IDs start at 2
+        position = index.position(node)
+        for host_id in range(2, half + 2):
+            entries.append(("0.0.0.%d" % host_id, SUFFIX_MASK, half + (host_id - 2 + position) % half + 1))
+    return tables
+
+
+def fattree_tables(index, adjacency):
+    "Returns the complete proactive tables of a fat-tree: subnet routes plus host deliveries"
+    tables = compile_routes(adjacency, fattree_prefixes(index))
+    for dpid, entries in fattree_host_ports(index).items():
+        tables.setdefault(dpid, []).extend(entries)
+    return tables
+
+
+def fattree_routing_state(index, mode, deferred=False):
+    "Returns the RoutingState that follows the discovered links of a fat-tree routed in mode"
+    if mode not in ROUTING_MODES:
+        raise ValueError("routing mode should be one of %s, got %r" % (", ".join(ROUTING_MODES), mode))
+    # two-level routing keeps the state as well, it just never installs from it
+    return RoutingState(fattree_prefixes(index), fattree_host_ports(index),
+                        multipath=mode == "ecmp", deferred=deferred)
+
+
+def proactive_tables(index, state, mode):
+    "Returns the complete tables of a fat-tree routed in mode, None while links are still missing"
+    # the two-level tables only need the switches, their ports are fixed by the addressing plan
+    if mode == "two-level":
+        return fattree_two_level_tables(index)
+    if state.num_links() < fattree_link_count(index):
+        return None
+    return state.tables()
+
+
+def route_entries(state, mode, changes):
+    "Returns the {dpid: [(address, mask, next hop)]} entries to re-issue for next-hop changes"
+    # the two-level tables follow the addresses, not the discovered graph
+    if mode == "two-level":
+        return {}
+    return state.entries(changes)
+
+
+def bucket_weights(path_counts):
+    "Scales shortest-path counts down to select group bucket weights with the same ratios"
+    divisor = 0
+    for count in path_counts:
+        divisor = gcd(divisor, count)
+    weights = [count // divisor for count in path_counts]
+    largest = max(weights)
+    if largest > MAX_BUCKET_WEIGHT:
+        weights = [max(1, weight * MAX_BUCKET_WEIGHT // largest) for weight in weights]
+    return weights
+
+
+def shortest_paths(adjacency, reverse, destination, multipath=False):
+    """
+    Returns (distances, next hops) of every switch towards destination, see
+    RoutingState. Only needs plain dicts, so it can run in another process
+    """
+    # one reverse BFS yields both the distances and the lowest-DPID next hops
+    distances = {destination: 0}
+    chosen = {}
+    frontier = [destination]
+    while frontier:
+        next_frontier = []
+        for dpid in frontier:
+            distance = distances[dpid] + 1
+            for previous in reverse.get(dpid, ()):
+                if previous not in distances:
+                    distances[previous] = distance
+                    chosen[previous] = dpid
+                    next_frontier.append(previous)
+                elif distances[previous] == distance and dpid < chosen[previous]:
+                    chosen[previous] = dpid
+        frontier = next_frontier
+    if multipath:
+        return distances, multipath_ports(adjacency, destination, distances)
+    ports = {dpid: adjacency[dpid][neighbor] for dpid, neighbor in chosen.items()}
+    return distances, ports
+
+
+def multipath_ports(adjacency, destination, distances):
+    "Returns the weighted (port, weight) next hops of every switch towards destination"
+    # count the shortest paths of every switch in BFS order, a switch's
+    # count is complete once all switches one hop closer are done
+    counts = {destination: 1}
+    ports = {}
+    for dpid in sorted(distances, key=distances.get):
+        if dpid == destination:
+            continue
+        distance = distances[dpid] - 1
+        hops = sorted((port, counts[neighbor]) for neighbor, port in adjacency[dpid].items()
+                      if distances.get(neighbor) == distance)
+        counts[dpid] = sum(count for _, count in hops)
+        ports[dpid] = tuple(zip([port for port, _ in hops], bucket_weights([count for _, count in hops])))
+    return ports
+
+
+def compute_paths(adjacency, reverse, destinations, multipath=False):
+    "Returns {destination: (distances, next hops)} for a batch of destinations"
+    return {destination: shortest_paths(adjacency, reverse, destination, multipath)
+            for destination in destinations}
+
+
+# Routing state that follows topology events incrementally. For every
+# destination switch it keeps the BFS distances and the chosen next hop of
+# every other switch; a link or switch event only recomputes the destinations
+# whose shortest paths it can change, and reports just the next hops that
+# actually moved.
+#
+# With multipath=True a next hop is the tuple of all equal-cost (port, weight)
+# pairs instead of a single port, where the weight is the number of shortest
+# paths to the destination through that port, reduced by their common divisor.
+#
+# With deferred=True events only update the graph and collect the
+# destinations to recompute in dirty; the paths are computed elsewhere (see
+# route_worker) from snapshot() and handed back to apply_paths(). Every
+# event bumps generation, so results of an older graph can be recognised.
+class RoutingState:
+
+    def __init__(self, prefixes, local_entries=None, multipath=False, deferred=False):
+        # prefixes: {destination dpid: [(address, mask)]} routed towards that switch
+        # local_entries: {dpid: [(address, mask, port)]} that do not depend on the graph
+        self.prefixes = prefixes
+        self.local_entries = local_entries or {}
+        self.multipath = multipath
+        self.deferred = deferred
+        self.adjacency = {}
+        # reverse[dpid] holds the switches with a link towards dpid
+        self.reverse = {}
+        self.distances = {}
+        self.ports = {}
+        self.dirty = set()
+        self.generation = 0
+
+    def num_links(self):
+        return sum(len(neighbors) for neighbors in self.adjacency.values())
+
+    def add_switch(self, dpid):
+        if dpid in self.adjacency:
+            return {}
+        self.adjacency[dpid] = {}
+        self.reverse.setdefault(dpid, set())
+        return self._recompute([dpid] if dpid in self.prefixes else [])
+
+    def add_link(self, src_dpid, src_port, dst_dpid):
+        "Adds (or re-ports) the directed link src_dpid:src_port -> dst_dpid and returns the changed next hops"
+        self.adjacency.setdefault(dst_dpid, {})
+        self.reverse.setdefault(src_dpid, set())
+        old_port = self.adjacency.setdefault(src_dpid, {}).get(dst_dpid)
+        if old_port == src_port:
+            return {}
+        self.adjacency[src_dpid][dst_dpid] = src_port
+        self.reverse.setdefault(dst_dpid, set()).add(src_dpid)
+        affected = []
+        for destination, distances in self.distances.items():
+            if destination in self.dirty:
+                # deferred, the kept paths are stale until the pending ones are applied
+                affected.append(destination)
+                continue
+            if old_port is not None and self._uses(self.ports[destination].get(src_dpid), old_port):
+                # the link moved to another port (a cable was replugged)
+                affected.append(destination)
+                continue
+            if dst_dpid not in distances:
+                continue
+            via = distances[dst_dpid] + 1
+            current = distances.get(src_dpid)
+            if current is None or via < current:
+                # shorter path
+                affected.append(destination)
+            elif via == current and src_dpid != destination:
+                # an equally short one that joins the next hops or wins the
+                # lowest-DPID tie-break, or the kept next hop leads nowhere
+                following = None if self.multipath else self._next_dpid(src_dpid, destination)
+                if self.multipath or following is None or dst_dpid < following:
+                    affected.append(destination)
+        if src_dpid in self.prefixes and src_dpid not in self.distances:
+            affected.append(src_dpid)
+        return self._recompute(affected)
+
+    def remove_link(self, src_dpid, dst_dpid):
+        "Removes the directed link src_dpid -> dst_dpid and returns the changed next hops"
+        port = self.adjacency.get(src_dpid, {}).pop(dst_dpid, None)
+        if port is None:
+            return {}
+        self.reverse[dst_dpid].discard(src_dpid)
+        affected = [destination for destination, ports in self.ports.items()
+                    if self._uses(ports.get(src_dpid), port)]
+        return self._recompute(affected)
+
+    def remove_switch(self, dpid):
+        "Removes a switch with all its links and returns the changed next hops of the remaining switches"
+        if dpid not in self.adjacency:
+            return {}
+        for neighbor in self.adjacency.pop(dpid):
+            self.reverse[neighbor].discard(dpid)
+        self.reverse.pop(dpid, None)
+        affected = set()
+        for src_dpid, neighbors in self.adjacency.items():
+            port = neighbors.pop(dpid, None)
+            if port is None:
+                continue
+            for destination, ports in self.ports.items():
+                if self._uses(ports.get(src_dpid), port):
+                    affected.add(destination)
+        changes = {}
+        # the switch is gone as a destination as well
+        old_ports = self.ports.pop(dpid, {})
+        self.distances.pop(dpid, None)
+        for src_dpid in old_ports:
+            if src_dpid in self.adjacency:
+                changes.setdefault(src_dpid, {})[dpid] = None
+        # and it no longer needs a next hop towards the others
+        for destination, ports in self.ports.items():
+            ports.pop(dpid, None)
+            self.distances[destination].pop(dpid, None)
+        for src_dpid, moved in self._recompute(sorted(affected - {dpid})).items():
+            changes.setdefault(src_dpid, {}).update(moved)
+        return changes
+
+    def _uses(self, hop, port):
+        # whether the next hop entry of a switch forwards over port
+        if self.multipath:
+            return hop is not None and any(hop_port == port for hop_port, _ in hop)
+        return hop == port
+
+    def _next_dpid(self, dpid, destination):
+        port = self.ports[destination].get(dpid)
+        for neighbor, neighbor_port in self.adjacency[dpid].items():
+            if neighbor_port == port:
+                return neighbor
+        return None
+
+    def _recompute(self, destinations):
+        # returns {dpid: {destination: new port or None}} for next hops that moved
+        self.generation += 1
+        destinations = [destination for destination in destinations
+                        if destination in self.prefixes and destination in self.adjacency]
+        if self.deferred:
+            self.dirty.update(destinations)
+            return {}
+        return self.apply_paths(compute_paths(self.adjacency, self.reverse, destinations, self.multipath))
+
+    def snapshot(self):
+        "Returns (generation, adjacency, reverse, dirty destinations) to compute the dirty paths from"
+        adjacency = {dpid: dict(neighbors) for dpid, neighbors in self.adjacency.items()}
+        reverse = {dpid: list(previous) for dpid, previous in self.reverse.items()}
+        return self.generation, adjacency, reverse, sorted(self.dirty)
+
+    def apply_paths(self, paths):
+        "Takes {destination: (distances, next hops)} over and returns the next hops that moved"
+        changes = {}
+        for destination, (distances, ports) in paths.items():
+            self.dirty.discard(destination)
+            if destination not in self.prefixes or destination not in self.adjacency:
+                continue
+            old_ports = self.ports.get(destination, {})
+            for dpid in set(old_ports) | set(ports):
+                if old_ports.get(dpid) != ports.get(dpid):
+                    changes.setdefault(dpid, {})[destination] = ports.get(dpid)
+            self.distances[destination] = distances
+            self.ports[destination] = ports
+        return changes
+
+    def add_prefix(self, destination, address, mask, port=None):
+        """
+        Routes address/mask towards the destination switch, which sends it out
+        of port if one is given, and returns the new flow entries in the form
+        of entries()
+        """
+        owned = self.prefixes.setdefault(destination, [])
+        if (address, mask) in owned:
+            return {}
+        owned.append((address, mask))
+        if destination in self.ports:
+            result = {dpid: [(address, mask, hop)] for dpid, hop in self.ports[destination].items()}
+        else:
+            result = self.entries(self._recompute([destination]))
+        if port is not None:
+            self.local_entries.setdefault(destination, []).append((address, mask, port))
+            result.setdefault(destination, []).append((address, mask, port))
+        return result
+
+    def remove_prefix(self, destination, address, mask):
+        "Stops routing address/mask towards the destination switch and returns the entries to delete"
+        owned = self.prefixes.get(destination, [])
+        if (address, mask) not in owned:
+            return {}
+        owned.remove((address, mask))
+        result = {dpid: [(address, mask, None)] for dpid in self.ports.get(destination, {})}
+        local = self.local_entries.get(destination, [])
+        kept = [entry for entry in local if entry[:2] != (address, mask)]
+        if len(kept) != len(local):
+            self.local_entries[destination] = kept
+            result.setdefault(destination, []).append((address, mask, None))
+        if not owned:
+            # nothing is routed towards the switch anymore
+            self.dirty.discard(destination)
+            del self.prefixes[destination]
+            self.ports.pop(destination, None)
+            self.distances.pop(destination, None)
+        return result
+
+    def entries(self, changes):
+        "Expands next-hop changes into {dpid: [(address, mask, next hop or None)]} flow entries"
+        result = {}
+        for dpid, moved in changes.items():
+            for destination, port in moved.items():
+                for address, mask in self.prefixes.get(destination, ()):
+                    result.setdefault(dpid, []).append((address, mask, port))
+        return result
+
+    def tables(self):
+        "Returns the complete tables of all switches: prefix routes plus local entries"
+        tables = {dpid: [] for dpid in self.adjacency}
+        for destination, ports in self.ports.items():
+            for dpid, port in ports.items():
+                for address, mask in self.prefixes[destination]:
+                    tables[dpid].append((address, mask, port))
+        for dpid, entries in self.local_entries.items():
+            if dpid in tables:
+                tables[dpid].extend(entries)
+        return tables
+
+
+# Select groups of the multipath routes. All routes of a switch with the same
+# weighted next hops share one group, so a fat-tree edge switch needs a single
+# group for its uplinks no matter how many remote prefixes it routes.
+class GroupAllocator:
+
+    def __init__(self):
+        # (dpid, buckets) -> group id, and the routes using each group
+        self.groups = {}
+        self.users = {}
+        # (dpid, route) -> buckets the route currently points at
+        self.routes = {}
+        self.next_group_id = {}
+
+    def assign(self, dpid, route, buckets):
+        """
+        Points a route of a switch at the group for buckets (None when the
+        route needs no group) and returns (group id or None, True if the group
+        still has to be created, group id that is no longer used or None)
+        """
+        old = self.routes.pop((dpid, route), None)
+        released = None
+        if old is not None:
+            group_id = self.groups[(dpid, old)]
+            users = self.users[(dpid, group_id)]
+            users.discard(route)
+            if not users and old != buckets:
+                del self.users[(dpid, group_id)]
+                del self.groups[(dpid, old)]
+                released = group_id
+        if buckets is None:
+            return None, False, released
+        self.routes[(dpid, route)] = buckets
+        group_id = self.groups.get((dpid, buckets))
+        created = group_id is None
+        if created:
+            group_id = self.next_group_id.get(dpid, 1)
+            self.next_group_id[dpid] = group_id + 1
+            self.groups[(dpid, buckets)] = group_id
+            self.users[(dpid, group_id)] = set()
+        self.users[(dpid, group_id)].add(route)
+        return group_id, created, released
+
+    def num_groups(self, dpid=None):
+        return sum(1 for key in self.users if dpid is None or key[0] == dpid)
+
+    def forget(self, dpid):
+        "Drops all groups of a switch that disconnected"
+        for table in (self.groups, self.users, self.routes):
+            for key in [key for key in table if key[0] == dpid]:
+                del table[key]
+        self.next_group_id.pop(dpid, None)
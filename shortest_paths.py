@@ -0,0 +1,159 @@
+# Copyright 2021 Lin Wang
+
+# This code is part of the Advanced Computer Networks course at Vrije
+# Universiteit Amsterdam.
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+
+#   http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Batched all-pairs shortest path lengths for topo.Fattree and topo.Jellyfish.
+#
+# Servers are leaves, so server-to-server distances are switch-to-switch
+# distances plus the two server links. The switch distances come from a
+# multi-source BFS that advances all sources at once: every switch keeps one
+# bit per source in a row of uint64 words, and one BFS level is a single
+# OR-reduction of the frontier rows of each switch's CSR neighbors.
+
+import numpy as npy
+
+# distance reported for pairs that are not connected
+UNREACHABLE = 255
+
+# number of BFS sources advanced together, 1024 sources are 16 words per switch
+DEFAULT_CHUNK = 1024
+
+
+def switch_csr(topology):
+    "Returns the CSR offsets and neighbors of the switch-only part of a topology"
+    graph = topology.graph
+    num_switches = topology.servers.start
+    offsets = npy.frombuffer(graph.offsets, dtype=npy.int32)
+    neighbors = npy.frombuffer(graph.neighbors_array, dtype=npy.int32)
+    owner = npy.repeat(npy.arange(len(graph), dtype=npy.int32), npy.diff(offsets))
+    keep = (owner < num_switches) & (neighbors < num_switches)
+    switch_neighbors = neighbors[keep]
+    switch_degree = npy.bincount(owner[keep], minlength=num_switches)
+    switch_offsets = npy.zeros(num_switches + 1, dtype=npy.int64)
+    npy.cumsum(switch_degree, out=switch_offsets[1:])
+    return switch_offsets, switch_neighbors
+
+
+def server_switches(topology):
+    "Returns the switch index each server is attached to, -1 for unconnected servers"
+    graph = topology.graph
+    servers = topology.servers
+    offsets = npy.frombuffer(graph.offsets, dtype=npy.int32)
+    neighbors = npy.frombuffer(graph.neighbors_array, dtype=npy.int32)
+    starts = offsets[servers.start:servers.stop]
+    connected = offsets[servers.start + 1:servers.stop + 1] > starts
+    attached = npy.full(len(servers), -1, dtype=npy.int64)
+    attached[connected] = neighbors[starts[connected]]
+    return attached
+
+
+def bfs_distances(offsets, neighbors, sources, chunk=DEFAULT_CHUNK):
+    "Returns a (len(sources), num_nodes) uint8 matrix of hop counts from every source"
+    num_nodes = len(offsets) - 1
+    sources = npy.asarray(sources, dtype=npy.int64)
+    distances = npy.full((len(sources), num_nodes), UNREACHABLE, dtype=npy.uint8)
+    if num_nodes == 0 or len(neighbors) == 0:
+        distances[npy.arange(len(sources)), sources] = 0
+        return distances
+
+    # reduceat returns the element at the start index for empty slices, and
+    # rejects start indices past the end, so nodes without neighbors are masked
+    starts = npy.minimum(offsets[:-1], len(neighbors) - 1)
+    isolated = offsets[1:] == offsets[:-1]
+
+    for first in range(0, len(sources), chunk):
+        batch = sources[first:first + chunk]
+        words = (len(batch) + 63) // 64
+        bits = npy.zeros((num_nodes, words), dtype=npy.uint64)
+        columns = npy.arange(len(batch))
+        bits[batch, columns // 64] |= npy.left_shift(npy.uint64(1), (columns % 64).astype(npy.uint64))
+        visited = bits.copy()
+        frontier = bits
+        distances[first + columns, batch] = 0
+
+        level = 0
+        while frontier.any() and level < UNREACHABLE - 1:
+            level += 1
+            reached = npy.bitwise_or.reduceat(frontier[neighbors], starts, axis=0)
+            reached[isolated] = 0
+            frontier = reached & ~visited
+            visited |= frontier
+            # unpack the new bits back into (node, source) positions
+            newly = npy.unpackbits(frontier.view(npy.uint8), axis=1, bitorder='little')[:, :len(batch)]
+            nodes, found = npy.nonzero(newly)
+            distances[first + found, nodes] = level
+    return distances
+
+
+def switch_distances(topology, sources=None, chunk=DEFAULT_CHUNK):
+    "Returns hop counts between switches, from the given sources (default all switches)"
+    offsets, neighbors = switch_csr(topology)
+    if sources is None:
+        sources = npy.arange(len(offsets) - 1)
+    return bfs_distances(offsets, neighbors, sources, chunk)
+
+
+def _hosting_switches(topology):
+    attached = server_switches(topology)
+    hosting, per_switch = npy.unique(attached[attached >= 0], return_counts=True)
+    return attached, hosting, per_switch
+
+
+def server_distances(topology, chunk=DEFAULT_CHUNK):
+    "Returns the dense uint8 matrix of path lengths (in links) between all server pairs"
+    attached, hosting, _ = _hosting_switches(topology)
+    num_servers = len(attached)
+    between = switch_distances(topology, hosting, chunk)[:, hosting]
+    # two server links on top of the switch path, saturating at UNREACHABLE
+    between = npy.where(between >= UNREACHABLE - 2, UNREACHABLE, between + 2).astype(npy.uint8)
+
+    row = npy.full(num_servers, -1, dtype=npy.int64)
+    connected = attached >= 0
+    row[connected] = npy.searchsorted(hosting, attached[connected])
+    result = npy.full((num_servers, num_servers), UNREACHABLE, dtype=npy.uint8)
+    both = npy.nonzero(connected)[0]
+    result[npy.ix_(both, both)] = between[npy.ix_(row[both], row[both])]
+    npy.fill_diagonal(result, 0)
+    return result
+
+
+def path_length_histogram(topology, chunk=DEFAULT_CHUNK):
+    "Returns counts of ordered server pairs per path length, index UNREACHABLE counts disconnected pairs"
+    attached, hosting, per_switch = _hosting_switches(topology)
+    num_servers = len(attached)
+    offsets, neighbors = switch_csr(topology)
+    histogram = npy.zeros(UNREACHABLE + 1, dtype=npy.int64)
+    # servers are weighted by switch, so the full server matrix is never materialized
+    for first in range(0, len(hosting), chunk):
+        rows = bfs_distances(offsets, neighbors, hosting[first:first + chunk], chunk)[:, hosting].astype(npy.int64)
+        lengths = npy.where(rows >= UNREACHABLE - 2, UNREACHABLE, rows + 2)
+        weights = npy.outer(per_switch[first:first + chunk], per_switch)
+        histogram += npy.bincount(lengths.ravel(), weights=weights.ravel(),
+                                  minlength=UNREACHABLE + 1).astype(npy.int64)
+    # servers on the same switch were counted at length 2, including each server with itself
+    connected = int(per_switch.sum())
+    histogram[2] -= connected
+    histogram[UNREACHABLE] += num_servers * num_servers - num_servers - int(histogram.sum())
+    return histogram
+
+
+def mean_path_length(histogram):
+    "Returns the mean over connected server pairs of a path_length_histogram"
+    lengths = npy.arange(UNREACHABLE)
+    pairs = histogram[:UNREACHABLE].sum()
+    if pairs == 0:
+        return float('nan')
+    return float((histogram[:UNREACHABLE] * lengths).sum() / pairs)
@@ -17,8 +17,10 @@
 
 # !/usr/bin/env python3
 import copy
+import time
 
 import netaddr
+from ryu import cfg
 from ryu.base import app_manager
 from ryu.controller import mac_to_port
 from ryu.controller import ofp_event
@@ -26,16 +28,105 @@ from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER, DEAD_DISP
 from ryu.controller.handler import set_ev_cls
 from ryu.ofproto import ofproto_v1_3
 from ryu.lib.mac import haddr_to_bin
-from ryu.lib.packet import packet, ethernet, icmp
-from ryu.lib.packet import ipv4
+from ryu.lib.packet import packet, ethernet
 from ryu.lib.packet import arp
+from ryu.lib.packet import ether_types
 
 from ryu.topology import event, switches
 from ryu.topology.api import get_switch, get_link
 from ryu.app.wsgi import ControllerBase
+from ryu.lib import hub
 
 import re
 import topo
+import routing
+from fattree_index import FattreeIndex, EDGE, HOST
+import hedera
+import arp_proxy
+import packet_classifier
+from flow_installer import FlowInstaller, PendingFlows
+import route_worker
+from route_worker import RouteWorker, PacketInQueue
+from telemetry import Telemetry, match_key
+import flow_lifecycle
+from flow_lifecycle import FlowLifecycle
+
+# seconds the install loop waits when there is nothing to send, and how many
+# acknowledged installs between two progress reports
+FLOW_INSTALL_INTERVAL = 0.005
+FLOW_INSTALL_REPORT = 1000
+
+# seconds between two sweeps of the ARP proxy for stale flood records and hosts that went quiet
+HOST_EXPIRY_INTERVAL = 10.0
+
+# how often the route loop checks for finished computations, and how many
+# packet-ins the packet-in loop handles before yielding
+ROUTE_POLL_INTERVAL = 0.01
+PACKET_IN_BATCH = 32
+
+# longest sleep of the telemetry loop, and seconds between two reports of the busiest link
+TELEMETRY_IDLE = 1.0
+TELEMETRY_REPORT = 10.0
+
+TOPOLOGY_KINDS = ("fattree", "file", "discovery")
+
+CONF = cfg.CONF
+CONF.register_opts([
+    cfg.StrOpt('routing-mode', default='shortest',
+               help="'shortest' for one next hop per destination, 'ecmp' for weighted "
+                    "select groups over all equal-cost next hops, 'two-level' for static "
+                    "prefix/suffix tables derived from the fat-tree addresses"),
+    cfg.StrOpt('topology', default='fattree:4',
+               help="'fattree:<k>' for a k-ary fat-tree, 'file:<path>' for a topology saved "
+                    "with topo.save_topology, or 'discovery' to route only what is discovered"),
+    cfg.BoolOpt('flow-bundles', default=False,
+                help="send every batch of flow mods as an atomic ONF bundle (OpenFlow 1.3 "
+                     "extension, supported by Open vSwitch)"),
+    cfg.IntOpt('route-workers', default=2,
+               help="processes computing routes off the event loop, 0 to compute them in the event handlers"),
+    cfg.IntOpt('route-offload-switches', default=route_worker.DEFAULT_OFFLOAD_SWITCHES,
+               help="switches from which on route computations go to the worker processes"),
+    cfg.IntOpt('packet-in-queue', default=route_worker.DEFAULT_QUEUE_CAPACITY,
+               help="packet-ins waiting to be handled before new ones are refused"),
+    cfg.IntOpt('packet-in-switch-queue', default=route_worker.DEFAULT_SWITCH_CAPACITY,
+               help="packet-ins of one switch waiting to be handled before its new ones are refused"),
+    cfg.FloatOpt('telemetry-interval', default=1.0,
+                 help="seconds between two port and flow statistics polls of a switch, 0 to disable"),
+    cfg.FloatOpt('telemetry-max-requests', default=200.0,
+                 help="switches polled per second at most, the interval stretches beyond that"),
+    cfg.FloatOpt('link-capacity', default=15.0,
+                 help="link capacity in Mbit/s that utilization is relative to"),
+    cfg.IntOpt('flow-table-budget', default=flow_lifecycle.DEFAULT_BUDGET,
+               help="reactive entries per switch before the least recently used ones are evicted, 0 for no limit"),
+    cfg.IntOpt('flow-idle-timeout', default=flow_lifecycle.DEFAULT_IDLE_TIMEOUT,
+               help="seconds without traffic after which a switch drops a reactive entry"),
+    cfg.IntOpt('flow-hard-timeout', default=0,
+               help="seconds after which a switch drops a reactive entry in any case, 0 for never"),
+    cfg.BoolOpt('switch-buffering', default=False,
+                help="let switches buffer missed packets and send only their first miss-send-len bytes"),
+    cfg.IntOpt('miss-send-len', default=128,
+               help="bytes of a missed packet sent to the controller when switches buffer"),
+    cfg.BoolOpt('hedera', default=False,
+                help="pin elephant flows to the least-loaded equal-cost path (fat-tree only, "
+                     "needs telemetry)"),
+    cfg.FloatOpt('hedera-interval', default=5.0, help="seconds between two elephant scheduling rounds"),
+    cfg.FloatOpt('elephant-threshold', default=hedera.DEFAULT_THRESHOLD,
+                 help="fraction of the link capacity above which a flow is an elephant"),
+])
+
+
+def parse_topology(text):
+    "Splits the topology option into (kind, argument) and checks it without building anything"
+    kind, _, argument = text.partition(":")
+    if kind not in TOPOLOGY_KINDS:
+        raise ValueError("topology should be one of fattree:<k>, file:<path> or discovery, got %r" % text)
+    if kind == "fattree":
+        argument = int(argument or 4)
+        if argument < 2 or argument % 2 != 0:
+            raise ValueError("the number of switch ports should be a positive even number, got %d" % argument)
+    elif kind == "file" and not argument:
+        raise ValueError("topology file:<path> needs a path")
+    return kind, argument
 
 
 class SPRouter(app_manager.RyuApp):
@@ -43,35 +134,230 @@ class SPRouter(app_manager.RyuApp):
 
     def __init__(self, *args, **kwargs):
         super(SPRouter, self).__init__(*args, **kwargs)
-        self.topo_net = topo.Fattree(4)
+        # the fabric is only built (or mapped from its file) on first use
+        self.topology_kind, self.topology_argument = parse_topology(CONF.topology)
+        self._fabric_loaded = False
+        self._fabric = None
+        self._routing_state = None
+        self.route_worker = None
+        self.topo_net = None
         # used for IP to Switch-DPID mapping
         self.ip_to_switch_dpid_table = {}
         # used for switch to host port mapping at switch (for outward action)
         self.switch_host_in_port = {}
         self.switch_dpid_to_dp = {}
+        # port numbers of every switch, as reported by topology discovery
+        self.switch_ports = {}
+        # learned host locations, used to answer ARP requests at the controller
+        self.arp_proxy = arp_proxy.ArpProxy()
+        # packet-in handlers by EtherType, see packet_classifier
+        self.packet_in_handlers = {
+            packet_classifier.ETH_TYPE_ARP: self._handle_arp,
+            packet_classifier.ETH_TYPE_IP: self._handle_ipv4,
+        }
         # store a pair of links to servers for each switch
         self.switch_to_other_switch_ports_list = []
         # Holds the topology data and structure
         self.topo_raw_switches = []
         self.topo_raw_links = []
+        if CONF.routing_mode not in routing.ROUTING_MODES:
+            raise ValueError("routing-mode should be one of %s, got %r" % (", ".join(routing.ROUTING_MODES),
+                                                                          CONF.routing_mode))
+        if CONF.routing_mode == "two-level" and self.topology_kind == "discovery":
+            raise ValueError("two-level routing needs the fat-tree addresses, not only discovery")
+        if CONF.hedera and (self.topology_kind == "discovery" or CONF.telemetry_interval <= 0):
+            raise ValueError("hedera needs a fat-tree topology and telemetry")
+        self.routing_mode = CONF.routing_mode
+        self.multipath = self.routing_mode == "ecmp"
+        # select groups shared by the multipath routes of each switch
+        self.group_allocator = routing.GroupAllocator()
+        self.proactive_installed = False
+        # flow mods are coalesced per switch and sent in batches by a green thread
+        self.flow_installer = FlowInstaller(use_bundles=CONF.flow_bundles, logger=self.logger)
+        # cookies, timeouts and per-switch budgets of the installed entries
+        self.flow_lifecycle = FlowLifecycle(CONF.flow_table_budget, CONF.flow_idle_timeout,
+                                            CONF.flow_hard_timeout)
+        # flows whose entry was just queued, repeated packet-ins only forward
+        self.pending_flows = PendingFlows()
+        self.flow_install_thread = hub.spawn(self._flow_install_loop)
+        # the ARP proxy's tables are swept by another one, hosts that went
+        # quiet are forgotten and unrouted
+        self.host_expiry_thread = hub.spawn(self._host_expiry_loop)
+        # port and flow counters of every switch, polled by another green thread
+        self.telemetry = None
+        if CONF.telemetry_interval > 0:
+            self.telemetry = Telemetry(interval=CONF.telemetry_interval,
+                                       max_requests=CONF.telemetry_max_requests,
+                                       link_capacity=CONF.link_capacity * 1e6)
+            self.telemetry_thread = hub.spawn(self._telemetry_loop)
+        # elephant scheduler, created with the proactive routes
+        self.hedera_scheduler = None
+        if CONF.hedera:
+            self.hedera_thread = hub.spawn(self._hedera_loop)
+        # routes computed off the event loop are picked up by another green thread
+        self.route_thread = hub.spawn(self._route_loop)
+        # packet-ins are queued by the handler and handled by their own green thread
+        self.packet_in_queue = PacketInQueue(CONF.packet_in_queue, CONF.packet_in_switch_queue)
+        self.packet_in_event = hub.Event()
+        self.packet_in_thread = hub.spawn(self._packet_in_loop)
 
-    # Topology discovery
+    # FattreeIndex of the configured fabric, None when the fabric is only
+    # discovered (or the topology file holds something else than a fat-tree)
+    @property
+    def fabric(self):
+        if not self._fabric_loaded:
+            started = time.time()
+            if self.topology_kind == "fattree":
+                self._fabric = FattreeIndex(self.topology_argument)
+            elif self.topology_kind == "file":
+                self.topo_net = topo.load_topology(self.topology_argument)
+                self._fabric = getattr(self.topo_net, "index", None)
+            self._fabric_loaded = True
+            self.logger.info("Topology %s ready in %.1f ms" % (CONF.topology, (time.time() - started) * 1000))
+        return self._fabric
+
+    # Shortest-path state of the discovered switch graph, kept up to date
+    # incrementally. With a fat-tree every edge switch owns its /24 up front;
+    # without one, hosts are routed by /32 as the ARP proxy learns them. With
+    # route workers the events only mark what to recompute and the paths are
+    # computed off the event loop
+    @property
+    def routing_state(self):
+        if self._routing_state is None:
+            index = self.fabric
+            deferred = CONF.route_workers > 0
+            if index is None:
+                if self.routing_mode == "two-level":
+                    raise ValueError("two-level routing needs a fat-tree, %s is not one" % CONF.topology)
+                self._routing_state = routing.RoutingState({}, {}, multipath=self.multipath, deferred=deferred)
+                # nothing to wait for, routes follow discovery right away
+                self.proactive_installed = True
+            else:
+                self._routing_state = routing.fattree_routing_state(index, self.routing_mode, deferred)
+            if deferred:
+                self.route_worker = RouteWorker(self._routing_state, CONF.route_workers,
+                                                CONF.route_offload_switches)
+        return self._routing_state
+
+    # Topology discovery, applied as deltas: every switch or link event updates
+    # the routing state and only the next hops that moved are re-issued
     @set_ev_cls(event.EventSwitchEnter)
     def get_topology_data(self, ev):
+        switch = ev.switch
+        index = self.fabric
+        # the proactive tables are addressed by the fabric's DPIDs (switch index + 1)
+        if index is not None and switch.dp.id not in self.switch_dpid_to_dp and \
+                not 1 <= switch.dp.id <= index.num_switches:
+            self.logger.error("Switch %016x is not in the k=%d fat-tree, check the topology's DPIDs"
+                              % (switch.dp.id, index.k))
+        self.switch_dpid_to_dp[switch.dp.id] = switch.dp
+        self.switch_ports[switch.dp.id] = [port.port_no for port in switch.ports]
+        if self.telemetry is not None:
+            self.telemetry.add_datapath(switch.dp)
+        self.topo_raw_switches = [known for known in self.topo_raw_switches if known.dp.id != switch.dp.id]
+        self.topo_raw_switches.append(switch)
+        self.apply_route_changes(self.routing_state.add_switch(switch.dp.id))
+
+    # Links are discovered (LLDP) after the switches have entered
+    @set_ev_cls(event.EventLinkAdd)
+    def link_add_handler(self, ev):
+        link = ev.link
+        if (link.src.dpid, link.src.port_no) not in self.switch_to_other_switch_ports_list:
+            self.switch_to_other_switch_ports_list.append((link.src.dpid, link.src.port_no))
+        self.topo_raw_links.append(link)
+        self.apply_route_changes(self.routing_state.add_link(link.src.dpid, link.src.port_no, link.dst.dpid))
+
+    @set_ev_cls(event.EventLinkDelete)
+    def link_delete_handler(self, ev):
+        link = ev.link
+        if (link.src.dpid, link.src.port_no) in self.switch_to_other_switch_ports_list:
+            self.switch_to_other_switch_ports_list.remove((link.src.dpid, link.src.port_no))
+        self.topo_raw_links = [known for known in self.topo_raw_links
+                               if (known.src.dpid, known.src.port_no) != (link.src.dpid, link.src.port_no)]
+        self.apply_route_changes(self.routing_state.remove_link(link.src.dpid, link.dst.dpid))
+
+    # Re-issue the entries whose next hop changed; before the initial install
+    # there is nothing on the switches yet, so just check whether it can happen
+    def apply_route_changes(self, changes):
+        if self.route_worker is not None:
+            # start computing what the event made dirty, small graphs right here
+            for dpid, moved in self.route_worker.schedule().items():
+                changes.setdefault(dpid, {}).update(moved)
+        if not self.proactive_installed:
+            self.install_proactive_routes()
+            return
+        self.apply_route_entries(routing.route_entries(self.routing_state, self.routing_mode, changes))
+
+    def apply_route_entries(self, changed):
+        started = time.time()
+        updated = 0
+        for dpid, entries in changed.items():
+            datapath = self.switch_dpid_to_dp.get(dpid)
+            if datapath is None:
+                continue
+            for address, mask, hop in entries:
+                self.install_route(datapath, routing.entry_priority(mask), address, mask, hop)
+                updated += 1
+        # reconvergence should not wait for the next round of the install loop
+        self.flow_installer.flush()
+        if updated:
+            self.logger.info("Updated %d entries on %d switches in %.1f ms"
+                             % (updated, len(changed), (time.time() - started) * 1000))
 
-        # Switches and links in the network
-        switches = get_switch(self, None)
-        switch_list = [switch.dp.id for switch in switches]
-        for switch in switches:
-            self.switch_dpid_to_dp[switch.dp.id] = switch.dp
-        self.topo_raw_switches = switches
-        links = get_link(self, None)
-        link_list = [(link.src.dpid, link.dst.dpid, {'port': link.src.port_no}) for link in links]
-        for link in links:
-            if (link.src.dpid, link.src.port_no) not in self.switch_to_other_switch_ports_list:
-                self.switch_to_other_switch_ports_list.append((link.src.dpid, link.src.port_no))
-        # print("Switch-links to each other = ", *self.switch_to_other_switch_ports_list)
-        self.topo_raw_links = links
+    # Once every switch and link of the fat-tree is known, push the
+    # shortest-path tables for all destinations in one go, so that IPv4
+    # traffic never has to visit the controller. The two-level tables only
+    # need the switches, their ports are fixed by the addressing plan
+    def install_proactive_routes(self):
+        if self.proactive_installed:
+            return
+        index = self.fabric
+        if index is None:
+            return
+        if not all(index.dpid(node) in self.switch_dpid_to_dp for node in index.switches()):
+            return
+        if self.route_worker is not None and self.route_worker.busy():
+            return
+        tables = routing.proactive_tables(index, self.routing_state, self.routing_mode)
+        if tables is None:
+            return
+        installed = 0
+        for dpid, entries in tables.items():
+            datapath = self.switch_dpid_to_dp.get(dpid)
+            if datapath is None:
+                continue
+            for address, mask, hop in entries:
+                self.install_route(datapath, routing.entry_priority(mask), address, mask, hop)
+                installed += 1
+        self.proactive_installed = True
+        if CONF.hedera:
+            self.install_flow_monitors(index)
+            self.hedera_scheduler = hedera.Scheduler(index, CONF.elephant_threshold)
+        self.logger.info("Installed %d proactive entries and %d groups on %d switches"
+                         % (installed, self.group_allocator.num_groups(), len(tables)))
+
+    # Point the entry for address/mask at its next hop: a port, a tuple of
+    # weighted (port, weight) next hops, or None to remove the entry. More than
+    # one next hop goes through a select group, so the switch spreads flows
+    # over them by itself
+    def install_route(self, datapath, priority, address, mask, hop):
+        parser = datapath.ofproto_parser
+        match = parser.OFPMatch(eth_type=ether_types.ETH_TYPE_IP, ipv4_dst=(address, mask))
+        buckets = hop if isinstance(hop, tuple) and len(hop) > 1 else None
+        group_id, created, released = self.group_allocator.assign(datapath.id, (address, mask), buckets)
+        if hop is None:
+            self.delete_flow(datapath, priority, match)
+        elif buckets is not None:
+            # the group has to exist before the entry that points at it
+            if created:
+                self.add_group(datapath, group_id, buckets)
+            self.add_flow(datapath, priority, match, [parser.OFPActionGroup(group_id)])
+        else:
+            port = hop[0][0] if isinstance(hop, tuple) else hop
+            # an add with the same match and priority replaces the old entry
+            self.add_flow(datapath, priority, match, [parser.OFPActionOutput(port)])
+        if released is not None:
+            self.delete_group(datapath, released)
 
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
     def switch_features_handler(self, ev):
@@ -79,136 +365,449 @@ class SPRouter(app_manager.RyuApp):
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
 
+        # a (re)connected switch starts from its own tables, not from our books;
+        # reactive entries of an earlier connection would no longer count against the budget
+        self.flow_lifecycle.forget(datapath.id)
+        self.delete_cookie(datapath, flow_lifecycle.REACTIVE << flow_lifecycle.COOKIE_KIND_SHIFT,
+                           flow_lifecycle.COOKIE_KIND_MASK)
+
+        self.pending_flows.forget(datapath.id)
+        if CONF.switch_buffering:
+            datapath.send_msg(parser.OFPSetConfig(datapath, ofproto.OFPC_FRAG_NORMAL, CONF.miss_send_len))
+
         # Install entry-miss flow entry
         match = parser.OFPMatch()
         actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER,
-                                          ofproto.OFPCML_NO_BUFFER)]
+                                          self.controller_max_len(ofproto))]
         self.add_flow(datapath, 0, match, actions)
 
-    # Add a flow entry to the flow-table
-    def add_flow(self, datapath, priority, match, actions):
+        # groups left over from an earlier connection would clash with the new group ids
+        if self.multipath:
+            self.group_allocator.forget(datapath.id)
+            self.delete_group(datapath, ofproto.OFPG_ALL)
+
+    # Bytes of a packet sent to the controller: all of it, or only the headers
+    # when the switch keeps the packet in a buffer
+    def controller_max_len(self, ofproto):
+        return CONF.miss_send_len if CONF.switch_buffering else ofproto.OFPCML_NO_BUFFER
+
+    # Add a flow entry to the flow-table. Reactive entries (per flow) idle
+    # out, report their removal and count against the switch's budget; making
+    # room evicts the least recently used ones first. With a buffer_id the
+    # switch runs its buffered packet through the new entry
+    def add_flow(self, datapath, priority, match, actions, reactive=False, buffer_id=None):
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
+        installation = self.flow_lifecycle.install(datapath.id, priority, match_key(match), reactive)
+        for entry in installation.evicted:
+            self.delete_cookie(datapath, entry.cookie)
+        if installation.evicted:
+            self.logger.debug("Evicted %d entries from switch %s" % (len(installation.evicted), datapath.id))
 
-        # Construct flow_mod message and send it
+        # Construct flow_mod message and queue it, the install loop sends it with the next batch
         inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
-        mod = parser.OFPFlowMod(datapath=datapath, priority=priority,
+        mod = parser.OFPFlowMod(datapath=datapath, cookie=installation.cookie, priority=priority,
+                                idle_timeout=installation.idle_timeout, hard_timeout=installation.hard_timeout,
+                                flags=ofproto.OFPFF_SEND_FLOW_REM if reactive else 0,
+                                buffer_id=ofproto.OFP_NO_BUFFER if buffer_id is None else buffer_id,
                                 match=match, instructions=inst)
-        datapath.send_msg(mod)
+        self.flow_installer.queue(datapath, mod)
+
+    # Remove the flow entry with exactly this match and priority
+    def delete_flow(self, datapath, priority, match):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        self.flow_lifecycle.deleted(datapath.id, priority, match_key(match))
+        mod = parser.OFPFlowMod(datapath=datapath, command=ofproto.OFPFC_DELETE_STRICT,
+                                out_port=ofproto.OFPP_ANY, out_group=ofproto.OFPG_ANY,
+                                priority=priority, match=match)
+        self.flow_installer.queue(datapath, mod)
+
+    # Remove the entries carrying this cookie (in the bits of cookie_mask), whatever their match
+    def delete_cookie(self, datapath, cookie, cookie_mask=0xffffffffffffffff):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        mod = parser.OFPFlowMod(datapath=datapath, cookie=cookie, cookie_mask=cookie_mask,
+                                table_id=ofproto.OFPTT_ALL, command=ofproto.OFPFC_DELETE,
+                                out_port=ofproto.OFPP_ANY, out_group=ofproto.OFPG_ANY,
+                                match=parser.OFPMatch())
+        self.flow_installer.queue(datapath, mod)
+
+    @set_ev_cls(ofp_event.EventOFPFlowRemoved, MAIN_DISPATCHER)
+    def flow_removed_handler(self, ev):
+        msg = ev.msg
+        self.flow_lifecycle.removed(msg.datapath.id, msg.cookie, msg.reason)
+
+    # Add a select group that hashes flows over the weighted ports
+    def add_group(self, datapath, group_id, hops):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        buckets = [parser.OFPBucket(weight=weight, watch_port=port, watch_group=ofproto.OFPG_ANY,
+                                    actions=[parser.OFPActionOutput(port)])
+                   for port, weight in hops]
+        mod = parser.OFPGroupMod(datapath, command=ofproto.OFPGC_ADD, type_=ofproto.OFPGT_SELECT,
+                                 group_id=group_id, buckets=buckets)
+        self.flow_installer.queue(datapath, mod)
+
+    def delete_group(self, datapath, group_id):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        mod = parser.OFPGroupMod(datapath, command=ofproto.OFPGC_DELETE, group_id=group_id)
+        self.flow_installer.queue(datapath, mod)
+
+    # Send the queued flow mods in barrier-terminated batches, one batch per
+    # switch per round, yielding to the event loop between rounds
+    def _flow_install_loop(self):
+        reported = 0
+        while True:
+            if self.flow_installer.flush():
+                hub.sleep(0)
+                continue
+            hub.sleep(FLOW_INSTALL_INTERVAL)
+            metrics = self.flow_installer.metrics()
+            if metrics["acknowledged"] - reported >= FLOW_INSTALL_REPORT:
+                reported = metrics["acknowledged"]
+                self.logger.info("Flow installs: %(acknowledged)d acknowledged, %(errors)d failed, "
+                                 "%(pending)d pending, %(install_rate).0f/s" % metrics)
+
+    # Poll the switches that are due and sleep until the next one is, so the
+    # stats requests are spread over the interval instead of sent in bursts
+    def _telemetry_loop(self):
+        reported = time.time()
+        while True:
+            now = time.time()
+            self.telemetry.poll(now)
+            if now - reported >= TELEMETRY_REPORT:
+                reported = now
+                links = [(link.src.dpid, link.src.port_no, link.dst.dpid) for link in self.topo_raw_links]
+                for (src, dst), load in self.telemetry.hottest(links, window=TELEMETRY_REPORT, now=now):
+                    self.logger.info("Busiest link %s -> %s at %.1f%% over %.0f s"
+                                     % (src, dst, load * 100, TELEMETRY_REPORT))
+            following = self.telemetry.next_poll()
+            hub.sleep(TELEMETRY_IDLE if following is None else min(max(following - time.time(), 0), TELEMETRY_IDLE))
 
+    @set_ev_cls(ofp_event.EventOFPPortStatsReply, MAIN_DISPATCHER)
+    def port_stats_reply_handler(self, ev):
+        if self.telemetry is not None:
+            self.telemetry.port_stats_reply(ev.msg)
+
+    @set_ev_cls(ofp_event.EventOFPFlowStatsReply, MAIN_DISPATCHER)
+    def flow_stats_reply_handler(self, ev):
+        if self.telemetry is not None:
+            self.telemetry.flow_stats_reply(ev.msg)
+        # entries whose packet count moved were used since the last poll
+        self.flow_lifecycle.flow_stats(ev.msg.datapath.id,
+                                       ((stat.cookie, stat.packet_count) for stat in ev.msg.body))
+
+    @set_ev_cls(ofp_event.EventOFPBarrierReply, MAIN_DISPATCHER)
+    def barrier_reply_handler(self, ev):
+        self.flow_installer.barrier_reply(ev.msg)
+
+    @set_ev_cls(ofp_event.EventOFPErrorMsg, [CONFIG_DISPATCHER, MAIN_DISPATCHER])
+    def error_msg_handler(self, ev):
+        self.flow_installer.error(ev.msg)
+
+    # Take over the routes of finished computations
+    def _route_loop(self):
+        while True:
+            hub.sleep(ROUTE_POLL_INTERVAL)
+            worker = self.route_worker
+            if worker is None or not worker.busy():
+                continue
+            try:
+                changes = worker.poll()
+            except Exception as error:
+                self.logger.error("Route computation failed: %s" % error)
+                continue
+            if changes or not worker.busy():
+                self.apply_route_changes(changes)
+
+    # Packet-ins only wait in the queue, so a burst of them (or a slow one)
+    # cannot hold up the other events; when the queue is full the packet is
+    # refused and its switch buffer released
     @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
     def _packet_in_handler(self, ev):
         msg = ev.msg
+        if self.packet_in_queue.put(msg.datapath.id, msg):
+            self.packet_in_event.set()
+            return
+        self.forward_packet_in(msg, {})
+        dropped = self.packet_in_queue.dropped
+        if dropped & (dropped - 1) == 0:
+            self.logger.warning("Packet-in queue full, %d packet-ins refused so far" % dropped)
+
+    def _packet_in_loop(self):
+        while True:
+            batch = self.packet_in_queue.get_batch(PACKET_IN_BATCH)
+            if not batch:
+                self.packet_in_event.clear()
+                self.packet_in_event.wait(timeout=1.0)
+                continue
+            for msg in batch:
+                self.handle_packet_in(msg)
+            hub.sleep(0)
+
+    def handle_packet_in(self, msg):
+        # peek at the EtherType and the header fields we need instead of
+        # decoding the whole packet, then hand it to the protocol's handler
+        eth_type, header = packet_classifier.classify(msg.data)
+        handler = self.packet_in_handlers.get(eth_type)
+        if header is None or handler is None:
+            # nothing to forward, but a buffered packet has to be let go
+            self.forward_packet_in(msg, {})
+            return
+        handler(msg, msg.match['in_port'], header)
+
+    # IP packets only miss the tables while the proactive routes are not in
+    # place yet; deliver them straight to the destination host's port
+    def _handle_ipv4(self, msg, in_port, pkt_ip):
+        if self.hedera_scheduler is not None and self.start_flow(msg, pkt_ip):
+            return
+        known = self.arp_proxy.lookup(pkt_ip.dst)
+        if known is None:
+            self.logger.debug("IP packet from %s for unknown host %s" % (pkt_ip.src, pkt_ip.dst))
+            self.forward_packet_in(msg, {})
+            return
+        self.forward_packet_in(msg, {known.dpid: [known.port]})
+
+    # Elephant scheduling. Edge switches send what their hosts emit to the
+    # controller until the flow has an exact-match entry of its own; that
+    # entry forwards like ECMP would and counts the flow for the telemetry.
+    # Every round the flows above the threshold are placed by the Hedera
+    # scheduler and pinned to their path with higher-priority entries
+    def install_flow_monitors(self, index):
+        for edge in index.switches(EDGE):
+            datapath = self.switch_dpid_to_dp.get(index.dpid(edge))
+            if datapath is None:
+                continue
+            ofproto = datapath.ofproto
+            parser = datapath.ofproto_parser
+            actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER, self.controller_max_len(ofproto))]
+            for host in index.neighbors(edge)[:index.half]:
+                match = parser.OFPMatch(in_port=index.port(edge, host), eth_type=ether_types.ETH_TYPE_IP)
+                self.add_flow(datapath, hedera.MONITOR_PRIORITY, match, actions)
+
+    # Give a new flow from a local host its counting entry and send the packet
+    # on. A buffered packet is released by the flow mod itself, and packets
+    # that arrive while the entry is pending only follow the first one
+    def start_flow(self, msg, pkt_ip):
+        index = self.fabric
+        datapath = msg.datapath
+        try:
+            edge = index.node_of_dpid(datapath.id)
+            source = index.node_of_address(pkt_ip.src)
+            destination = index.node_of_address(pkt_ip.dst)
+        except KeyError:
+            return False
+        if index.layer(edge) != EDGE or index.layer(source) != HOST or index.layer(destination) != HOST \
+                or index.edge_of(source) != edge:
+            return False
+        key = (datapath.id, pkt_ip.src, pkt_ip.dst)
+        port = self.pending_flows.get(key)
+        if port is None:
+            ofproto = datapath.ofproto
+            parser = datapath.ofproto_parser
+            port = hedera.default_port(index, edge, source, destination)
+            self.pending_flows.add(key, port)
+            match = parser.OFPMatch(eth_type=ether_types.ETH_TYPE_IP, ipv4_src=pkt_ip.src, ipv4_dst=pkt_ip.dst)
+            buffered = msg.buffer_id != ofproto.OFP_NO_BUFFER
+            self.add_flow(datapath, hedera.FLOW_PRIORITY, match, [parser.OFPActionOutput(port)], reactive=True,
+                          buffer_id=msg.buffer_id if buffered else None)
+            self.flow_installer.flush(datapath.id)
+            if buffered:
+                return True
+        self.forward_packet_in(msg, {datapath.id: [port]})
+        return True
+
+    def _hedera_loop(self):
+        while True:
+            hub.sleep(CONF.hedera_interval)
+            if self.hedera_scheduler is not None:
+                self.schedule_elephants()
+
+    # Rates of the flows as fractions of the link capacity, counted once at
+    # the edge switch of their source (by its counting or its pinned entry)
+    def measured_flow_rates(self, now=None):
+        index = self.fabric
+        capacity = self.telemetry.link_capacity
+        rates = {}
+        for (dpid, _, priority, match), rate in self.telemetry.flow_rates(window=CONF.hedera_interval,
+                                                                            now=now).items():
+            if priority not in (hedera.FLOW_PRIORITY, hedera.ELEPHANT_PRIORITY):
+                continue
+            fields = dict(match)
+            try:
+                flow = (index.node_of_address(fields["ipv4_src"]), index.node_of_address(fields["ipv4_dst"]))
+            except KeyError:
+                continue
+            if index.layer(flow[0]) != HOST or index.dpid(index.edge_of(flow[0])) != dpid:
+                continue
+            rates[flow] = rates.get(flow, 0.0) + rate * 8 / capacity
+        return rates
+
+    def schedule_elephants(self, now=None):
+        previous = dict(self.hedera_scheduler.placements)
+        moved, released = self.hedera_scheduler.schedule(self.measured_flow_rates(now))
+        for flow in released:
+            self.unpin_flow(flow, previous[flow])
+        for flow, path in moved.items():
+            if flow in previous:
+                self.unpin_flow(flow, previous[flow], keep=path)
+        # pinned entries are refreshed every round, so they cannot idle out
+        # under a placement the scheduler still counts on
+        for flow, path in self.hedera_scheduler.placements.items():
+            self.pin_flow(flow, path)
+        self.flow_installer.flush()
+        if moved or released:
+            self.logger.info("Scheduled %d elephants, %d moved, %d released"
+                             % (len(self.hedera_scheduler.placements), len(moved), len(released)))
+
+    def _flow_match(self, datapath, flow):
+        index = self.fabric
+        return datapath.ofproto_parser.OFPMatch(eth_type=ether_types.ETH_TYPE_IP,
+                                                ipv4_src=index.address(flow[0]), ipv4_dst=index.address(flow[1]))
+
+    def pin_flow(self, flow, path):
+        for dpid, port in hedera.path_entries(self.fabric, flow[0], flow[1], path):
+            datapath = self.switch_dpid_to_dp.get(dpid)
+            if datapath is None:
+                continue
+            self.add_flow(datapath, hedera.ELEPHANT_PRIORITY, self._flow_match(datapath, flow),
+                          [datapath.ofproto_parser.OFPActionOutput(port)], reactive=True)
+
+    # Remove the pinned entries of a flow from the switches of path that are not on keep
+    def unpin_flow(self, flow, path, keep=()):
+        for node in path:
+            if node in keep:
+                continue
+            datapath = self.switch_dpid_to_dp.get(self.fabric.dpid(node))
+            if datapath is not None:
+                self.delete_flow(datapath, hedera.ELEPHANT_PRIORITY, self._flow_match(datapath, flow))
+
+    def _handle_arp(self, msg, in_port, pkt_arp):
         datapath = msg.datapath
         dpid = datapath.id
-        ofproto = datapath.ofproto
-        parser = datapath.ofproto_parser
-        source_add = None
-        destination_add = None
-        # TODO: handle new packets at the controller
-        # analyse the incoming packets
-        read_packet = packet.Packet(msg.data)
-
-        # read the in_port number from packet_in message and learn/store
-        in_port = msg.match['in_port']
-
-        pkt_ip = read_packet.get_protocol(ipv4.ipv4)
-        if pkt_ip:
-            destination_add = pkt_ip.dst
-            source_add = pkt_ip.src
-            print("IP Packet from %s for %s!" % (source_add, destination_add))
-            actions = [
-                parser.OFPActionOutput(port=self.switch_host_in_port[self.ip_to_switch_dpid_table[destination_add]])]
-            match = parser.OFPMatch(in_port=in_port, eth_dst=destination_add)
-            self.add_flow(datapath, 1, match, actions)
-            out = parser.OFPPacketOut(datapath=datapath,
-                                      buffer_id=ofproto.OFP_NO_BUFFER,
-                                      in_port=in_port,
-                                      actions=actions,
-                                      data=read_packet.data)
-            datapath.send_msg(out)
-
-        pkt_eth = read_packet.get_protocol(ethernet.ethernet)
-        if pkt_eth:
-            # print("Ethernet Packet Found!")
-            pass
-        if not pkt_eth:
-            print("Not an Ethernet packet!")
-            # return
-
-        pkt_icmp = read_packet.get_protocol(icmp.icmp)
-        if pkt_icmp:
-            destination_add = pkt_icmp.dst
-            source_add = pkt_icmp.src
-            print("ICMP Packet from %s for %s!" % (source_add, destination_add))
-            actions = [
-                parser.OFPActionOutput(port=self.switch_host_in_port[self.ip_to_switch_dpid_table[destination_add]])]
-            match = parser.OFPMatch(in_port=in_port, eth_dst=destination_add)
-            self.add_flow(datapath, 1, match, actions)
-            out = parser.OFPPacketOut(datapath=datapath,
-                                      buffer_id=ofproto.OFP_NO_BUFFER,
-                                      in_port=in_port,
-                                      actions=actions,
-                                      data=read_packet.data)
-            datapath.send_msg(out)
-
-        pkt_arp = read_packet.get_protocol(arp.arp)
-        if pkt_arp:
-            destination_add = pkt_arp.dst_ip
-            source_add = pkt_arp.src_ip
-            print("ARP packet from %s for %s" % (source_add, destination_add))
-            self.logger.info(
-                "Packet in switch %s at port %s from %s for %s" % (dpid, in_port, source_add, destination_add))
-            # learn the IP-address connected to switch
-            self.ip_to_switch_dpid_table[source_add] = dpid
+        self.logger.debug(
+            "ARP packet in switch %s at port %s from %s for %s" % (dpid, in_port, pkt_arp.src_ip, pkt_arp.dst_ip))
+        # learn the IP-address connected to switch, ARP is never forwarded between switches
+        if (dpid, in_port) not in self.switch_to_other_switch_ports_list:
+            self.ip_to_switch_dpid_table[pkt_arp.src_ip] = dpid
             self.switch_host_in_port[dpid] = in_port
-            if destination_add in self.ip_to_switch_dpid_table:
-                actions = [
-                    parser.OFPActionOutput(
-                        port=self.switch_host_in_port[self.ip_to_switch_dpid_table[destination_add]])]
-                match = parser.OFPMatch(in_port=in_port, eth_dst=pkt_arp.dst_mac)
-                self.add_flow(datapath, 1, match, actions)
-                out = parser.OFPPacketOut(datapath=datapath,
-                                          buffer_id=ofproto.OFP_NO_BUFFER,
-                                          in_port=in_port,
-                                          actions=actions,
-                                          data=read_packet.data)
-                datapath.send_msg(out)
+            previous = self.arp_proxy.hosts.get(pkt_arp.src_ip)
+            if self.arp_proxy.learn(pkt_arp.src_ip, dpid, in_port, pkt_arp.src_mac) and self.fabric is None:
+                self.route_learned_host(pkt_arp.src_ip, dpid, in_port, previous)
+        if pkt_arp.opcode == arp.ARP_REQUEST:
+            self.handle_arp_request(msg, in_port, pkt_arp)
+        elif pkt_arp.opcode == arp.ARP_REPLY:
+            self.deliver_arp_reply(msg, pkt_arp)
+        else:
+            self.forward_packet_in(msg, {})
+
+    # Without an addressing plan every host is its own /32 destination,
+    # routed towards the switch it was learned on
+    def route_learned_host(self, ip, dpid, port, previous):
+        state = self.routing_state
+        if previous is not None:
+            self.apply_route_entries(state.remove_prefix(previous.dpid, ip, routing.HOST_MASK))
+        self.apply_route_entries(state.add_prefix(dpid, ip, routing.HOST_MASK, port))
+
+    # The ARP proxy dropped hosts (their switch left, or they went quiet), so
+    # their /32 routes have to go as well
+    def forget_learned_hosts(self, forgotten):
+        for ip, known in forgotten:
+            self.ip_to_switch_dpid_table.pop(ip, None)
+            if self.fabric is None:
+                self.apply_route_entries(self.routing_state.remove_prefix(known.dpid, ip, routing.HOST_MASK))
+
+    def _host_expiry_loop(self):
+        while True:
+            hub.sleep(HOST_EXPIRY_INTERVAL)
+            forgotten = self.arp_proxy.expire()
+            if forgotten:
+                self.logger.info("Forgot %d hosts that went quiet" % len(forgotten))
+                self.forget_learned_hosts(forgotten)
+
+    # Answer an ARP request from the host table; for an unknown target send the
+    # request only to where the target should be, at most once per interval
+    def handle_arp_request(self, msg, in_port, pkt_arp):
+        datapath = msg.datapath
+        known = self.arp_proxy.answer(pkt_arp.dst_ip)
+        if known is not None:
+            self.send_arp_reply(datapath, in_port, pkt_arp, known.mac)
+            self.forward_packet_in(msg, {})
+            return
+        if not self.arp_proxy.should_flood(pkt_arp.dst_ip):
+            self.forward_packet_in(msg, {})
+            return
+
+        location = None
+        if self.fabric is not None:
+            location = arp_proxy.fattree_location(self.fabric, pkt_arp.dst_ip)
+        if location is not None and location[0] in self.switch_dpid_to_dp:
+            targets = {location[0]: [location[1]]}
+        else:
+            # outside the addressing plan: every host port, one packet-out per switch
+            targets = arp_proxy.host_ports(self.switch_ports, set(self.switch_to_other_switch_ports_list))
+        targets = {target_dpid: [port for port in ports if (target_dpid, port) != (datapath.id, in_port)]
+                   for target_dpid, ports in targets.items()}
+        self.forward_packet_in(msg, targets)
+
+    # Hand an ARP reply to the host that asked, wherever it is
+    def deliver_arp_reply(self, msg, pkt_arp):
+        known = self.arp_proxy.lookup(pkt_arp.dst_ip)
+        self.forward_packet_in(msg, {known.dpid: [known.port]} if known is not None else {})
+
+    def send_arp_reply(self, datapath, port, request, mac):
+        reply = packet.Packet()
+        reply.add_protocol(ethernet.ethernet(ethertype=ether_types.ETH_TYPE_ARP,
+                                             dst=request.src_mac, src=mac))
+        reply.add_protocol(arp.arp(opcode=arp.ARP_REPLY,
+                                   src_mac=mac, src_ip=request.dst_ip,
+                                   dst_mac=request.src_mac, dst_ip=request.src_ip))
+        reply.serialize()
+        self.send_packet_out(datapath, [port], reply.data)
+
+    # Send the packet of a packet-in out of {dpid: ports}. A packet the switch
+    # buffered leaves from that buffer when it goes out of the same switch,
+    # the other switches get the data, which is only possible if the whole
+    # packet came up. An unused buffer is released, or the switch would hold
+    # the packet until it gives up on it
+    def forward_packet_in(self, msg, targets):
+        datapath = msg.datapath
+        ofproto = datapath.ofproto
+        buffered = msg.buffer_id != ofproto.OFP_NO_BUFFER
+        complete = len(msg.data) >= msg.total_len
+        for dpid, ports in targets.items():
+            target = self.switch_dpid_to_dp.get(dpid)
+            if target is None or not ports:
+                continue
+            if buffered and dpid == datapath.id:
+                self.send_buffered_out(datapath, msg.buffer_id, msg.match['in_port'], ports)
+                buffered = False
+            elif complete:
+                self.send_packet_out(target, ports, msg.data)
             else:
-                # print("Something")
-                # for link in self.topo_raw_links:
-                #     print(" \t" + "Current Links:")
-                #     temp_string = str(link)
-                #     switch_dpid1 = re.search('(?<=dpid=)(\w+)', temp_string).group(1)
-                #     switch_dpid2 = re.search('(?<=dpid=)(\w+)', temp_string).group(2)
-                #     switch_dpid1_link = re.search('(?<=port_no=)(\w+)', temp_string).group(1)
-                #     switch_dpid2_link = re.search('(?<=port_no=)(\w+)', temp_string).group(2)
-                #     # out_port = ofproto.OFPP_FLOOD
-                #     if (switch_dpid1, switch_dpid1_link) not in self.switch_to_other_switch_ports_list:
-                #         self.switch_to_other_switch_ports_list.append((switch_dpid1, switch_dpid1_link))
-                #     if (switch_dpid2, switch_dpid2_link) not in self.switch_to_other_switch_ports_list:
-                #         self.switch_to_other_switch_ports_list.append((switch_dpid2, switch_dpid2_link))
-                # # for iterator in range(len(self.switch_to_other_switch_ports_list)):
-                # #     print(self.switch_to_other_switch_ports_list[iterator])
-                # counter = 0
-                for switch in self.topo_raw_switches:
-                #     # print(" \t" + "Current Switches:")
-                #     temp_string = str(switch)
-                #     switch_dpid = re.search('(?<=dpid=)(\w+)', temp_string).group(1)
-                #     self.switch_dpid_to_dp['s' + str(counter)] = switch_dpid
-                #     counter += 1
-                    for iterator in range(1, 5):  # since there could only be 4 ports in a switch
-                        if (switch.dp.id, iterator) not in self.switch_to_other_switch_ports_list:
-                            out_port = iterator
-                            print("Sending flood packet on switch %s on port %s" % (switch.dp.id, iterator))
-                            actions = [parser.OFPPacketOut(out_port)]
-                            out = parser.OFPPacketOut(datapath=switch.dp,
-                                                      in_port=in_port,
-                                                      actions=actions,
-                                                      buffer_id=datapath.ofproto.OFP_NO_BUFFER,
-                                                      data=msg.data)
-                            datapath.send_msg(out)
-                    # print(" \t" + "controlled flooding being done!")
+                self.logger.debug("Dropped packet-in of switch %s, only %d of %d bytes came up"
+                                  % (datapath.id, len(msg.data), msg.total_len))
+        if buffered:
+            self.send_buffered_out(datapath, msg.buffer_id, msg.match['in_port'], [])
+
+    def send_buffered_out(self, datapath, buffer_id, in_port, ports):
+        parser = datapath.ofproto_parser
+        actions = [parser.OFPActionOutput(port) for port in ports]
+        datapath.send_msg(parser.OFPPacketOut(datapath=datapath, buffer_id=buffer_id, in_port=in_port,
+                                              actions=actions, data=None))
+
+    def send_packet_out(self, datapath, ports, data):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        actions = [parser.OFPActionOutput(port) for port in ports]
+        out = parser.OFPPacketOut(datapath=datapath,
+                                  buffer_id=ofproto.OFP_NO_BUFFER,
+                                  in_port=ofproto.OFPP_CONTROLLER,
+                                  actions=actions,
+                                  data=data)
+        datapath.send_msg(out)
 
     @set_ev_cls(event.EventSwitchEnter)
     def handler_switch_enter(self, ev):
@@ -235,4 +834,21 @@ class SPRouter(app_manager.RyuApp):
 
     @set_ev_cls(event.EventSwitchLeave, [MAIN_DISPATCHER, CONFIG_DISPATCHER, DEAD_DISPATCHER])
     def handler_switch_leave(self, ev):
-        self.logger.info("Not tracking Switches, switch leaved.")
+        dpid = ev.switch.dp.id
+        self.logger.info("Switch %s left, rerouting around it" % dpid)
+        self.switch_dpid_to_dp.pop(dpid, None)
+        self.flow_installer.forget(dpid)
+        self.group_allocator.forget(dpid)
+        self.switch_ports.pop(dpid, None)
+        self.forget_learned_hosts(self.arp_proxy.forget_switch(dpid))
+        if self.telemetry is not None:
+            self.telemetry.forget(dpid)
+        self.flow_lifecycle.forget(dpid)
+        self.pending_flows.forget(dpid)
+        self.packet_in_queue.forget(dpid)
+        self.topo_raw_switches = [known for known in self.topo_raw_switches if known.dp.id != dpid]
+        self.switch_to_other_switch_ports_list = [(switch, port) for switch, port
+                                                  in self.switch_to_other_switch_ports_list if switch != dpid]
+        self.topo_raw_links = [link for link in self.topo_raw_links
+                               if link.src.dpid != dpid and link.dst.dpid != dpid]
+        self.apply_route_changes(self.routing_state.remove_switch(dpid))
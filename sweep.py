@@ -0,0 +1,141 @@
+# Copyright 2021 Lin Wang
+
+# This code is part of the Advanced Computer Networks course at Vrije
+# Universiteit Amsterdam.
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+
+#   http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# !/usr/bin/env python3
+
+# Non-interactive sweep over Fattree and Jellyfish configurations. Every
+# configuration is built and measured in a worker process and its row is
+# appended to the CSV file as soon as it completes, e.g.
+#
+#   python3 sweep.py --k 4:16:2 --seeds 0:10 --output sweep.csv
+#
+# For every k there is one Fattree and, per server count and seed, one
+# Jellyfish with the same number of switches (5k^2/4) and ports (k). Without
+# --servers the Jellyfish gets as many servers as the Fattree (k^3/4).
+
+import argparse
+import csv
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import topo
+from shortest_paths import UNREACHABLE, path_length_histogram, mean_path_length
+
+FIELDS = ["topology", "k", "servers", "switches", "seed", "links", "unfilled_ports",
+          "mean_path_length", "diameter", "disconnected_pairs", "build_seconds", "metric_seconds"]
+
+
+def parse_range(text):
+    "Parses '4', '4,8,16' or 'start:stop[:step]' (stop exclusive) into a list of ints"
+    values = []
+    for part in text.split(","):
+        if ":" in part:
+            bounds = [int(bound) for bound in part.split(":")]
+            values.extend(range(*bounds))
+        elif part:
+            values.append(int(part))
+    return values
+
+
+def configurations(ks, server_counts, seeds):
+    "Yields one (topology, k, servers, seed) tuple per instance to build"
+    for k in ks:
+        yield "fattree", k, k ** 3 // 4, None
+        for servers in (server_counts or [k ** 3 // 4]):
+            for seed in seeds:
+                yield "jellyfish", k, servers, seed
+
+
+def measure(configuration):
+    "Builds one topology and returns its CSV row"
+    name, k, servers, seed = configuration
+    start = time.perf_counter()
+    if name == "fattree":
+        instance = topo.Fattree(k)
+        unfilled = 0
+    else:
+        instance = topo.Jellyfish(servers, 5 * k ** 2 // 4, k, seed)
+        unfilled = sum(instance.unfilled_ports.values())
+    built = time.perf_counter()
+    histogram = path_length_histogram(instance)
+    finite = [length for length in range(UNREACHABLE) if histogram[length] > 0]
+    measured = time.perf_counter()
+    return {
+        "topology": name,
+        "k": k,
+        "servers": len(instance.servers),
+        "switches": len(instance.switches),
+        "seed": "" if seed is None else seed,
+        "links": instance.graph.num_edges(),
+        "unfilled_ports": unfilled,
+        "mean_path_length": "%.6f" % mean_path_length(histogram),
+        "diameter": max(finite) if finite else "",
+        "disconnected_pairs": int(histogram[UNREACHABLE]),
+        "build_seconds": "%.6f" % (built - start),
+        "metric_seconds": "%.6f" % (measured - built),
+    }
+
+
+def run(configs, output, workers=None):
+    "Measures all configurations in a process pool, writing rows as they complete"
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(measure, config): config for config in configs}
+        writer = csv.DictWriter(output, fieldnames=FIELDS)
+        writer.writeheader()
+        output.flush()
+        done = 0
+        for future in as_completed(futures):
+            try:
+                row = future.result()
+            except Exception as error:
+                print("Configuration %s failed: %s" % (futures[future], error), file=sys.stderr)
+                continue
+            writer.writerow(row)
+            output.flush()
+            done += 1
+            print("Completed %d/%d: %s" % (done, len(futures), futures[future]), file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sweep Fattree and Jellyfish configurations")
+    parser.add_argument("--k", default="4", type=parse_range,
+                        help="switch port counts, e.g. 4,8 or 4:16:2 (default: 4)")
+    parser.add_argument("--servers", default=None, type=parse_range,
+                        help="Jellyfish server counts (default: k^3/4 for every k)")
+    parser.add_argument("--seeds", default="0", type=parse_range,
+                        help="Jellyfish RNG seeds, e.g. 0:10 (default: 0)")
+    parser.add_argument("--workers", default=None, type=int,
+                        help="worker processes (default: one per CPU)")
+    parser.add_argument("--output", default="-",
+                        help="CSV file to write, - for stdout (default: -)")
+    args = parser.parse_args(argv)
+
+    for k in args.k:
+        if k < 2 or k % 2 != 0:
+            parser.error("the number of switch ports should be a positive even number, got %d" % k)
+
+    configs = list(configurations(args.k, args.servers, args.seeds))
+    if args.output == "-":
+        run(configs, sys.stdout, args.workers)
+    else:
+        with open(args.output, "w", newline="") as output:
+            run(configs, output, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,370 @@
+# Copyright 2021 Lin Wang
+
+# This code is part of the Advanced Computer Networks course at Vrije
+# Universiteit Amsterdam.
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+
+#   http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Port and flow counter telemetry for SPRouter. Every datapath is polled for
+# its port and flow statistics on its own jittered schedule, and the replies
+# are turned into byte and packet rates kept in fixed-size NumPy rings, one
+# ring of history per port (or flow entry).
+#
+# Polling is spread instead of synchronised: each datapath is due once per
+# interval, shifted by a random jitter, so the requests (and the replies)
+# trickle in rather than arriving in one burst per interval. The request rate
+# is capped by max_requests per second; with more switches than the cap allows
+# the interval stretches, so the control-channel load stays flat as the
+# fabric grows.
+#
+# Like FlowInstaller, Telemetry only talks to datapath objects (send_msg and
+# the ofproto parser); the controller calls poll() from a green thread and
+# feeds the stats replies back in.
+
+import heapq
+import random
+import time
+
+import numpy as npy
+
+DEFAULT_INTERVAL = 1.0
+DEFAULT_JITTER = 0.2
+DEFAULT_MAX_REQUESTS = 200.0
+DEFAULT_HISTORY = 64
+# the lab links run at 15 Mbit/s, see fat-tree.py
+DEFAULT_LINK_CAPACITY = 15e6
+
+# counters kept per port and per flow entry, in this order
+PORT_COUNTERS = ("tx_bytes", "tx_packets", "rx_bytes", "rx_packets")
+FLOW_COUNTERS = ("byte_count", "packet_count")
+
+
+class RateRing:
+    """
+    Rates of monotonically increasing counters, the last history samples for
+    every key. Rows of the arrays are keys, allocated on first sight and
+    reused once forgotten
+    """
+
+    def __init__(self, counters, history=DEFAULT_HISTORY, rows=64):
+        self.counters = counters
+        self.history = history
+        self.rows = {}
+        self.free = []
+        self.last_values = npy.zeros((rows, counters), dtype=npy.float64)
+        self.last_times = npy.full(rows, npy.nan)
+        self.rates = npy.zeros((rows, history, counters), dtype=npy.float64)
+        self.times = npy.full((rows, history), -npy.inf)
+        self.samples = npy.zeros(rows, dtype=npy.int64)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, key):
+        return key in self.rows
+
+    def keys(self):
+        return list(self.rows)
+
+    def _grow(self):
+        size = len(self.last_times)
+        self.last_values = npy.concatenate([self.last_values, npy.zeros_like(self.last_values)])
+        self.last_times = npy.concatenate([self.last_times, npy.full(size, npy.nan)])
+        self.rates = npy.concatenate([self.rates, npy.zeros_like(self.rates)])
+        self.times = npy.concatenate([self.times, npy.full((size, self.history), -npy.inf)])
+        self.samples = npy.concatenate([self.samples, npy.zeros(size, dtype=npy.int64)])
+
+    def row(self, key):
+        row = self.rows.get(key)
+        if row is None:
+            if self.free:
+                row = self.free.pop()
+            else:
+                row = len(self.rows)
+                if row == len(self.last_times):
+                    self._grow()
+            self.rows[key] = row
+        return row
+
+    def update(self, keys, values, now):
+        """
+        Records the counter values (one row per key) read at time now and
+        returns the number of rates written. The first reading of a key, and a
+        reading where a counter went backwards (the entry was replaced), only
+        set the baseline
+        """
+        if not keys:
+            return 0
+        rows = npy.fromiter((self.row(key) for key in keys), dtype=npy.int64, count=len(keys))
+        values = npy.asarray(values, dtype=npy.float64).reshape(len(keys), self.counters)
+        elapsed = now - self.last_times[rows]
+        deltas = values - self.last_values[rows]
+        valid = (elapsed > 0) & (deltas >= 0).all(axis=1)
+        self.last_values[rows] = values
+        self.last_times[rows] = now
+        rows = rows[valid]
+        positions = self.samples[rows] % self.history
+        self.rates[rows, positions] = deltas[valid] / elapsed[valid][:, None]
+        self.times[rows, positions] = now
+        self.samples[rows] += 1
+        return len(rows)
+
+    def current(self, key):
+        "Returns the latest rates of key, or None before its second reading"
+        row = self.rows.get(key)
+        if row is None or self.samples[row] == 0:
+            return None
+        return self.rates[row, (self.samples[row] - 1) % self.history].copy()
+
+    def window(self, seconds, now=None):
+        """
+        Returns (keys, mean rates over the samples of the last seconds) for all
+        keys with at least one such sample
+        """
+        keys = list(self.rows)
+        if not keys:
+            return keys, npy.zeros((0, self.counters))
+        now = time.time() if now is None else now
+        rows = npy.fromiter(self.rows.values(), dtype=npy.int64, count=len(keys))
+        recent = self.times[rows] > now - seconds
+        counts = recent.sum(axis=1)
+        totals = (self.rates[rows] * recent[:, :, None]).sum(axis=1)
+        sampled = counts > 0
+        means = totals[sampled] / counts[sampled][:, None]
+        return [key for key, keep in zip(keys, sampled) if keep], means
+
+    def latest(self):
+        "Returns (keys, latest rates) for all keys with at least one rate"
+        keys = list(self.rows)
+        rows = npy.fromiter(self.rows.values(), dtype=npy.int64, count=len(keys))
+        sampled = self.samples[rows] > 0
+        rows = rows[sampled]
+        rates = self.rates[rows, (self.samples[rows] - 1) % self.history]
+        return [key for key, keep in zip(keys, sampled) if keep], rates
+
+    def forget(self, predicate):
+        "Drops every key for which predicate(key) is true"
+        self.discard([key for key in self.rows if predicate(key)])
+
+    def discard(self, keys):
+        "Drops the given keys, unknown ones are ignored"
+        for key in keys:
+            row = self.rows.pop(key, None)
+            if row is None:
+                continue
+            self.last_times[row] = npy.nan
+            self.times[row] = -npy.inf
+            self.samples[row] = 0
+            self.free.append(row)
+
+
+class PollSchedule:
+    """
+    When every datapath is due next: once per interval, shifted by up to
+    +-jitter of the interval, with the interval stretched so that no more
+    than max_requests datapaths are polled per second
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL, jitter=DEFAULT_JITTER,
+                 max_requests=DEFAULT_MAX_REQUESTS, rng=None):
+        self.interval = interval
+        self.jitter = jitter
+        self.max_requests = max_requests
+        self.rng = rng or random.Random()
+        # (due time, dpid) with stale entries skipped lazily
+        self.heap = []
+        self.due_at = {}
+
+    def __len__(self):
+        return len(self.due_at)
+
+    def effective_interval(self):
+        if not self.max_requests:
+            return self.interval
+        return max(self.interval, len(self.due_at) / self.max_requests)
+
+    def _next(self, now):
+        interval = self.effective_interval()
+        return now + interval * (1 + self.rng.uniform(-self.jitter, self.jitter))
+
+    def add(self, dpid, now):
+        # a new datapath starts at a random phase within one interval
+        due = now + self.rng.uniform(0, self.effective_interval())
+        self.due_at[dpid] = due
+        heapq.heappush(self.heap, (due, dpid))
+
+    def remove(self, dpid):
+        self.due_at.pop(dpid, None)
+
+    def due(self, now):
+        "Returns the datapaths due by now and schedules their next poll"
+        ready = []
+        while self.heap and self.heap[0][0] <= now:
+            due, dpid = heapq.heappop(self.heap)
+            if self.due_at.get(dpid) != due:
+                continue
+            ready.append(dpid)
+            following = self._next(now)
+            self.due_at[dpid] = following
+            heapq.heappush(self.heap, (following, dpid))
+        return ready
+
+    def next_due(self):
+        "Returns the earliest due time, or None without datapaths"
+        while self.heap and self.due_at.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+        return self.heap[0][0] if self.heap else None
+
+
+def match_key(match):
+    "Hashable form of an OFPMatch, the fields in the order the switch reported them"
+    return tuple((field, tuple(value) if isinstance(value, list) else value) for field, value in match.items())
+
+
+class Telemetry:
+
+    def __init__(self, interval=DEFAULT_INTERVAL, jitter=DEFAULT_JITTER, max_requests=DEFAULT_MAX_REQUESTS,
+                 history=DEFAULT_HISTORY, link_capacity=DEFAULT_LINK_CAPACITY, flow_stats=True,
+                 rng=None):
+        self.schedule = PollSchedule(interval, jitter, max_requests, rng)
+        # (dpid, port) -> rates of PORT_COUNTERS
+        self.ports = RateRing(len(PORT_COUNTERS), history)
+        # (dpid, table, priority, match key) -> rates of FLOW_COUNTERS
+        self.flows = RateRing(len(FLOW_COUNTERS), history)
+        # flow keys of every datapath as of its last complete reply, and
+        # those of the parts received so far of a reply still coming in
+        self.flow_keys = {}
+        self.flow_parts = {}
+        self.flow_stats = flow_stats
+        # bits per second of a port, unless set_capacity says otherwise
+        self.link_capacity = link_capacity
+        self.capacities = {}
+        self.datapaths = {}
+        self.requests = 0
+        self.replies = 0
+
+    def add_datapath(self, datapath, now=None):
+        now = time.time() if now is None else now
+        if datapath.id not in self.datapaths:
+            self.schedule.add(datapath.id, now)
+        self.datapaths[datapath.id] = datapath
+
+    def forget(self, dpid):
+        self.datapaths.pop(dpid, None)
+        self.schedule.remove(dpid)
+        self.ports.forget(lambda key: key[0] == dpid)
+        self.flows.discard(self.flow_keys.pop(dpid, ()))
+        self.flows.discard(self.flow_parts.pop(dpid, ()))
+
+    def set_capacity(self, dpid, port, bits_per_second):
+        self.capacities[(dpid, port)] = bits_per_second
+
+    def poll(self, now=None):
+        "Sends the stats requests of every datapath that is due and returns how many datapaths were polled"
+        now = time.time() if now is None else now
+        polled = 0
+        for dpid in self.schedule.due(now):
+            datapath = self.datapaths.get(dpid)
+            if datapath is None:
+                continue
+            ofproto = datapath.ofproto
+            parser = datapath.ofproto_parser
+            datapath.send_msg(parser.OFPPortStatsRequest(datapath, 0, ofproto.OFPP_ANY))
+            if self.flow_stats:
+                datapath.send_msg(parser.OFPFlowStatsRequest(datapath))
+            self.requests += 1
+            polled += 1
+        return polled
+
+    def next_poll(self):
+        return self.schedule.next_due()
+
+    def port_stats_reply(self, msg, now=None):
+        now = time.time() if now is None else now
+        dpid = msg.datapath.id
+        ofproto = msg.datapath.ofproto
+        keys = []
+        values = []
+        for stat in msg.body:
+            # the local port is the switch's own interface, not a link
+            if stat.port_no > ofproto.OFPP_MAX:
+                continue
+            keys.append((dpid, stat.port_no))
+            values.append((stat.tx_bytes, stat.tx_packets, stat.rx_bytes, stat.rx_packets))
+        self.replies += 1
+        return self.ports.update(keys, values, now)
+
+    def flow_stats_reply(self, msg, now=None):
+        now = time.time() if now is None else now
+        dpid = msg.datapath.id
+        keys = []
+        values = []
+        for stat in msg.body:
+            keys.append((dpid, stat.table_id, stat.priority, match_key(stat.match)))
+            values.append((stat.byte_count, stat.packet_count))
+        self.replies += 1
+        # a reply may come in several parts; the entries missing from all of
+        # them are gone from the switch, so their rows are freed
+        seen = self.flow_parts.setdefault(dpid, set())
+        seen.update(keys)
+        if not msg.flags & msg.datapath.ofproto.OFPMPF_REPLY_MORE:
+            del self.flow_parts[dpid]
+            self.flows.discard(self.flow_keys.get(dpid, set()) - seen)
+            self.flow_keys[dpid] = seen
+        return self.flows.update(keys, values, now)
+
+    def _capacities(self, keys):
+        return npy.array([self.capacities.get(key, self.link_capacity) for key in keys], dtype=npy.float64)
+
+    def utilization(self, window=None, now=None):
+        """
+        Returns {(dpid, port): transmit utilization in [0, 1]}, from the latest
+        rates or averaged over the last window seconds
+        """
+        if window is None:
+            keys, rates = self.ports.latest()
+        else:
+            keys, rates = self.ports.window(window, now)
+        if not keys:
+            return {}
+        fractions = rates[:, 0] * 8 / self._capacities(keys)
+        return dict(zip(keys, fractions.tolist()))
+
+    def link_utilization(self, links, window=None, now=None):
+        "Returns {(src dpid, dst dpid): utilization} of (src dpid, src port, dst dpid) links"
+        ports = self.utilization(window, now)
+        return {(src, dst): ports[(src, port)] for src, port, dst in links if (src, port) in ports}
+
+    def hottest(self, links, count=1, window=None, now=None):
+        "Returns the count busiest links as ((src dpid, dst dpid), utilization), busiest first"
+        loads = self.link_utilization(links, window, now)
+        return heapq.nlargest(count, loads.items(), key=lambda item: item[1])
+
+    def flow_rates(self, dpid=None, window=None, now=None):
+        "Returns {(dpid, table, priority, match key): bytes per second} of the flow entries"
+        if window is None:
+            keys, rates = self.flows.latest()
+        else:
+            keys, rates = self.flows.window(window, now)
+        return {key: rate for key, rate in zip(keys, rates[:, 0].tolist())
+                if dpid is None or key[0] == dpid}
+
+    def metrics(self):
+        return {
+            "datapaths": len(self.datapaths),
+            "ports": len(self.ports),
+            "flows": len(self.flows),
+            "requests": self.requests,
+            "replies": self.replies,
+            "interval": self.schedule.effective_interval(),
+        }
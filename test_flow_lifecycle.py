@@ -0,0 +1,61 @@
+# Copyright 2021 Lin Wang
+
+# This code is part of the Advanced Computer Networks course at Vrije
+# Universiteit Amsterdam.
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+
+#   http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Cookies, budgets and least-recently-used eviction of FlowLifecycle.
+
+import flow_lifecycle
+from flow_lifecycle import FlowLifecycle, PROACTIVE, REACTIVE
+
+
+def test_cookies_carry_the_kind():
+    lifecycle = FlowLifecycle(budget=10, idle_timeout=5)
+    proactive = lifecycle.install(1, 10, "route", reactive=False)
+    reactive = lifecycle.install(1, 40, "flow", reactive=True)
+    assert flow_lifecycle.cookie_kind(proactive.cookie) == PROACTIVE
+    assert flow_lifecycle.cookie_kind(reactive.cookie) == REACTIVE
+    assert (proactive.idle_timeout, reactive.idle_timeout) == (0, 5)
+    assert lifecycle.occupancy(1) == (1, 1)
+    # a re-install keeps the cookie
+    assert lifecycle.install(1, 40, "flow", reactive=True).cookie == reactive.cookie
+
+
+def test_budget_evicts_least_recently_used():
+    lifecycle = FlowLifecycle(budget=3)
+    cookies = {key: lifecycle.install(1, 40, key, reactive=True).cookie for key in "abc"}
+    # a is used again (re-installed), b shows traffic in the flow stats
+    lifecycle.install(1, 40, "a", reactive=True)
+    assert lifecycle.flow_stats(1, [(cookies["b"], 7), (cookies["c"], 0)]) == 1
+    evicted = lifecycle.install(1, 40, "d", reactive=True).evicted
+    assert [entry.key for entry in evicted] == ["c"]
+    evicted = lifecycle.install(1, 40, "e", reactive=True).evicted
+    assert [entry.key for entry in evicted] == ["a"]
+    assert lifecycle.occupancy(1) == (0, 3)
+    assert lifecycle.metrics()["evicted"] == 2
+
+
+def test_removed_and_deleted_entries_leave_the_books():
+    lifecycle = FlowLifecycle(budget=2)
+    first = lifecycle.install(1, 40, "a", reactive=True).cookie
+    lifecycle.install(1, 40, "b", reactive=True)
+    assert lifecycle.removed(1, first, 0)
+    assert not lifecycle.removed(1, first, 0)
+    lifecycle.deleted(1, 40, "b")
+    assert lifecycle.occupancy(1) == (0, 0)
+    assert lifecycle.install(1, 40, "c", reactive=True).evicted == []
+    assert lifecycle.metrics()["removed"] == {"idle_timeout": 2}
+    lifecycle.forget(1)
+    assert lifecycle.metrics()["reactive"] == 0
@@ -0,0 +1,70 @@
+# Copyright 2021 Lin Wang
+
+# This code is part of the Advanced Computer Networks course at Vrije
+# Universiteit Amsterdam.
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+
+#   http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Demand estimation and elephant placement of hedera, on hand-checked cases.
+
+from fattree_index import FattreeIndex
+import hedera
+
+
+def test_estimate_demands_shares_senders_and_limits_receivers():
+    # host 0 sends to 1, 2 and 3, host 1 to 0 and 2, host 2 to 0 and 3, host 3
+    # to 1; host 1 receives 1/3 from host 0 and is left with 2/3 for host 3
+    flows = [(0, 1), (0, 2), (0, 3), (1, 0), (1, 2), (2, 0), (2, 3), (3, 1)]
+    demands = dict(zip(flows, hedera.estimate_demands(flows)))
+    expected = {(0, 1): 1 / 3, (0, 2): 1 / 3, (0, 3): 1 / 3, (1, 0): 1 / 2, (1, 2): 1 / 2,
+                (2, 0): 1 / 2, (2, 3): 1 / 2, (3, 1): 2 / 3}
+    for flow, demand in expected.items():
+        assert abs(demands[flow] - demand) < 1e-6
+
+
+def test_estimate_demands_limits_oversubscribed_receivers():
+    flows = [(source, 9) for source in range(4)] + [(0, 8)]
+    demands = dict(zip(flows, hedera.estimate_demands(flows)))
+    assert abs(sum(demands[(source, 9)] for source in range(4)) - 1.0) < 1e-6
+    assert all(abs(demands[(source, 9)] - 0.25) < 1e-6 for source in range(4))
+    # the sender of the limited flow gives its rest to its other flow
+    assert abs(demands[(0, 8)] - 0.75) < 1e-6
+
+
+def test_host_paths_of_a_fattree():
+    index = FattreeIndex(4)
+    hosts = list(index.hosts())
+    assert hedera.host_paths(index, hosts[0], hosts[1]) == [(index.edge_of(hosts[0]),)]
+    assert len(hedera.host_paths(index, hosts[0], hosts[2])) == 2
+    paths = hedera.host_paths(index, hosts[0], hosts[-1])
+    assert len(paths) == 4 and len(set(paths)) == 4
+    for path in paths:
+        for upper, lower in hedera.path_links(path):
+            assert index.is_neighbor(upper, lower)
+
+
+def test_scheduler_spreads_and_keeps_placements():
+    index = FattreeIndex(4)
+    hosts = list(index.hosts())
+    scheduler = hedera.Scheduler(index)
+    # the two hosts of one edge switch send to two hosts of another pod
+    rates = {(hosts[0], hosts[4]): 0.9, (hosts[1], hosts[5]): 0.9}
+    moved, released = scheduler.schedule(rates)
+    assert set(moved) == set(rates) and released == []
+    first, second = moved.values()
+    # the elephants leave their edge switch on different uplinks
+    assert first[1] != second[1]
+    moved, released = scheduler.schedule(rates)
+    assert moved == {} and released == []
+    moved, released = scheduler.schedule({(hosts[0], hosts[4]): 0.9, (hosts[1], hosts[5]): 0.01})
+    assert moved == {} and released == [(hosts[1], hosts[5])]
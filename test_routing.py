@@ -0,0 +1,240 @@
+# Copyright 2021 Lin Wang
+
+# This code is part of the Advanced Computer Networks course at Vrije
+# Universiteit Amsterdam.
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+
+#   http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Random link and switch flaps against RoutingState, inline and through a
+# RouteWorker, compared with a state built from scratch on the links that are
+# up; plus prefixes of learned hosts and the PacketInQueue bounds.
+
+import multiprocessing
+import random
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import pytest
+
+import routing
+from fattree_index import FattreeIndex, HOST
+from route_worker import RouteWorker, PacketInQueue
+
+
+def fattree_links(index):
+    "Returns the directed (src dpid, src port, dst dpid) switch links of a fat-tree"
+    links = []
+    for upper, lower in index.links():
+        if index.layer(lower) == HOST:
+            continue
+        links.append((index.dpid(upper), index.port(upper, lower), index.dpid(lower)))
+        links.append((index.dpid(lower), index.port(lower, upper), index.dpid(upper)))
+    return links
+
+
+def from_scratch(index, links, switches, multipath=False):
+    state = routing.RoutingState(routing.fattree_prefixes(index), multipath=multipath)
+    for dpid in switches:
+        state.add_switch(dpid)
+    for src_dpid, src_port, dst_dpid in links:
+        if src_dpid in switches and dst_dpid in switches:
+            state.add_link(src_dpid, src_port, dst_dpid)
+    return state
+
+
+def assert_converged(state, index, links, switches):
+    expected = from_scratch(index, links, switches, state.multipath)
+    assert not state.dirty
+    assert state.ports == expected.ports
+    assert state.distances == expected.distances
+
+
+class ManualExecutor:
+    "Runs submitted computations only when told to, so events can overtake them"
+
+    def __init__(self):
+        self.waiting = []
+
+    def submit(self, function, *args):
+        future = Future()
+        self.waiting.append((future, function, args))
+        return future
+
+    def run(self, count=None):
+        while self.waiting and count != 0:
+            future, function, args = self.waiting.pop(0)
+            if future.set_running_or_notify_cancel():
+                future.set_result(function(*args))
+            count = None if count is None else count - 1
+
+    def shutdown(self, wait=True):
+        pass
+
+
+def flap(state, index, links, rng, events):
+    """
+    Applies random link and switch events to state, yielding the links and
+    switches that are up after every event so that the caller can drive a
+    deferred state in between
+    """
+    up = set(links)
+    switches = {index.dpid(node) for node in index.switches()}
+    for _ in range(events):
+        choice = rng.random()
+        if choice < 0.45 and up:
+            link = rng.choice(sorted(up))
+            up.discard(link)
+            state.remove_link(link[0], link[2])
+        elif choice < 0.9:
+            link = rng.choice(links)
+            if link[0] in switches and link[2] in switches:
+                up.add(link)
+                state.add_link(*link)
+        elif choice < 0.95:
+            dpid = rng.choice(sorted(switches))
+            switches.discard(dpid)
+            up = {link for link in up if dpid not in (link[0], link[2])}
+            state.remove_switch(dpid)
+        else:
+            missing = [index.dpid(node) for node in index.switches() if index.dpid(node) not in switches]
+            if missing:
+                dpid = rng.choice(missing)
+                switches.add(dpid)
+                state.add_switch(dpid)
+        yield up, switches
+
+
+@pytest.mark.parametrize("k", [4, 6])
+@pytest.mark.parametrize("multipath", [False, True])
+def test_inline_follows_link_flaps(k, multipath):
+    index = FattreeIndex(k)
+    links = fattree_links(index)
+    state = from_scratch(index, links, {index.dpid(node) for node in index.switches()}, multipath)
+    rng = random.Random(k)
+    for up, switches in flap(state, index, links, rng, 300):
+        pass
+    assert_converged(state, index, up, switches)
+
+
+@pytest.mark.parametrize("multipath", [False, True])
+def test_deferred_follows_link_flaps(multipath):
+    index = FattreeIndex(4)
+    links = fattree_links(index)
+    state = routing.RoutingState(routing.fattree_prefixes(index), multipath=multipath, deferred=True)
+    executor = ManualExecutor()
+    worker = RouteWorker(state, offload_switches=0, executor=executor)
+    for src_dpid, src_port, dst_dpid in links:
+        state.add_link(src_dpid, src_port, dst_dpid)
+    worker.schedule()
+    rng = random.Random(7)
+    for up, switches in flap(state, index, links, rng, 400):
+        # computations finish at random moments, often after newer events
+        worker.schedule()
+        if rng.random() < 0.3:
+            executor.run(1)
+            worker.poll()
+    while worker.busy():
+        executor.run()
+        worker.poll()
+    assert worker.stale + worker.cancelled > 0
+    assert_converged(state, index, up, switches)
+
+
+def test_deferred_readds_uplink_while_pending():
+    index = FattreeIndex(4)
+    links = fattree_links(index)
+    state = routing.RoutingState(routing.fattree_prefixes(index), deferred=True)
+    worker = RouteWorker(state, workers=0)
+    for link in links:
+        state.add_link(*link)
+    worker.schedule()
+    uplinks = [link for link in links if link[0] == 1]
+    for src_dpid, _, dst_dpid in uplinks:
+        state.remove_link(src_dpid, dst_dpid)
+    # the kept next hops still point at the lowest uplink, which stays down
+    state.add_link(*uplinks[1])
+    worker.schedule()
+    switches = {index.dpid(node) for node in index.switches()}
+    assert_converged(state, index, [link for link in links if link != uplinks[0]], switches)
+
+
+@pytest.mark.parametrize("deferred", [False, True])
+@pytest.mark.parametrize("multipath", [False, True])
+def test_link_moves_to_another_port(deferred, multipath):
+    index = FattreeIndex(4)
+    links = fattree_links(index)
+    state = routing.RoutingState(routing.fattree_prefixes(index), multipath=multipath, deferred=deferred)
+    worker = RouteWorker(state, workers=0)
+    for link in links:
+        state.add_link(*link)
+    worker.schedule()
+    src_dpid, src_port, dst_dpid = links[0]
+    changes = state.add_link(src_dpid, src_port + 100, dst_dpid)
+    changes.update(worker.schedule())
+    moved = [(src_dpid, src_port + 100, dst_dpid) if link == links[0] else link for link in links]
+    switches = {index.dpid(node) for node in index.switches()}
+    assert_converged(state, index, moved, switches)
+    # only the switch whose port moved gets new next hops
+    assert set(changes) == {src_dpid}
+
+
+def test_process_pool_follows_link_flaps():
+    index = FattreeIndex(4)
+    links = fattree_links(index)
+    state = routing.RoutingState(routing.fattree_prefixes(index), deferred=True)
+    executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+    worker = RouteWorker(state, offload_switches=0, executor=executor)
+    try:
+        for link in links:
+            state.add_link(*link)
+        worker.schedule()
+        for up, switches in flap(state, index, links, random.Random(3), 50):
+            worker.schedule()
+        while worker.busy():
+            if worker.running is not None:
+                worker.running[1].result(timeout=60)
+            worker.poll()
+    finally:
+        worker.shutdown()
+    assert worker.submitted > 0
+    assert_converged(state, index, up, switches)
+
+
+def test_add_and_remove_prefix():
+    index = FattreeIndex(4)
+    state = routing.RoutingState({}, {})
+    for link in fattree_links(index):
+        state.add_link(*link)
+    added = state.add_prefix(1, "10.9.9.9", routing.HOST_MASK, 5)
+    assert added[1] == [("10.9.9.9", routing.HOST_MASK, 5)]
+    assert len(added) == index.num_switches
+    assert state.add_prefix(1, "10.9.9.9", routing.HOST_MASK, 5) == {}
+    removed = state.remove_prefix(1, "10.9.9.9", routing.HOST_MASK)
+    assert all(entries == [("10.9.9.9", routing.HOST_MASK, None)] for entries in removed.values())
+    assert len(removed) == index.num_switches
+    assert 1 not in state.prefixes and not state.local_entries[1]
+    # learned again on the same switch, it is routed again
+    assert state.add_prefix(1, "10.9.9.9", routing.HOST_MASK, 5)
+
+
+def test_packet_in_queue_round_robin_and_bounds():
+    queue = PacketInQueue(capacity=5, switch_capacity=3)
+    for item in range(4):
+        queue.put(1, ("a", item))
+    assert queue.put(2, ("b", 0))
+    assert queue.put(2, ("b", 1))
+    assert not queue.put(3, ("c", 0))
+    assert queue.dropped == 2
+    assert queue.get_batch(4) == [("a", 0), ("b", 0), ("a", 1), ("b", 1)]
+    assert queue.forget(1) == [("a", 2)]
+    assert len(queue) == 0
+    assert queue.get_batch(10) == []
@@ -0,0 +1,114 @@
+# Copyright 2021 Lin Wang
+
+# This code is part of the Advanced Computer Networks course at Vrije
+# Universiteit Amsterdam.
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+
+#   http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Rates, windows and row reuse of RateRing, how PollSchedule spreads and caps
+# the stats requests, and how Telemetry drops the flows a switch no longer has.
+
+import random
+from types import SimpleNamespace
+
+import numpy as npy
+
+from telemetry import RateRing, PollSchedule, Telemetry
+
+OFPMPF_REPLY_MORE = 1
+
+
+def flow_reply(datapath, cookies, more=False):
+    "A flow stats reply part of datapath, one entry per cookie with the cookie as byte count"
+    body = [SimpleNamespace(table_id=0, priority=10, match={"cookie": cookie},
+                            byte_count=cookie, packet_count=1) for cookie in cookies]
+    return SimpleNamespace(datapath=datapath, body=body, flags=OFPMPF_REPLY_MORE if more else 0)
+
+
+def test_rate_ring_rates_and_resets():
+    ring = RateRing(2, history=4, rows=1)
+    assert ring.update([("a",), ("b",)], [[0, 0], [100, 10]], 0.0) == 0
+    assert ring.current(("a",)) is None
+    assert ring.update([("a",), ("b",)], [[50, 5], [300, 30]], 2.0) == 2
+    assert list(ring.current(("a",))) == [25.0, 2.5]
+    assert list(ring.current(("b",))) == [100.0, 10.0]
+    # a counter that went backwards was reset, it only sets the new baseline
+    assert ring.update([("b",)], [[10, 1]], 3.0) == 0
+    assert list(ring.current(("b",))) == [100.0, 10.0]
+    assert ring.update([("b",)], [[20, 2]], 4.0) == 1
+    assert list(ring.current(("b",))) == [10.0, 1.0]
+
+
+def test_rate_ring_window_wraps():
+    ring = RateRing(1, history=3)
+    for second in range(7):
+        ring.update([("a",)], [[second * second]], float(second))
+    # the rates are 1, 3, 5, ..., 11 and only the last three are kept
+    keys, means = ring.window(10.0, now=6.0)
+    assert keys == [("a",)]
+    assert npy.allclose(means, [[(7 + 9 + 11) / 3]])
+    keys, means = ring.window(1.5, now=6.0)
+    assert npy.allclose(means, [[(9 + 11) / 2]])
+
+
+def test_rate_ring_reuses_forgotten_rows():
+    ring = RateRing(1, history=2, rows=2)
+    for key in ("a", "b", "c"):
+        ring.update([key], [[0]], 0.0)
+    assert len(ring.last_times) == 4
+    ring.forget(lambda key: key != "c")
+    assert ring.keys() == ["c"]
+    ring.update(["d"], [[0]], 1.0)
+    ring.update(["d"], [[5]], 2.0)
+    assert list(ring.current("d")) == [5.0]
+    assert len(ring.last_times) == 4
+
+
+def test_poll_schedule_spreads_and_caps():
+    schedule = PollSchedule(interval=1.0, jitter=0.2, max_requests=50, rng=random.Random(1))
+    for dpid in range(100):
+        schedule.add(dpid, 0.0)
+    # 100 switches at 50 polls per second stretch the interval to 2 s
+    assert schedule.effective_interval() == 2.0
+    polled = []
+    now = 0.0
+    while now < 20.0:
+        now += 0.1
+        polled.extend(schedule.due(now))
+    assert len(set(polled)) == 100
+    assert len(polled) / 20.0 <= 50 * 1.25
+    schedule.remove(5)
+    assert 5 not in schedule.due(100.0)
+
+
+def test_flow_rows_follow_the_flow_table():
+    datapath = SimpleNamespace(id=1, ofproto=SimpleNamespace(OFPMPF_REPLY_MORE=OFPMPF_REPLY_MORE))
+    other = SimpleNamespace(id=2, ofproto=datapath.ofproto)
+    telemetry = Telemetry(rng=random.Random(1))
+    telemetry.flow_stats_reply(flow_reply(datapath, [1, 2, 3]), now=0.0)
+    telemetry.flow_stats_reply(flow_reply(other, [1]), now=0.0)
+    assert len(telemetry.flows) == 4
+    # entry 1 was removed; the reply comes in two parts and the rows stay
+    # until the last one has arrived
+    telemetry.flow_stats_reply(flow_reply(datapath, [2], more=True), now=1.0)
+    assert len(telemetry.flows) == 4
+    telemetry.flow_stats_reply(flow_reply(datapath, [3]), now=1.0)
+    assert sorted(key[3] for key in telemetry.flows.keys() if key[0] == 1) == [(("cookie", 2),), (("cookie", 3),)]
+    # the other switch keeps its entry, and many polls do not grow the rows
+    assert len(telemetry.flows) == 3
+    for second in range(2, 50):
+        telemetry.flow_stats_reply(flow_reply(datapath, [second + 10]), now=float(second))
+    assert len(telemetry.flows) == 2
+    assert len(telemetry.flows.last_times) == 64
+    telemetry.forget(1)
+    assert [key[0] for key in telemetry.flows.keys()] == [2]
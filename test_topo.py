@@ -0,0 +1,59 @@
+# Copyright 2021 Lin Wang
+
+# This code is part of the Advanced Computer Networks course at Vrije
+# Universiteit Amsterdam.
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy
+# of the License at
+
+#   http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Save/load round trips of Fattree and Jellyfish, that saving leaves the
+# topology alone, and rejection of files that are not topology files.
+
+import topo
+
+
+def test_fattree_survives_save_and_load(tmp_path):
+    fattree = topo.Fattree(4)
+    path = str(tmp_path / "fattree.topo")
+    addresses = fattree.graph.addresses
+    topo.save_topology(fattree, path)
+    # saving does not touch the topology's own graph
+    assert fattree.graph.metadata == {} and fattree.graph.addresses is addresses
+    loaded = topo.load_topology(path)
+    assert isinstance(loaded, topo.Fattree)
+    assert list(loaded.graph.edges()) == list(fattree.graph.edges())
+    assert [loaded.graph.node_id(node) for node in range(len(loaded.graph))] == \
+        [fattree.graph.node_id(node) for node in range(len(fattree.graph))]
+    assert loaded.graph.address(0) == fattree.index.address(0)
+    assert loaded.index.k == 4
+
+
+def test_jellyfish_survives_save_and_load(tmp_path):
+    jellyfish = topo.Jellyfish(16, 20, 4, seed=3)
+    path = str(tmp_path / "jellyfish.topo")
+    topo.save_topology(jellyfish, path)
+    loaded = topo.load_topology(path)
+    assert isinstance(loaded, topo.Jellyfish)
+    assert list(loaded.graph.edges()) == list(jellyfish.graph.edges())
+    assert loaded.unfilled_ports == jellyfish.unfilled_ports
+    assert len(loaded.switches) == 20 and len(loaded.servers) == 16
+
+
+def test_load_rejects_other_files(tmp_path):
+    path = tmp_path / "other.topo"
+    path.write_bytes(b"not a topology file at all")
+    try:
+        topo.load_topology(str(path))
+    except ValueError as error:
+        assert "not a topology file" in str(error)
+    else:
+        raise AssertionError("loading a foreign file should fail")
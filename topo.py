@@ -18,12 +18,55 @@
 import sys
 import random
 import queue
+import time
+import json
+import mmap
+import socket
+import struct
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+
+from fattree_index import FattreeIndex, LAYER_NAMES, EDGE, AGGREGATION, CORE, HOST, address_value
+
+
+# Topology generators are silent by default. Progress is reported as
+# BuildEvents to an optional sink, any callable taking one event:
+#   topology  "fattree" or "jellyfish"
+#   stage     "layer" (nodes of one layer), "links" (links of one kind),
+#             "unfilled" (switch ports left free), "graph" (CSR built) or
+#             "done" (whole build, count is the number of links)
+#   layer     the layer or link kind the event is about, None for the whole topology
+#   count     number of nodes, links or ports
+#   seconds   time spent on the stage, None for the pure counts of "layer" and
+#             "unfilled" events
+BuildEvent = namedtuple("BuildEvent", ["topology", "stage", "layer", "count", "seconds"])
+
+
+def emit(sink, topology, stage, layer, count, seconds=None):
+    if sink is not None:
+        sink(BuildEvent(topology, stage, layer, count, seconds))
+
+
+# Sink that prints every event on stdout
+def print_sink(event):
+    kind = event.layer + " " if event.layer else ""
+    if event.stage == "layer":
+        print("%s: %d %snodes" % (event.topology, event.count, kind))
+    elif event.stage == "links":
+        print("%s: %d %slinks in %.3f s" % (event.topology, event.count, kind, event.seconds))
+    elif event.stage == "unfilled":
+        print("%s: %d %sports left unconnected" % (event.topology, event.count, kind))
+    elif event.stage == "graph":
+        print("%s: graph of %d nodes built in %.3f s" % (event.topology, event.count, event.seconds))
+    else:
+        print("%s: done, %d links in %.3f s" % (event.topology, event.count, event.seconds))
 
 
 class Edge:
-    def __init__(self):
-        self.lnode = None
-        self.rnode = None
+    def __init__(self, lnode=None, rnode=None):
+        self.lnode = lnode
+        self.rnode = rnode
 
     def remove(self):
         self.lnode.edges.remove(self)
@@ -33,14 +76,36 @@ class Edge:
 
 
 # Class for a node in the graph
+# A node is either standalone (it keeps its own list of Edge objects) or a
+# lightweight view of one index in a Graph, in which case its edges are read
+# from the CSR arrays on demand and the node cannot be modified.
 class Node:
-    def __init__(self, id, type):
-        self.edges = []
+    def __init__(self, id, type, graph=None, index=None):
         self.id = id
         self.type = type
+        self.graph = graph
+        self.index = index
+        self._edges = [] if graph is None else None
+
+    @property
+    def edges(self):
+        if self.graph is None:
+            return self._edges
+        return [Edge(self, self.graph.node(neighbor)) for neighbor in self.graph.neighbors(self.index)]
+
+    @edges.setter
+    def edges(self, edges):
+        self._check_mutable()
+        self._edges = edges
+
+    def _check_mutable(self):
+        if self.graph is not None:
+            raise TypeError("node %s is a read-only view of a Graph" % self.id)
 
     # Add an edge connected to another node
     def add_edge(self, node):
+        self._check_mutable()
+        node._check_mutable()
         edge = Edge()
         edge.lnode = self
         edge.rnode = node
@@ -50,10 +115,13 @@ class Node:
 
     # Remove an edge from the node
     def remove_edge(self, edge):
+        self._check_mutable()
         self.edges.remove(edge)
 
     # Decide if another node is a neighbor
     def is_neighbor(self, node):
+        if self.graph is not None and self.graph is node.graph:
+            return self.graph.has_edge(self.index, node.index)
         for edge in self.edges:
             if edge.lnode == node or edge.rnode == node:
                 return True
@@ -62,286 +130,448 @@ class Node:
     def __eq__(self, other):
         return self.id == other.id and self.type == other.type
 
-class Jellyfish:
 
-    def __init__(self, num_servers, num_switches, num_ports):
-        self.servers = []
-        self.switches = []
-        self.generate(num_servers, num_switches, num_ports)
+# Compact undirected graph in CSR form. Nodes are the integers 0..n-1, the
+# neighbors of node i are neighbors[offsets[i]:offsets[i + 1]] (sorted, so
+# adjacency checks are a binary search) and types[i] indexes type_names.
+# Node ids such as "s3" or "h12" are not stored; they are derived from
+# id_ranges, a list of (start, stop, prefix, base) tuples meaning that
+# node i in [start, stop) is called prefix + str(i - start + base).
+# addresses optionally holds one IPv4 address per node as an unsigned int
+# (0 for none).
+#
+# Graphs can be saved to a binary file: a fixed header, a JSON description and
+# the arrays, each 8-byte aligned and in native byte order. Graph.load maps the
+# file read-only and hands out memoryviews of the mapping, so loading costs no
+# copies and processes that load the same file share its pages.
+class Graph:
+
+    def __init__(self, types, type_names, offsets, neighbors, id_ranges, addresses=None):
+        self.types = types
+        self.type_names = tuple(type_names)
+        self.offsets = offsets
+        self.neighbors_array = neighbors
+        self.id_ranges = list(id_ranges)
+        self.addresses = addresses
+        # free-form description stored along with the graph in a topology file
+        self.metadata = {}
+
+    @classmethod
+    def from_edges(cls, types, type_names, lefts, rights, id_ranges):
+        "Builds the CSR arrays from two parallel arrays of edge endpoints"
+        num_nodes = len(types)
+        degree = array('i', bytes(4 * (num_nodes + 1)))
+        for node in lefts:
+            degree[node] += 1
+        for node in rights:
+            degree[node] += 1
+
+        offsets = array('i', bytes(4 * (num_nodes + 1)))
+        total = 0
+        for node in range(num_nodes):
+            offsets[node] = total
+            total += degree[node]
+        offsets[num_nodes] = total
+
+        neighbors = array('i', bytes(4 * total))
+        position = array('i', offsets)
+        for lnode, rnode in zip(lefts, rights):
+            neighbors[position[lnode]] = rnode
+            position[lnode] += 1
+            neighbors[position[rnode]] = lnode
+            position[rnode] += 1
+
+        # sort each adjacency slice so that has_edge can bisect
+        for node in range(num_nodes):
+            start, stop = offsets[node], offsets[node + 1]
+            if stop - start > 1:
+                neighbors[start:stop] = array('i', sorted(neighbors[start:stop]))
+        return cls(types, type_names, offsets, neighbors, id_ranges)
+
+    def __len__(self):
+        return len(self.types)
+
+    def num_edges(self):
+        return len(self.neighbors_array) // 2
+
+    def degree(self, index):
+        return self.offsets[index + 1] - self.offsets[index]
+
+    def neighbors(self, index):
+        return self.neighbors_array[self.offsets[index]:self.offsets[index + 1]]
+
+    def has_edge(self, lindex, rindex):
+        start, stop = self.offsets[lindex], self.offsets[lindex + 1]
+        position = bisect_left(self.neighbors_array, rindex, start, stop)
+        return position < stop and self.neighbors_array[position] == rindex
+
+    def node_type(self, index):
+        return self.type_names[self.types[index]]
+
+    def node_id(self, index):
+        for start, stop, prefix, base in self.id_ranges:
+            if start <= index < stop:
+                return prefix + str(index - start + base)
+        raise IndexError("node index %d out of range" % index)
+
+    def node(self, index):
+        return Node(self.node_id(index), self.node_type(index), self, index)
+
+    def address(self, index):
+        "Returns the dotted IPv4 address of a node, or None if it has none"
+        if self.addresses is None or self.addresses[index] == 0:
+            return None
+        return socket.inet_ntoa(struct.pack("!I", self.addresses[index]))
+
+    def save(self, path, metadata=None, addresses=None):
+        "Writes the graph to a binary topology file, with metadata and addresses in place of its own if given"
+        metadata = self.metadata if metadata is None else metadata
+        addresses = self.addresses if addresses is None else addresses
+        arrays = [("types", "B", self.types), ("offsets", "i", self.offsets),
+                  ("neighbors", "i", self.neighbors_array)]
+        if addresses is not None:
+            arrays.append(("addresses", "I", addresses))
+        layout = {}
+        chunks = []
+        position = 0
+        for name, typecode, values in arrays:
+            data = memoryview(values).cast("B").tobytes()
+            if len(data) != len(values) * struct.calcsize(typecode):
+                raise ValueError("array %s does not hold %s items" % (name, typecode))
+            layout[name] = [position, len(values), typecode]
+            chunks.append(data + bytes(_padding(len(data))))
+            position += len(chunks[-1])
+        description = json.dumps({
+            "version": GRAPH_FILE_VERSION,
+            "byteorder": sys.byteorder,
+            "type_names": list(self.type_names),
+            "id_ranges": [list(id_range) for id_range in self.id_ranges],
+            "arrays": layout,
+            "metadata": metadata,
+        }).encode()
+        with open(path, "wb") as stream:
+            stream.write(_GRAPH_HEADER.pack(GRAPH_MAGIC, GRAPH_FILE_VERSION, len(description)))
+            stream.write(description + bytes(_padding(_GRAPH_HEADER.size + len(description))))
+            for chunk in chunks:
+                stream.write(chunk)
+
+    @classmethod
+    def load(cls, path):
+        "Maps a binary topology file and returns its graph, backed by the mapping"
+        with open(path, "rb") as stream:
+            mapping = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(mapping) < _GRAPH_HEADER.size:
+            raise ValueError("%s is not a topology file" % path)
+        magic, version, length = _GRAPH_HEADER.unpack_from(mapping, 0)
+        if magic != GRAPH_MAGIC:
+            raise ValueError("%s is not a topology file" % path)
+        if version != GRAPH_FILE_VERSION:
+            raise ValueError("%s has format version %d, expected %d" % (path, version, GRAPH_FILE_VERSION))
+        description = json.loads(mapping[_GRAPH_HEADER.size:_GRAPH_HEADER.size + length].decode())
+        if description["byteorder"] != sys.byteorder:
+            raise ValueError("%s was written on a %s-endian machine" % (path, description["byteorder"]))
+        base = _GRAPH_HEADER.size + length + _padding(_GRAPH_HEADER.size + length)
+        view = memoryview(mapping)
+        arrays = {}
+        for name, (offset, count, typecode) in description["arrays"].items():
+            start = base + offset
+            arrays[name] = view[start:start + count * struct.calcsize(typecode)].cast(typecode)
+        graph = cls(arrays["types"], description["type_names"], arrays["offsets"], arrays["neighbors"],
+                    [tuple(id_range) for id_range in description["id_ranges"]], arrays.get("addresses"))
+        graph.metadata = description["metadata"]
+        return graph
+
+    def edges(self):
+        "Yields every undirected edge once as an (lindex, rindex) pair"
+        for lnode in range(len(self.types)):
+            for rnode in self.neighbors(lnode):
+                if lnode < rnode:
+                    yield lnode, rnode
+
+
+GRAPH_MAGIC = b"ACNTOPO\0"
+GRAPH_FILE_VERSION = 1
+# magic, format version, length of the JSON description
+_GRAPH_HEADER = struct.Struct("<8sII")
+
+
+def _padding(length):
+    return -length % 8
+
+
+# Sequence of Node views over a contiguous range of Graph indices, so that
+# topologies can expose servers and switches without keeping a Python object
+# per node alive
+class NodeList:
+
+    def __init__(self, graph, start, stop):
+        self.graph = graph
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[i] for i in range(*position.indices(len(self)))]
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError("node list index out of range")
+        return self.graph.node(self.start + position)
+
+    def __iter__(self):
+        for index in range(self.start, self.stop):
+            yield self.graph.node(index)
+
+
+# Random regular wiring for Jellyfish using the configuration model: every
+# free switch port becomes a stub, the shuffled stubs are paired up, and pairs
+# that would form a self-loop or a duplicate link go back into the pool for
+# another round. Whatever is left is repaired with the incremental edge swaps
+# of the Jellyfish paper (break a random link x-y and connect both ends to the
+# switch that still has free ports). The number of repair attempts is bounded,
+# so the generator always terminates; free_ports is updated in place and the
+# switches that still have free ports are returned alongside the links.
+def random_regular_links(free_ports, rng=random, pairing_rounds=8, max_repair_attempts=None):
+    num_switches = len(free_ports)
+    adjacency = [set() for _ in range(num_switches)]
+    links = []
+    link_position = {}
+
+    def connect(lnode, rnode):
+        link = (lnode, rnode) if lnode < rnode else (rnode, lnode)
+        link_position[link] = len(links)
+        links.append(link)
+        adjacency[lnode].add(rnode)
+        adjacency[rnode].add(lnode)
+        free_ports[lnode] -= 1
+        free_ports[rnode] -= 1
+
+    def disconnect(link):
+        # swap-remove so that picking a random link stays O(1)
+        position = link_position.pop(link)
+        last = links.pop()
+        if last != link:
+            links[position] = last
+            link_position[last] = position
+        adjacency[link[0]].discard(link[1])
+        adjacency[link[1]].discard(link[0])
+        free_ports[link[0]] += 1
+        free_ports[link[1]] += 1
+
+    stubs = [switch for switch in range(num_switches) for _ in range(free_ports[switch])]
+    for _ in range(pairing_rounds):
+        rng.shuffle(stubs)
+        rejected = []
+        for position in range(0, len(stubs) - 1, 2):
+            lnode, rnode = stubs[position], stubs[position + 1]
+            if lnode == rnode or rnode in adjacency[lnode]:
+                rejected.append(lnode)
+                rejected.append(rnode)
+            else:
+                connect(lnode, rnode)
+        if len(stubs) % 2:
+            rejected.append(stubs[-1])
+        if len(rejected) == len(stubs):
+            break
+        stubs = rejected
+
+    if max_repair_attempts is None:
+        max_repair_attempts = 100 * (len(stubs) + 1)
+    pending = [switch for switch in range(num_switches) if free_ports[switch] > 0]
+    attempts = 0
+    while pending and links and attempts < max_repair_attempts:
+        attempts += 1
+        switch = pending[-1]
+        if free_ports[switch] == 0:
+            pending.pop()
+            continue
+        if free_ports[switch] == 1:
+            # a single free port can only be filled together with another switch
+            partners = [other for other in pending if other != switch and free_ports[other] > 0]
+            if not partners:
+                break
+            other = rng.choice(partners)
+            if other not in adjacency[switch]:
+                connect(switch, other)
+                continue
+            lnode, rnode = links[rng.randrange(len(links))]
+            if rng.random() < 0.5:
+                lnode, rnode = rnode, lnode
+            if switch in (lnode, rnode) or other in (lnode, rnode) \
+                    or lnode in adjacency[switch] or rnode in adjacency[other]:
+                continue
+            disconnect((min(lnode, rnode), max(lnode, rnode)))
+            connect(switch, lnode)
+            connect(other, rnode)
+            continue
+        # two or more free ports: splice the switch into a random link
+        lnode, rnode = links[rng.randrange(len(links))]
+        if switch in (lnode, rnode) or lnode in adjacency[switch] or rnode in adjacency[switch]:
+            continue
+        disconnect((lnode, rnode))
+        connect(switch, lnode)
+        connect(switch, rnode)
+
+    unfilled = {switch: free_ports[switch] for switch in range(num_switches) if free_ports[switch] > 0}
+    return links, unfilled
 
-    def generate(self, num_servers, num_switches, num_ports):
 
-        # TODO: code for generating the jellyfish topology
-        server_dict = switch_dict = {}
-        available_ports = []
-        # generating all switches
-        for iterator in range(num_switches):
-            self.switches.append(Node("s" + str(iterator), "switch"))
-            switch_dict.update({"s" + str(iterator): Node("s" + str(iterator), "switch")})
-            available_ports.append(num_ports)
+class Jellyfish:
 
-        # generating all servers
+    def __init__(self, num_servers, num_switches, num_ports, seed=None, sink=None):
+        self.servers = []
+        self.switches = []
+        self.graph = None
+        self.unfilled_ports = {}
+        self.generate(num_servers, num_switches, num_ports, seed, sink)
+
+    @classmethod
+    def from_graph(cls, graph):
+        "Wraps a graph loaded from a topology file, without generating anything"
+        topology = cls.__new__(cls)
+        num_switches = graph.metadata["num_switches"]
+        topology.graph = graph
+        topology.switches = NodeList(graph, 0, num_switches)
+        topology.servers = NodeList(graph, num_switches, len(graph))
+        topology.unfilled_ports = {int(switch): ports
+                                   for switch, ports in graph.metadata.get("unfilled_ports", {}).items()}
+        return topology
+
+    def generate(self, num_servers, num_switches, num_ports, seed=None, sink=None):
+
+        # every server takes a switch port, so the switches must have enough of them
+        if num_servers > 0 and num_switches < 1:
+            raise ValueError("%d servers need at least one switch" % num_servers)
+        if num_servers > num_switches * num_ports:
+            raise ValueError("%d servers do not fit on %d switches with %d ports"
+                             % (num_servers, num_switches, num_ports))
+
+        # switches get the graph indices 0..num_switches-1, servers follow them
+        started = time.perf_counter()
+        rng = random.Random(seed)
+        available_ports = [num_ports] * num_switches
+        emit(sink, "jellyfish", "layer", "switch", num_switches)
+        emit(sink, "jellyfish", "layer", "server", num_servers)
+
+        lefts = array('i')
+        rights = array('i')
+
+        # link the servers with switches, spreading them round-robin over the switches
+        stage = time.perf_counter()
         for iterator in range(num_servers):
-            self.servers.append(Node("h" + str(iterator), "server"))
-            server_dict.update({"h" + str(iterator): Node("h" + str(iterator), "server")})
-
-        server_switch_ratio = num_servers // num_switches
-        print("-----------------------------------------")
-        print("Total servers count = ", num_servers)
-        print("Total switches count = ", num_switches)
-        print("Servers to switches ratio: ", server_switch_ratio)
-        print("-----------------------------------------")
-
-        # connecting each server with a switch or vice-versa
-        if num_switches < num_servers:
-            select_join_first = num_switches
-        else:
-            select_join_first = num_servers
-        # servers_iterated = 0
-            # link the servers with switches
-        for iterator in range(select_join_first):
-            switch_dict["s" + str(iterator)].edges.append(
-                switch_dict["s" + str(iterator)].add_edge(server_dict["h" + str(iterator)]))
-            print("Connected switch ", switch_dict["s" + str(iterator)].id, "to the host ",
-                  server_dict["h" + str(iterator)].id)
-            available_ports[iterator] -= 1
-            servers_iterated = iterator
-
-        # for balancing the server to switch count
-        if server_switch_ratio >= 1:
-            for iterator in range(server_switch_ratio):
-                switch_used_list = []
-                random_switch_chooser = 0
-                while random_switch_chooser in switch_used_list:
-                    random_switch_chooser = random.randint(0, num_switches)
-                switch_dict["s" + str(random_switch_chooser)].edges.append(
-                switch_dict["s" + str(random_switch_chooser)].add_edge(server_dict["h" + str(servers_iterated)]))
-                print("Connected switch ", switch_dict["s" + str(iterator)].id, "to the host ",
-                  server_dict["h" + str(servers_iterated)].id)
-                available_ports[random_switch_chooser] -= 1
-                # random_switch_chooser += 1
-                servers_iterated += 1
-                switch_used_list.append(random_switch_chooser)
-
-        # creating a set data-structure for links to avoid duplicates
-        joint_links = set()
-
-        # start randomly linking switches in case free-ports are available
-        num_of_switches_left = num_switches
-        repeated_random_check_failure = 0
-
-        while (num_of_switches_left > 1) and (repeated_random_check_failure < 5):
-            switch_left = random.randint(0, num_switches - 1)
-            # switch_left = random.randrange(0, num_switches)
-            # print("LS - ", switch_left)
-            switch_right = random.randint(0, num_switches - 1)
-            # print("RS - ", switch_right)
-            while switch_left == switch_right:
-                switch_right = random.randint(0, num_switches - 1)
-            if (switch_left, switch_right) in joint_links:
-                repeated_random_check_failure += 1
-            else:
-                repeated_random_check_failure = 0
-                joint_links.add((switch_left, switch_right))
-                joint_links.add((switch_right, switch_left))
-
-                # reducing the available ports from both switches by 1
-                available_ports[switch_left] -= 1
-                available_ports[switch_right] -= 1
-
-                # also reducing the total switches left to be operated if the open ports for any switch is 0
-                if (available_ports[switch_left] == 0) or (available_ports[switch_right] == 0):
-                    num_of_switches_left -= 1
-
-        if num_of_switches_left > 0:
-            for iterator in range(num_switches):
-                while available_ports[iterator] > 1:
-                    while True:
-                        random_link = random.choice(list(joint_links))
-                        # if current switch port is already listed in random link, ignore
-                        if (iterator, random_link[0]) in joint_links:
-                            continue
-                        if (iterator, random_link[1]) in joint_links:
-                            continue
-                        # else, remove the link, and add new link
-                        joint_links.remove(random_link)
-                        joint_links.remove(random_link[::-1])
-                        joint_links.add((iterator, random_link[0]))
-                        joint_links.add((random_link[0], iterator))
-                        joint_links.add((iterator, random_link[1]))
-                        joint_links.add((random_link[1], iterator))
-
-                        available_ports[iterator] -= 2
-
-                for each_link in joint_links:
-                    if each_link[0] < each_link[1]:
-                        switch_dict["s" + str(each_link[0])].edges.append(
-                            switch_dict["s" + str(each_link[0])].add_edge(switch_dict["s" + str(each_link[1])]))
-                        print("Connected switch ", switch_dict["s" + str(each_link[0])].id, "to the switch ",
-                              server_dict["s" + str(each_link[1])].id)
-                        # num_switches[each_link[0]], num_switches[each_link[1]])
+            switch = iterator % num_switches
+            lefts.append(switch)
+            rights.append(num_switches + iterator)
+            available_ports[switch] -= 1
+        emit(sink, "jellyfish", "links", "server", len(lefts), time.perf_counter() - stage)
+
+        # wire the remaining switch ports into a random regular graph
+        stage = time.perf_counter()
+        joint_links, self.unfilled_ports = random_regular_links(available_ports, rng)
+        for each_link in joint_links:
+            lefts.append(each_link[0])
+            rights.append(each_link[1])
+        emit(sink, "jellyfish", "links", "switch", len(joint_links), time.perf_counter() - stage)
+        if self.unfilled_ports:
+            emit(sink, "jellyfish", "unfilled", "switch", sum(self.unfilled_ports.values()))
+
+        stage = time.perf_counter()
+        types = bytearray(num_switches) + bytearray(b'\x01') * num_servers
+        self.graph = Graph.from_edges(types, ("switch", "server"), lefts, rights,
+                                      [(0, num_switches, "s", 0),
+                                       (num_switches, num_switches + num_servers, "h", 0)])
+        self.switches = NodeList(self.graph, 0, num_switches)
+        self.servers = NodeList(self.graph, num_switches, num_switches + num_servers)
+        emit(sink, "jellyfish", "graph", None, len(self.graph), time.perf_counter() - stage)
+        emit(sink, "jellyfish", "done", None, self.graph.num_edges(), time.perf_counter() - started)
 
 
 class Fattree:
 
-    def __init__(self, num_ports):
+    def __init__(self, num_ports, sink=None):
         self.servers = []
         self.switches = []
-        self.generate(num_ports)
-
-    def generate(self, num_ports):
-        # initialising the various counts in a fattree topology
-        # k = num_ports
-        print("--------------------------------------------------")
-        pod_count = num_ports
-        each_type_switches_in_pod = num_ports // 2
-        core_layer_switch_count = (num_ports // 2) ** 2
-        print("Total core switches used in this topology: ", core_layer_switch_count)
-        aggregation_layer_switch_count = num_ports * (num_ports // 2)
-        print("Total aggregation switches used in this topology: ", aggregation_layer_switch_count)
-        edge_layer_switch_count = num_ports * (num_ports // 2)
-        print("Total edge switches used in this topology: ", edge_layer_switch_count)
-        total_servers_count = num_ports * ((num_ports // 2) ** 2)
-        print("Total number of hosts used in this topology: ", total_servers_count)
-        total_switch_count = core_layer_switch_count + aggregation_layer_switch_count + edge_layer_switch_count
-        print("Total switches used in this topology: ", total_switch_count)
-        print("--------------------------------------------------")
-        edge_switch_list = aggregation_switch_list = core_switch_list = server_list = {}
-        # creating dictionary above for storing mapping
-        current_switch_count = 0
-        current_server_count = 0
-
-        edge_start_index = 0
-        edge_end_index = 0
-        aggregator_start_index = 0
-        aggregator_end_index = 0
-        core_start_index = 0
-        core_end_index = 0
+        self.graph = None
+        self.index = None
+        self.generate(num_ports, sink)
+
+    @classmethod
+    def from_graph(cls, graph):
+        "Wraps a graph loaded from a topology file, without generating anything"
+        topology = cls.__new__(cls)
+        topology.index = FattreeIndex(graph.metadata["num_ports"])
+        topology.graph = graph
+        topology.switches = NodeList(graph, 0, topology.index.host_start)
+        topology.servers = NodeList(graph, topology.index.host_start, len(graph))
+        return topology
+
+    def generate(self, num_ports, sink=None):
+        # the counts, addresses and wiring of a fat-tree are all closed-form
+        started = time.perf_counter()
+        index = FattreeIndex(num_ports)
+        self.index = index
+        for layer in (EDGE, AGGREGATION, CORE):
+            emit(sink, "fattree", "layer", LAYER_NAMES[layer], len(index.switches(layer)))
+        emit(sink, "fattree", "layer", LAYER_NAMES[HOST], index.num_hosts)
 
         # few interesting properties to consider
         # Each edge switch connects to (k/2) nodes and k/2 aggregation switches within same pod
         # Each aggregation switch connects to (k/2) edge switches from same pod, and k/2 core switches
-        # Each core switch connects to only one aggregation switch (randomly, first for simplicity) in a given pod
-
-        # creating edge switches
-        edge_start_index = 0
-        for iterator in range(edge_layer_switch_count):
-            # edge_switch_list.append("s" + str(iterator))
-            current_switch_count += 1
-            self.switches.append(Node("s" + str(current_switch_count), "edge"))
-            edge_switch_list.update({"edge" + str(iterator): Node("s" + str(current_switch_count), "edge")})
-            print("Edge switch", current_switch_count)
-        edge_end_index = len(self.switches) - 1
-
-        aggregator_start_index = len(self.switches)
-        # creating aggregation switches
-        for iterator in range(1, aggregation_layer_switch_count + 1):
-            # edge_switch_list.append("s" + str(iterator))
-            current_switch_count += 1
-            self.switches.append(Node("s" + str(current_switch_count), "aggregator"))
-            aggregation_switch_list.update(
-                {"aggregator" + str(iterator): Node("s" + str(current_switch_count), "aggregator")})
-
-            print("Aggregator switch ", current_switch_count)
-        aggregator_end_index = len(self.switches) - 1
-
-
-        # creating core switches
-        core_start_index = len(self.switches)
-        for iterator in range(1, core_layer_switch_count + 1):
-            # core_switch_list.append("s" + str(iterator))
-            current_switch_count += 1
-            self.switches.append(Node("s" + str(current_switch_count), "core"))
-            core_switch_list.update({"core" + str(iterator): Node("s" + str(current_switch_count), "core")})
-
-            print("Core switch ", current_switch_count)
-        core_end_index = len(self.switches) - 1
-
-        # creating hosts
-        for host_iterator in range(total_servers_count):
-            current_server_count += 1
-            server_list.update({"host" + str(host_iterator): Node("h" + str(current_server_count), "host")})
-            self.servers.append(Node("h" + str(current_server_count), "host"))
-
-            print("Host ", current_server_count)
-
-        current_server_count = 1
-        temp_server = Node(current_switch_count,"host")
-        temp_switch = Node(current_switch_count,"switches")
-        # iterating the edge switches and adding link with hosts first
-        for iterator in range(1, edge_layer_switch_count + 1):
-
-            for host_iterator in range(current_server_count, current_server_count + (num_ports // 2)):
-                edge_switch_list["edge" + str(iterator - 1)].edges.append(
-                    edge_switch_list["edge" + str(iterator - 1)].add_edge(server_list["host" + str(host_iterator - 1)]))
-                edge_switch_list["edge" + str(iterator - 1)].add_edge(server_list["host" + str(host_iterator - 1)])
-                # for i in range(len(self.servers)):
-                #     if self.servers[i] == server_list["host" + str(host_iterator - 1)]:
-                #         temp_server = self.servers[i]
-                #         print("Matching host found!")
-                #         break
-                # for i in range(len(self.switches)):
-                #     if self.switches[i] == edge_switch_list["edge" + str(iterator - 1)]:
-                #         temp_switch = self.switches[i]
-                #         print("Matching switch found!")
-                #         break
-                # temp_switch.add_edge(temp_server)
-                #temp_switch.
-                print("Connected edge switch ", edge_switch_list["edge" + str(iterator - 1)].id, "to the host ",
-                      server_list["host" + str(host_iterator - 1)].id)
-                current_server_count += 1
-
-        current_pod = 0
-        # print("Switch Count ", current_switch_count)
-
-        # iterating the aggregator switches and adding links with edge switches and core switches
-        for iterator in range(1, aggregation_layer_switch_count + 1):
-
-            # link edge switches
-            for edge_iterator in range(current_pod * (num_ports // 2),
-                                       (current_pod * (num_ports // 2)) + (num_ports // 2)):
-                aggregation_switch_list["aggregator" + str(iterator)].edges.append(
-                    aggregation_switch_list["aggregator" + str(iterator)].add_edge(
-                        edge_switch_list["edge" + str(edge_iterator)]))
-                # for i in range(len(self.switches)):
-                #     if self.switches[i] == aggregation_switch_list["aggregator" + str(iterator)]:
-                #         temp_server = self.switches[i]
-                #         print("Matching aggregation switch found!")
-                #     if self.switches[i] == edge_switch_list["edge" + str(edge_iterator)]:
-                #         temp_switch = self.switches[i]
-                #         print("Matching edge switch found!")
-                # temp_switch.add_edge(temp_server)
-                print("Connected aggregator switch ", aggregation_switch_list["aggregator" + str(iterator)].id,
-                      "to the edge switch ",
-                      edge_switch_list["edge" + str(edge_iterator)].id)
-            if iterator % (num_ports // 2) == 0:
-                current_pod += 1
-                # print("POD ", current_pod)
-
-            # link core switches
-            core_aggregate_connection = 0  # checks for the k/2 connections between core and aggregator
-            for core_iterator in range(((iterator - 1) * num_ports // 2) % (core_layer_switch_count),
-                                       core_layer_switch_count):
-                # ((iterator) * (num_ports // 2)) % (core_layer_switch_count)):
-
-                aggregation_switch_list["aggregator" + str(iterator)].edges.append(
-                    aggregation_switch_list["aggregator" + str(iterator)].add_edge(
-                        core_switch_list["core" + str(core_iterator + 1)]))
-                # for i in range(len(self.switches)):
-                #     if self.switches[i] == aggregation_switch_list["aggregator" + str(iterator)]:
-                #         temp_server = self.switches[i]
-                #         print("Matching aggregation switch found!")
-                #     if self.switches[i] == core_switch_list["core" + str(core_iterator + 1)]:
-                #         temp_switch = self.switches[i]
-                #         print("Matching core switch found!")
-                # temp_switch.add_edge(temp_server)
-                print("Connected aggregator switch ", aggregation_switch_list["aggregator" + str(iterator)].id,
-                      "to the core switch ",
-                      core_switch_list["core" + str(core_iterator + 1)].id)
-                core_aggregate_connection += 1
-                if (core_aggregate_connection == num_ports // 2):
-                    break;
-            # print("POD ", current_pod)
+        # Each core switch connects to only one aggregation switch in a given pod
+
+        # graph indices are the FattreeIndex node indices: edge, aggregation, core switches, then hosts
+        types = bytearray(index.num_edge) \
+            + bytearray([AGGREGATION]) * index.num_aggregation \
+            + bytearray([CORE]) * index.num_core \
+            + bytearray([HOST]) * index.num_hosts
+
+        stage = time.perf_counter()
+        lefts = array('i')
+        rights = array('i')
+        for upper, lower in index.links():
+            lefts.append(upper)
+            rights.append(lower)
+        emit(sink, "fattree", "links", None, len(lefts), time.perf_counter() - stage)
+
+        # switches are named s1.. (their DPID) and hosts h1.. as before
+        stage = time.perf_counter()
+        self.graph = Graph.from_edges(types, LAYER_NAMES, lefts, rights,
+                                      [(0, index.host_start, "s", 1),
+                                       (index.host_start, index.num_nodes, "h", 1)])
+        self.switches = NodeList(self.graph, 0, index.host_start)
+        self.servers = NodeList(self.graph, index.host_start, index.num_nodes)
+        emit(sink, "fattree", "graph", None, len(self.graph), time.perf_counter() - stage)
+        emit(sink, "fattree", "done", None, self.graph.num_edges(), time.perf_counter() - started)
+
+
+def save_topology(topology, path):
+    "Writes a Fattree or Jellyfish to a binary topology file, see Graph.save"
+    # the topology's own graph is left as it is
+    graph = topology.graph
+    addresses = None
+    if isinstance(topology, Fattree):
+        index = topology.index
+        metadata = {"topology": "fattree", "num_ports": index.k, "num_switches": index.num_switches}
+        if graph.addresses is None:
+            addresses = array('I', (address_value(index.address(node)) for node in range(index.num_nodes)))
+    else:
+        metadata = {"topology": "jellyfish", "num_switches": len(topology.switches),
+                    "unfilled_ports": {str(switch): ports for switch, ports in topology.unfilled_ports.items()}}
+    graph.save(path, metadata, addresses)
+
+
+def load_topology(path):
+    "Returns the Fattree or Jellyfish stored in a binary topology file, memory-mapped"
+    graph = Graph.load(path)
+    kind = graph.metadata.get("topology")
+    if kind == "fattree":
+        return Fattree.from_graph(graph)
+    if kind == "jellyfish":
+        return Jellyfish.from_graph(graph)
+    raise ValueError("%s holds an unknown topology %r" % (path, kind))
 
 
 # https://reproducingnetworkresearch.wordpress.com/2014/06/03/cs244-14-jellyfish-networking-data-centers-randomly/
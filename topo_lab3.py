@@ -18,12 +18,16 @@
 import sys
 import random
 import queue
+import time
 # import topo
 from queue import PriorityQueue
 import networkx as nx
 import matplotlib.pyplot as plot
 import numpy as npy
 
+from fattree_index import FattreeIndex, LAYER_NAMES, EDGE, AGGREGATION, CORE, HOST
+from topo import random_regular_links, emit, print_sink
+
 nodes_jf = []
 nodes_ft = []
 edges_jf = []
@@ -176,18 +180,18 @@ class Node:
 
 class Jellyfish:
 
-    def __init__(self, num_servers, num_switches, num_ports):
+    def __init__(self, num_servers, num_switches, num_ports, seed=None, sink=None):
         self.servers = []
         self.switches = []
         self.server_dict = {}
         self.switch_dict = {}
         self.jf_edge_set = set()
-        self.generate(num_servers, num_switches, num_ports)
-
-    def generate(self, num_servers, num_switches, num_ports):
+        self.unfilled_ports = {}
+        self.generate(num_servers, num_switches, num_ports, seed, sink)
 
-        # TODO: code for generating the jellyfish topology
+    def generate(self, num_servers, num_switches, num_ports, seed=None, sink=None):
 
+        started = time.perf_counter()
         available_ports = []
         # generating all switches
         for iterator in range(num_switches):
@@ -201,11 +205,9 @@ class Jellyfish:
             self.server_dict.update({"h" + str(iterator): Node("h" + str(iterator), "server")})
 
         server_switch_ratio = num_servers // num_switches
-        print("-----------------------------------------")
-        print("Total servers count = ", num_servers)
-        print("Total switches count = ", num_switches)
-        print("Servers to switches ratio: ", server_switch_ratio)
-        print("-----------------------------------------")
+        emit(sink, "jellyfish", "layer", "switch", num_switches)
+        emit(sink, "jellyfish", "layer", "server", num_servers)
+        stage = time.perf_counter()
 
         # connecting each server with a switch or vice-versa
         if num_switches < num_servers:
@@ -218,8 +220,6 @@ class Jellyfish:
             temp_edge = self.switch_dict["s" + str(iterator)].add_edge(self.server_dict["h" + str(iterator)])
             self.switch_dict["s" + str(iterator)].edges.append(temp_edge)
             self.jf_edge_set.add((temp_edge.lnode.id, temp_edge.rnode.id))
-            print("Connected switch ", self.switch_dict["s" + str(iterator)].id, "to the host ",
-                  self.server_dict["h" + str(iterator)].id)
             available_ports[iterator] -= 1
             servers_iterated = iterator
             servers_remaining = num_servers - servers_iterated
@@ -244,76 +244,29 @@ class Jellyfish:
                             self.server_dict["h" + str(servers_iterated)])
                         self.switch_dict["s" + str(switch_iterator)].edges.append(temp_edge)
                         self.jf_edge_set.add((temp_edge.lnode.id, temp_edge.rnode.id))
-                        print("In ramdom: Connected switch ", self.switch_dict["s" + str(switch_iterator)].id, "to the host ",
-                            self.server_dict["h" + str(servers_iterated)].id)
                         available_ports[switch_iterator] -= 1
                     # random_switch_chooser += 1
                     servers_iterated += 1
                     # switch_used_list.append(random_switch_chooser)
 
-        # creating a set data-structure for links to avoid duplicates
-        joint_links = set()
-
-        # start randomly linking switches in case free-ports are available
-        num_of_switches_left = num_switches
-        repeated_random_check_failure = 0
-
-        # check if there are 10 hits with similar switches already linked, then exit
-        while (num_of_switches_left > 1) and (repeated_random_check_failure < 10):
-            switch_left = random.randint(0, num_switches - 1)
-            # switch_left = random.randrange(0, num_switches)
-            # print("LS - ", switch_left)
-            switch_right = random.randint(0, num_switches - 1)
-            # print("RS - ", switch_right)
-            while switch_left == switch_right:
-                switch_right = random.randint(0, num_switches - 1)
-            if (switch_left, switch_right) in joint_links:
-                repeated_random_check_failure += 1
-            else:
-                repeated_random_check_failure = 0
-                joint_links.add((switch_left, switch_right))
-                joint_links.add((switch_right, switch_left))
-
-                # reducing the available ports from both switches by 1
-                available_ports[switch_left] -= 1
-                available_ports[switch_right] -= 1
-
-                # also reducing the total switches left to be operated if the open ports for any switch is 0
-                if (available_ports[switch_left] == 0) or (available_ports[switch_right] == 0):
-                    num_of_switches_left -= 1
-
-        if num_of_switches_left > 0:
-            for iterator in range(num_switches):
-                while available_ports[iterator] > 1:
-                    while True:
-                        random_link = random.choice(list(joint_links))
-                        # if current switch port is already listed in random link, ignore
-                        if (iterator, random_link[0]) in joint_links:
-                            continue
-                        if (iterator, random_link[1]) in joint_links:
-                            continue
-                        # else, remove the link, and add new link
-                        joint_links.remove(random_link)
-                        joint_links.remove(random_link[::-1])
-                        joint_links.add((iterator, random_link[0]))
-                        joint_links.add((random_link[0], iterator))
-                        joint_links.add((iterator, random_link[1]))
-                        joint_links.add((random_link[1], iterator))
-                        available_ports[iterator] -= 2
-
-            for each_link in joint_links:
-                if each_link[0] < each_link[1]:
-                    temp_edge = self.switch_dict["s" + str(each_link[0])].add_edge(
-                        self.switch_dict["s" + str(each_link[1])])
-                    self.switch_dict["s" + str(each_link[0])].edges.append(temp_edge)
-                    print("Connected switch ", self.switch_dict["s" + str(each_link[0])].id, "to the switch ",
-                          self.switch_dict["s" + str(each_link[1])].id)
-                    self.jf_edge_set.add((temp_edge.lnode.id, temp_edge.rnode.id))
+        emit(sink, "jellyfish", "links", "server", len(self.jf_edge_set), time.perf_counter() - stage)
+
+        # wire the remaining switch ports into a random regular graph
+        stage = time.perf_counter()
+        joint_links, self.unfilled_ports = random_regular_links(available_ports, random.Random(seed))
+        for each_link in joint_links:
+            temp_edge = self.switch_dict["s" + str(each_link[0])].add_edge(
+                self.switch_dict["s" + str(each_link[1])])
+            self.jf_edge_set.add((temp_edge.lnode.id, temp_edge.rnode.id))
+        emit(sink, "jellyfish", "links", "switch", len(joint_links), time.perf_counter() - stage)
+        if self.unfilled_ports:
+            emit(sink, "jellyfish", "unfilled", "switch", sum(self.unfilled_ports.values()))
+        emit(sink, "jellyfish", "done", None, len(self.jf_edge_set), time.perf_counter() - started)
 
 
 class Fattree:
 
-    def __init__(self, num_ports):
+    def __init__(self, num_ports, sink=None):
         self.servers = []
         self.switches = []
         self.edge_switch_list = {}
@@ -321,162 +274,51 @@ class Fattree:
         self.core_switch_list = {}
         self.server_list = {}
         self.fat_edge_set = set()
-        self.generate(num_ports)
-
-    def generate(self, num_ports):
-        # initialising the various counts in a fattree topology
-        # k = num_ports
-        print("--------------------------------------------------")
-        pod_count = num_ports
-        each_type_switches_in_pod = num_ports // 2
-        core_layer_switch_count = (num_ports // 2) ** 2
-        print("Total core switches used in this topology: ", core_layer_switch_count)
-        aggregation_layer_switch_count = num_ports * (num_ports // 2)
-        print("Total aggregation switches used in this topology: ", aggregation_layer_switch_count)
-        edge_layer_switch_count = num_ports * (num_ports // 2)
-        print("Total edge switches used in this topology: ", edge_layer_switch_count)
-        total_servers_count = num_ports * ((num_ports // 2) ** 2)
-        print("Total number of hosts used in this topology: ", total_servers_count)
-        total_switch_count = core_layer_switch_count + aggregation_layer_switch_count + edge_layer_switch_count
-        print("Total switches used in this topology: ", total_switch_count)
-        print("--------------------------------------------------")
-        # self.edge_switch_list = self.aggregation_switch_list = self.core_switch_list = self.server_list = {}
-        # creating dictionary above for storing mapping
-        current_switch_count = 0
-        current_server_count = 0
+        self.generate(num_ports, sink)
+
+    def generate(self, num_ports, sink=None):
+        # the counts, addresses and wiring of a fat-tree are all closed-form
+        started = time.perf_counter()
+        index = FattreeIndex(num_ports)
 
         # few interesting properties to consider
         # Each edge switch connects to (k/2) nodes and k/2 aggregation switches within same pod
         # Each aggregation switch connects to (k/2) edge switches from same pod, and k/2 core switches
-        # Each core switch connects to only one aggregation switch (randomly, first for simplicity) in a given pod
-
-        i = 0 # pod-count
-        j = 0 # switch-count
-        # creating edge switches
-        for iterator in range(edge_layer_switch_count):
-            # self.edge_switch_list.append("s" + str(iterator))
-            self.switches.append("s" + str(current_switch_count))
-            if ((iterator % (num_ports // 2)) == 0 and iterator != 0):
-                i += 1
-                j = 0
-            elif iterator != 0:
-                j += 1
-            self.edge_switch_list.update({"edge" + str(iterator): Node("s" + str(current_switch_count),
-                                                            "10."+str(i)+"."+str(j)+".1")})
-            print("Edge switch", current_switch_count,
-                  "; IP-Address = ",self.edge_switch_list["edge" + str(iterator)].type)
-
-            current_switch_count += 1
-
-        i = 0  # pod-count
-        j = 0  # switch-count
-        # creating aggregation switches
-        for iterator in range(aggregation_layer_switch_count):
-            # self.edge_switch_list.append("s" + str(iterator))
-            self.switches.append("s" + str(current_switch_count))
-            if ((iterator % (num_ports // 2)) == 0 and iterator != 0):
-                i += 1
-                j = (num_ports//2)
-            elif iterator != 0:
-                j += 1
-            else:
-                j = (num_ports // 2)
-            self.aggregation_switch_list.update(
-                {"aggregator" + str(iterator): Node("s" + str(current_switch_count),
-                                                            "10."+str(i)+"."+str(j)+".1")})
-            print("Aggregator switch ", current_switch_count,
-                  "; IP-Address = ",self.aggregation_switch_list["aggregator" + str(iterator)].type)
-            current_switch_count += 1
-
-        i = 0 # core's ith position for ip-address
-        j = 1 # core's jth position for ip-address
-        # creating core switches
-        for iterator in range(0, core_layer_switch_count):
-            # self.core_switch_list.append("s" + str(iterator))
-            self.switches.append("s" + str(current_switch_count))
-            if ((iterator) % (num_ports // 2) == 0):
-                i += 1
-                j = 1
-            self.core_switch_list.update({"core" + str(iterator): Node("s" + str(current_switch_count),
-                                                                       "10."+str(num_ports)+"."+str(i)+"."+str(j))})
-            print("Core switch ", current_switch_count, "; IP-Address = ",self.core_switch_list["core" + str(iterator)].type)
-
-            j += 1
-            current_switch_count += 1
-
-        i = 0 # pod-count
-        j = 0 # switch-count
-        k = 2 # host-count, always start with 2 (as ip-octet value 1 is occupied by switch)
-        # creating hosts
-        for host_iterator in range(total_servers_count):
-            if (host_iterator % num_ports == 0 and host_iterator != 0):
-                i += 1
-                j = 0
-                k = 2
-            elif ((host_iterator % (num_ports//2)) == 0 and host_iterator != 0):
-                j += 1
-                k = 2
-
-            self.server_list.update({"host" + str(host_iterator): Node("s" + str(current_switch_count),
-                                                 "10."+str(i)+"."+str(j)+"."+str(k))})
-            self.servers.append("h" + str(current_server_count))
-            print("Host ", current_server_count, "; IP-Address = ",self.server_list["host" + str(host_iterator)].type)
-            k += 1
-            current_server_count += 1
-
-        current_server_count = 0
-
-        # iterating the edge switches and adding link with hosts first
-        for iterator in range(0, edge_layer_switch_count):
-
-            for host_iterator in range(current_server_count, current_server_count + (num_ports // 2)):
-                temp_edge = self.edge_switch_list["edge" + str(iterator)].add_edge(
-                    self.server_list["host" + str(host_iterator)])
-                self.edge_switch_list["edge" + str(iterator)].edges.append(temp_edge)
-                self.fat_edge_set.add((temp_edge.lnode.id, temp_edge.rnode.id))
-                # print("Connected edge switch ", self.edge_switch_list["edge" + str(iterator)].id, "to the host ",
-                #       self.server_list["host" + str(host_iterator)].id)
-                current_server_count += 1
-
-        current_pod = 0
-        # print("Switch Count ", current_switch_count)
-
-        # iterating the aggregator switches and adding links with edge switches and core switches
-        for iterator in range(0, aggregation_layer_switch_count):
-
-            self.aggregation_switch_list.update({"aggregator" + str(iterator): Node("s" + str(current_switch_count), "aggregator")})
-
-            # print("POD ", current_pod)
-            if iterator % (num_ports // 2) == 0 and iterator != 0:
-                current_pod += 1
-                print("POD ", current_pod)
-
-            # link edge switches
-            for edge_iterator in range(current_pod * (num_ports // 2),
-                                       (current_pod * (num_ports // 2)) + (num_ports // 2)):
-                temp_edge = self.aggregation_switch_list["aggregator" + str(iterator)].add_edge(
-                    self.edge_switch_list["edge" + str(edge_iterator)])
-                self.aggregation_switch_list["aggregator" + str(iterator)].edges.append(temp_edge)
-                # print("Connected aggregator switch ", self.aggregation_switch_list["aggregator" + str(iterator)].id,
-                #       "to the edge switch ",
-                #       self.edge_switch_list["edge" + str(edge_iterator)].id)
-                self.fat_edge_set.add((temp_edge.lnode.id, temp_edge.rnode.id))
-
-            # link core switches
-            core_aggregate_connection = 0  # checks for the k/2 connections between core and aggregator
-            for core_iterator in range((iterator * num_ports // 2) % core_layer_switch_count,
-                                       core_layer_switch_count):
-                # ((iterator) * (num_ports // 2)) % (core_layer_switch_count)):
-                temp_edge = self.aggregation_switch_list["aggregator" + str(iterator)].add_edge(
-                    self.core_switch_list["core" + str(core_iterator)])
-                self.aggregation_switch_list["aggregator" + str(iterator)].edges.append(temp_edge)
-                # print("Connected aggregator switch ", self.aggregation_switch_list["aggregator" + str(iterator)].id,
-                #       "to the core switch ",
-                #       self.core_switch_list["core" + str(core_iterator)].id)
-                self.fat_edge_set.add((temp_edge.lnode.id, temp_edge.rnode.id))
-                core_aggregate_connection += 1
-                if core_aggregate_connection == num_ports // 2:
-                    break;
+        # Each core switch connects to only one aggregation switch in a given pod
+
+        # nodes keep their IP-address in the type field
+        nodes = {}
+        for node in index.switches(EDGE):
+            nodes[node] = Node(index.name(node), index.address(node))
+            self.edge_switch_list["edge" + str(index.offset(node))] = nodes[node]
+            self.switches.append(index.name(node))
+        emit(sink, "fattree", "layer", LAYER_NAMES[EDGE], index.num_edge)
+
+        for node in index.switches(AGGREGATION):
+            nodes[node] = Node(index.name(node), index.address(node))
+            self.aggregation_switch_list["aggregator" + str(index.offset(node))] = nodes[node]
+            self.switches.append(index.name(node))
+        emit(sink, "fattree", "layer", LAYER_NAMES[AGGREGATION], index.num_aggregation)
+
+        for node in index.switches(CORE):
+            nodes[node] = Node(index.name(node), index.address(node))
+            self.core_switch_list["core" + str(index.offset(node))] = nodes[node]
+            self.switches.append(index.name(node))
+        emit(sink, "fattree", "layer", LAYER_NAMES[CORE], index.num_core)
+
+        for node in index.hosts():
+            nodes[node] = Node(index.name(node), index.address(node))
+            self.server_list["host" + str(index.offset(node))] = nodes[node]
+            self.servers.append(index.name(node))
+        emit(sink, "fattree", "layer", LAYER_NAMES[HOST], index.num_hosts)
+
+        # hosts below edge switches first, then edge and core switches of every aggregator
+        stage = time.perf_counter()
+        for upper, lower in index.links():
+            temp_edge = nodes[upper].add_edge(nodes[lower])
+            self.fat_edge_set.add((temp_edge.lnode.id, temp_edge.rnode.id))
+        emit(sink, "fattree", "links", None, len(self.fat_edge_set), time.perf_counter() - stage)
+        emit(sink, "fattree", "done", None, len(self.fat_edge_set), time.perf_counter() - started)
 
 
 # https://reproducingnetworkresearch.wordpress.com/2014/06/03/cs244-14-jellyfish-networking-data-centers-randomly/
@@ -492,7 +334,7 @@ while (True):
         continue
     else:
         break
-print(Fattree(switch_port))
+print(Fattree(switch_port, sink=print_sink))
 # # calculate the number of servers and switches used for generating the fattree topology, using same number of switch port (k)
 # num_servers = (switch_port ** 3) // 4  # (K^3)/4, where k = switch port count in a switch
 # num_switches = 5 * (switch_port ** 2) // 4  # 5*(k^2)/4, where k = switch port count in a switch